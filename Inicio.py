@@ -1,61 +1,33 @@
 import streamlit as st
-import pandas as pd
 import os
-import re
 from PIL import Image
-
-def load_patient_database():
-    try:
-        df = pd.read_csv("../patient_database.csv")
-        return df
-    except FileNotFoundError:
-        st.error("Patient database file not found.")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Error loading database: {str(e)}")
-        return pd.DataFrame()
+import patient_store
+import report_manifest
 
 
 def get_recent_reports(n=5):
-    reports_dir = "reports"
-    if not os.path.exists(reports_dir):
-        return []
-
-    reports = [f for f in os.listdir(reports_dir) if f.endswith('.docx')]
-    reports.sort(key=lambda x: os.path.getmtime(os.path.join(reports_dir, x)), reverse=True)
-    return reports[:n]
-
-
-def extract_days(hospitalization_time):
-    match = re.search(r'(\d+)', hospitalization_time)
-    return int(match.group(1)) if match else 0
+    return report_manifest.latest_reports(n)
 
 
-def calculate_stats(df):
+def calculate_stats(aggregates):
     stats = {
-        "Número total de registros": len(df),
+        "Número total de registros": 0,
         "Tiempo promedio de hospitalización (días)": "N/A",
         "Pacientes actualmente hospitalizados": "N/A",
         "Diagnósticos más comunes": "N/A"
     }
 
-    if not df.empty:
-        if 'Días de hospitalización' in df.columns:
-            # Extract the number of days from the string
-            df['Hospitalization Days'] = df['Días de hospitalización'].apply(extract_days)
-
-            # Calculate average hospitalization time
-            avg_time = df['Hospitalization Days'].mean()
-            stats["Tiempo promedio de hospitalización (días)"] = f"{avg_time:.1f}"
-
-            # Count of currently hospitalized patients (assuming they're hospitalized if days > 0)
-            current_patients = (df['Hospitalization Days'] > 0).sum()
-            stats["Pacientes actualmente hospitalizados"] = current_patients
-
-        # Most common diagnoses
-        if 'Diagnostico' in df.columns:
-            top_diagnoses = df['Diagnostico'].value_counts().head(3)
-            stats["Diagnósticos más comunes"] = ", ".join(f"{diag} ({count})" for diag, count in top_diagnoses.items())
+    # The aggregates are kept up to date by every write to the store, see dashboard_stats
+    if aggregates and aggregates["records"]:
+        stats["Número total de registros"] = aggregates["records"]
+        if aggregates["average_days"] is not None:
+            # Stays computed from the admission and discharge dates, see census
+            stats["Tiempo promedio de hospitalización (días)"] = f"{aggregates['average_days']:.1f}"
+        # Patients whose Estado is "Activo" in Listado de pacientes
+        stats["Pacientes actualmente hospitalizados"] = aggregates["inpatients"]
+        if aggregates["top_diagnoses"]:
+            stats["Diagnósticos más comunes"] = ", ".join(
+                f"{diag} ({count})" for diag, count in aggregates["top_diagnoses"])
 
     return stats
 
@@ -75,11 +47,8 @@ def main():
 
     st.title("Sistema electrónico Neurocirugía Curicó")
 
-    # Load patient database
-    df = load_patient_database()
-
     # Calculate and display statistics
-    stats = calculate_stats(df)
+    stats = calculate_stats(patient_store.load_dashboard_stats())
     st.subheader("Estadísticas de la base de datos")
     for metric, value in stats.items():
         st.metric(label=metric, value=value)
@@ -0,0 +1,101 @@
+from datetime import date
+
+import pandas as pd
+
+EPOCH = pd.Timestamp("1970-01-01")
+
+# Sums kept by stay_totals; adding or subtracting them for a set of rows keeps the averages exact
+STAY_TOTALS = ["records", "active", "active_dated", "active_admission_days", "closed_dated", "closed_stay_days"]
+
+
+def _today(today=None):
+    return pd.Timestamp(today if today is not None else date.today()).normalize()
+
+
+def _dates(df, column):
+    if column not in df.columns:
+        return pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    values = df[column]
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        values = pd.to_datetime(values, errors="coerce")
+    return values.dt.normalize()
+
+
+def _status(df):
+    # Rows saved without a status are active, as the store reads them
+    if "Estado" not in df.columns:
+        return pd.Series("Activo", index=df.index, dtype="string")
+    return df["Estado"].astype("string").fillna("Activo")
+
+
+def _antibiotic_given(df, number):
+    column = f"Antibiótico {number}"
+    if column not in df.columns:
+        return pd.Series(False, index=df.index)
+    names = df[column].astype("string").str.strip()
+    return (names.notna() & ~names.isin(["", "Ninguno"])).fillna(False).astype(bool)
+
+
+def census_days(df, today=None):
+    """
+    Stay length, antibiotic days and discharge status of every patient in one vectorized pass.
+
+    Stays of hospitalized patients run until today and those of discharged patients until their "Fecha de alta";
+    antibiotic days count the first day, as the Registro clínico form does.
+
+    :param df: Patients with typed date columns; missing columns count as empty
+    :param today: Optional; the day the census is computed for
+    :return: DataFrame aligned with df with "Hospitalizado" (bool), "Días de hospitalización",
+             "Días de antibiótico 1" and "Días de antibiótico 2" (Int64, missing when the dates are unknown)
+    """
+    today = _today(today)
+    status = _status(df)
+    discharged = status == "Alta"
+    end = _dates(df, "Fecha de alta").where(discharged, today)
+
+    result = pd.DataFrame({
+        "Hospitalizado": (status == "Activo").astype(bool),
+        "Días de hospitalización": (end - _dates(df, "Fecha de ingreso")).dt.days.astype("Int64"),
+    }, index=df.index)
+    for number in (1, 2):
+        days = (end - _dates(df, f"Fecha de inicio Antibiotico {number}")).dt.days + 1
+        result[f"Días de antibiótico {number}"] = days.where(_antibiotic_given(df, number)).astype("Int64")
+    return result
+
+
+def format_days(days):
+    """Day counts as the "12 días" text used by the reports, "N/A" where unknown."""
+    return (days.astype("string") + " días").fillna("N/A")
+
+
+def stay_totals(df):
+    """
+    Additive sums of a set of patients from which average_stay computes their average stay on any later day.
+
+    Active stays grow every day, so instead of their length the sum of their admission days is kept.
+    """
+    status = _status(df)
+    active = status == "Activo"
+    closed = status == "Alta"
+    admission = (_dates(df, "Fecha de ingreso") - EPOCH).dt.days
+    discharge = (_dates(df, "Fecha de alta") - EPOCH).dt.days
+    active_dated = active & admission.notna()
+    closed_dated = closed & admission.notna() & discharge.notna()
+    return {
+        "records": len(df),
+        "active": int(active.sum()),
+        "active_dated": int(active_dated.sum()),
+        "active_admission_days": int(admission[active_dated].sum()),
+        "closed_dated": int(closed_dated.sum()),
+        "closed_stay_days": int((discharge - admission)[closed_dated].sum()),
+    }
+
+
+def average_stay(totals, today=None):
+    """Average stay in days of the patients summed up in totals, or None if none has known dates."""
+    dated = totals["active_dated"] + totals["closed_dated"]
+    if not dated:
+        return None
+    today_days = (_today(today) - EPOCH).days
+    active_days = totals["active_dated"] * today_days - totals["active_admission_days"]
+    return (active_days + totals["closed_stay_days"]) / dated
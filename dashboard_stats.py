@@ -0,0 +1,159 @@
+import os
+import sqlite3
+from collections import Counter
+from contextlib import closing
+
+import pandas as pd
+
+import census
+from rut import rut_keys
+
+# Bumped whenever the tables change; older aggregates are dropped and rebuilt from the store
+SCHEMA_VERSION = 2
+# The store columns each row contributes to the aggregates, and where they are kept
+STATS_COLUMNS = {"Estado": "estado", "Fecha de ingreso": "admission", "Fecha de alta": "discharge",
+                 "Diagnostico": "diagnosis"}
+# RUTs bound per query when reading contributions; older SQLite builds accept at most 999 parameters
+MAX_PARAMETERS = 900
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        for table in ("totals", "contributions", "diagnoses"):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    columns = ", ".join(f"{name} INTEGER" for name in census.STAY_TOTALS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS totals ({columns})")
+    # The fields of each row of the store, so a rewrite of a patient can take its old values back out
+    conn.execute("CREATE TABLE IF NOT EXISTS contributions "
+                 "(rut_key TEXT, estado TEXT, admission TEXT, discharge TEXT, diagnosis TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS contributions_rut_key ON contributions (rut_key)")
+    conn.execute("CREATE TABLE IF NOT EXISTS diagnoses (diagnosis TEXT PRIMARY KEY, count INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS diagnoses_count ON diagnoses (count)")
+    return conn
+
+
+def _stored_value(value):
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return str(value)
+
+
+def _rows_frame(rows):
+    """Contribution rows (estado, admission, discharge, diagnosis) as store columns."""
+    return pd.DataFrame(rows, columns=list(STATS_COLUMNS), dtype=object)
+
+
+def _contributions(conn, keys):
+    """Contribution rows of each of keys, as stored."""
+    rows = {key: [] for key in keys}
+    for start in range(0, len(keys), MAX_PARAMETERS):
+        batch = keys[start:start + MAX_PARAMETERS]
+        for key, *row in conn.execute("SELECT rut_key, estado, admission, discharge, diagnosis FROM contributions "
+                                      f"WHERE rut_key IN ({', '.join('?' for _ in batch)})", batch):
+            rows[key].append(tuple(row))
+    return rows
+
+
+def _replace_rows(conn, old, new):
+    """Take the contribution rows old out of the running totals and add the rows new."""
+    removed = census.stay_totals(_rows_frame(old))
+    added = census.stay_totals(_rows_frame(new))
+    assignments = ", ".join(f"{name} = {name} + ?" for name in census.STAY_TOTALS)
+    conn.execute(f"UPDATE totals SET {assignments}", [added[name] - removed[name] for name in census.STAY_TOTALS])
+    counts = Counter(diagnosis for *_, diagnosis in new if diagnosis is not None)
+    counts.subtract(diagnosis for *_, diagnosis in old if diagnosis is not None)
+    changed = [(diagnosis, count) for diagnosis, count in counts.items() if count]
+    conn.executemany("INSERT INTO diagnoses (diagnosis, count) VALUES (?, 0) ON CONFLICT (diagnosis) DO NOTHING",
+                     [(diagnosis,) for diagnosis, _ in changed])
+    conn.executemany("UPDATE diagnoses SET count = count + ? WHERE diagnosis = ?",
+                     [(count, diagnosis) for diagnosis, count in changed])
+    conn.execute("DELETE FROM diagnoses WHERE count <= 0")
+
+
+def rebuild(path, df):
+    """Recompute every aggregate from the whole store, e.g. after the census was replaced."""
+    totals = census.stay_totals(df)
+    columns = {column: (df[column] if column in df.columns else pd.Series(None, index=df.index, dtype=object))
+               for column in STATS_COLUMNS}
+    keys = rut_keys(df["Rut"]).astype(object).where(df["Rut"].notna(), None)
+    rows = zip(keys.tolist(), *([_stored_value(value) for value in columns[column]] for column in STATS_COLUMNS))
+    counts = columns["Diagnostico"].dropna().map(str).value_counts()
+
+    with closing(_connect(path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM totals")
+            conn.execute("DELETE FROM contributions")
+            conn.execute("DELETE FROM diagnoses")
+            conn.execute(f"INSERT INTO totals VALUES ({', '.join('?' for _ in census.STAY_TOTALS)})",
+                         [totals[name] for name in census.STAY_TOTALS])
+            conn.executemany("INSERT INTO contributions VALUES (?, ?, ?, ?, ?)", rows)
+            conn.executemany("INSERT INTO diagnoses VALUES (?, ?)", zip(counts.index, counts.tolist()))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def record_changes(path, changes):
+    """
+    Fold written records into the running aggregates.
+
+    :param changes: List of (rut_key, fields, mode) with the stored values written for the patient. mode is
+        "upsert" when all rows of the patient became one row with exactly these fields, "update" when only these
+        fields changed on every row of the patient and "merge" for an update that adds a row for a new patient
+    """
+    changes = [(key, fields, mode) for key, fields, mode in changes
+               if mode != "update" or any(column in fields for column in STATS_COLUMNS)]
+    with closing(_connect(path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # The whole batch is applied in memory, in order, and only its net effect is written
+            old = _contributions(conn, list(dict.fromkeys(key for key, _, _ in changes)))
+            current = dict(old)
+            for key, fields, mode in changes:
+                rows = current[key]
+                if not rows and mode == "update":
+                    continue
+                if mode == "upsert" or not rows:
+                    current[key] = [tuple(_stored_value(fields.get(column)) for column in STATS_COLUMNS)]
+                else:
+                    current[key] = [tuple(_stored_value(fields[column]) if column in fields else value
+                                          for column, value in zip(STATS_COLUMNS, row)) for row in rows]
+            changed = [key for key, rows in current.items() if rows != old[key]]
+            _replace_rows(conn, [row for key in changed for row in old[key]],
+                          [row for key in changed for row in current[key]])
+            conn.executemany("DELETE FROM contributions WHERE rut_key = ?", [(key,) for key in changed])
+            conn.executemany("INSERT INTO contributions VALUES (?, ?, ?, ?, ?)",
+                             [(key, *row) for key in changed for row in current[key]])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def read_stats(path, top=3, today=None):
+    """
+    :return: Dictionary with records, average_days (computed for today), inpatients and top_diagnoses
+        (list of (diagnosis, count)), or None if the aggregates were never built
+    """
+    if not os.path.exists(path):
+        return None
+    with closing(_connect(path)) as conn:
+        row = conn.execute(f"SELECT {', '.join(census.STAY_TOTALS)} FROM totals").fetchone()
+        if row is None:
+            return None
+        totals = dict(zip(census.STAY_TOTALS, row))
+        top_diagnoses = conn.execute(
+            "SELECT diagnosis, count FROM diagnoses ORDER BY count DESC, diagnosis LIMIT ?", (top,)).fetchall()
+    return {
+        "records": totals["records"],
+        "average_days": census.average_stay(totals, today),
+        "inpatients": totals["active"],
+        "top_diagnoses": top_diagnoses,
+    }
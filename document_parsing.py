@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from docx import Document
+from docx.text.paragraph import Paragraph
+from PyPDF2 import PdfReader
+
+# Parsing is CPU bound and each document is independent, so every core can take one
+MAX_WORKERS = os.cpu_count() or 1
+# Pages of a PDF parsed by one task; long PDFs are split so a single chart does not wait on one core
+PDF_PAGES_PER_TASK = 10
+SUPPORTED_EXTENSIONS = {".docx", ".pdf"}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: forking the Streamlit server process with its threads is not safe
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def file_extension(filename):
+    """Lowercase extension of a file name, e.g. ".pdf" for "Epicrisis.v2.PDF"."""
+    return os.path.splitext(filename)[1].lower()
+
+
+def docx_text(source):
+    """
+    Text of a Word document: its paragraphs and the rows of its tables in document order, one per line.
+
+    :param source: Path or binary file object
+    """
+    lines = []
+    for block in Document(source).iter_inner_content():
+        if isinstance(block, Paragraph):
+            lines.append(block.text)
+            continue
+        for row in block.rows:
+            cells = []
+            previous = None
+            for cell in row.cells:
+                # Merged cells are returned once per grid column they span, each time with the same element
+                if cell._tc is not previous:
+                    cells.append(cell.text)
+                previous = cell._tc
+            lines.append(" | ".join(cells))
+    return "\n".join(line for line in lines if line.strip())
+
+
+def _pdf_reader(data):
+    return PdfReader(BytesIO(data))
+
+
+def _parse_task(filename, data, start=None, stop=None):
+    """
+    Parse a document, or pages start to stop of a PDF. Runs in a worker process.
+
+    :return: List of (text, metadata), one per PDF page or one for a Word document
+    """
+    if file_extension(filename) == ".pdf":
+        pages = _pdf_reader(data).pages
+        return [(pages[number].extract_text() or "", {"source": filename, "page": number})
+                for number in range(start, stop)]
+    return [(docx_text(BytesIO(data)), {"source": filename})]
+
+
+def _tasks(files):
+    tasks = []
+    errors = []
+    for order, (filename, data) in enumerate(files):
+        extension = file_extension(filename)
+        if extension not in SUPPORTED_EXTENSIONS:
+            errors.append((filename, f"formato {extension or 'desconocido'} no soportado"))
+        elif extension == ".pdf":
+            try:
+                page_count = len(_pdf_reader(data).pages)
+            except Exception as e:
+                errors.append((filename, str(e)))
+                continue
+            tasks.extend(((order, start), filename, data, start, min(start + PDF_PAGES_PER_TASK, page_count))
+                         for start in range(0, page_count, PDF_PAGES_PER_TASK))
+        else:
+            tasks.append(((order, 0), filename, data, None, None))
+    return tasks, errors
+
+
+def parse_documents(files, progress=None):
+    """
+    Parse uploaded documents straight from their bytes, in parallel worker processes.
+
+    :param files: List of (filename, bytes) of .docx and .pdf files
+    :param progress: Optional function called with (tasks done, total) as documents and page ranges complete
+    :return: A tuple (documents, errors): documents is a list of (text, metadata) in upload and page order,
+        errors a list of (filename, message) for files, or pages of them, that could not be read
+    """
+    tasks, errors = _tasks(files)
+    results = {}
+    done = []
+
+    def finish(key, filename, parse):
+        try:
+            results[key] = parse()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            errors.append((filename, str(e)))
+        done.append(key)
+        if progress is not None:
+            progress(len(done), len(tasks))
+
+    if len(tasks) == 1:
+        # Starting worker processes costs more than parsing a single document
+        key, filename, *args = tasks[0]
+        finish(key, filename, lambda: _parse_task(filename, *args))
+    elif tasks:
+        try:
+            executor = _get_executor()
+            futures = {executor.submit(_parse_task, filename, *args): (key, filename)
+                       for key, filename, *args in tasks}
+            for future in as_completed(futures):
+                key, filename = futures[future]
+                finish(key, filename, future.result)
+        except BrokenProcessPool:
+            # A worker died; parse what is left here and start a new pool next time
+            _reset_executor()
+            for key, filename, *args in tasks:
+                if key not in done:
+                    finish(key, filename, lambda: _parse_task(filename, *args))
+
+    documents = []
+    for key in sorted(results):
+        documents.extend(results[key])
+    return documents, errors
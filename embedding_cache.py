@@ -0,0 +1,142 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+
+import patient_store
+
+# Embeddings of document chunks, keyed by the model and the text they were computed from
+EMBEDDING_CACHE_FILE = os.path.join(patient_store.DATA_DIR, "embedding_cache.sqlite3")
+# The least recently used embeddings are dropped once the vectors take more than this
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+_lock = threading.Lock()
+
+
+def content_key(model, text):
+    """Cache key of the embedding of text by model."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _connect(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                 "(key TEXT PRIMARY KEY, model TEXT, vector BLOB, size INTEGER, last_used REAL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+    # Running total of the vector bytes, so eviction does not sum every row on each write
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+    # Rows replaced by INSERT OR REPLACE only fire the delete trigger with recursive triggers on
+    conn.execute("PRAGMA recursive_triggers = ON")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings BEGIN "
+                 "UPDATE meta SET value = value + new.size WHERE name = 'bytes'; END")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings BEGIN "
+                 "UPDATE meta SET value = value - old.size WHERE name = 'bytes'; END")
+    if conn.execute("SELECT 1 FROM meta WHERE name = 'bytes'").fetchone() is None:
+        # Caches written before the total was kept are summed once
+        conn.execute("INSERT OR IGNORE INTO meta SELECT 'bytes', COALESCE(SUM(size), 0) FROM embeddings")
+    return conn
+
+
+def _total_bytes(conn):
+    return conn.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+
+
+def _lookup(conn, keys):
+    found = {}
+    # SQLite limits the number of parameters of a statement
+    for start in range(0, len(keys), 500):
+        batch = keys[start:start + 500]
+        rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({', '.join('?' for _ in batch)})",
+                            batch)
+        found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+    return found
+
+
+def evict(conn, max_bytes=MAX_CACHE_BYTES):
+    """Drop the least recently used embeddings until the cached vectors take at most max_bytes."""
+    total = _total_bytes(conn)
+    if total <= max_bytes:
+        return 0
+    removed = 0
+    for key, size in conn.execute("SELECT key, size FROM embeddings ORDER BY last_used"):
+        if total <= max_bytes:
+            break
+        removed += 1
+        total -= size
+    conn.execute("DELETE FROM embeddings WHERE key IN "
+                 "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (removed,))
+    return removed
+
+
+def cached_embeddings(embed, model, texts, path=EMBEDDING_CACHE_FILE, max_bytes=MAX_CACHE_BYTES):
+    """
+    Embed texts, computing only the ones not embedded by model before.
+
+    :param embed: Function embedding a list of texts, e.g. OllamaEmbeddings.embed_documents
+    :param model: Name of the embedding model; embeddings of other models are never reused
+    :param texts: List of texts to embed
+    :return: List of float32 vectors, one per text
+    """
+    keys = [content_key(model, text) for text in texts]
+    with _lock, closing(_connect(path)) as conn:
+        found = _lookup(conn, list(set(keys)))
+    # Identical chunks of several documents are embedded once
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found:
+            missing.setdefault(key, text)
+    if missing:
+        vectors = embed(list(missing.values()))
+        for key, vector in zip(missing, vectors):
+            found[key] = np.asarray(vector, dtype=np.float32)
+
+    now = time.time()
+    with _lock, closing(_connect(path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)",
+                             [(key, model, found[key].tobytes(), found[key].nbytes, now) for key in missing])
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                             [(now, key) for key in set(keys) - set(missing)])
+            evict(conn, max_bytes)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return [found[key] for key in keys]
+
+
+def cache_stats(path=EMBEDDING_CACHE_FILE):
+    """:return: Dictionary with the number of cached embeddings and the bytes their vectors take"""
+    if not os.path.exists(path):
+        return {"entries": 0, "bytes": 0}
+    with closing(_connect(path)) as conn:
+        entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        size = _total_bytes(conn)
+    return {"entries": entries, "bytes": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Herramientas de la caché de embeddings del Asistente")
+    parser.add_argument("--path", default=EMBEDDING_CACHE_FILE, help="Archivo de la caché")
+    parser.add_argument("--max-mb", type=float, help="Reducir la caché a este tamaño en MB")
+    args = parser.parse_args()
+
+    if args.max_mb is not None:
+        with closing(_connect(args.path)) as conn:
+            print(f"{evict(conn, int(args.max_mb * 1024 * 1024))} embeddings eliminados")
+    stats = cache_stats(args.path)
+    print(f"{stats['entries']} embeddings en caché, {stats['bytes'] / (1024 * 1024):.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+import random
+import urllib.error
+import urllib.request
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+# Texts sent per request and requests in flight at once
+BATCH_SIZE = 32
+MAX_CONCURRENCY = 4
+# Failed batches are retried this many times, waiting BACKOFF_SECONDS, then twice as long each time
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 0.5
+REQUEST_TIMEOUT = 120
+# The prefixes langchain's OllamaEmbeddings adds, so vectors stay comparable with those embedded before
+DOCUMENT_PREFIX = "passage: "
+QUERY_PREFIX = "query: "
+# Server answers worth retrying: overloaded, restarting or timed out
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class EmbeddingError(Exception):
+    pass
+
+
+def _post(url, payload, timeout):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class EmbeddingClient:
+    """
+    Embeds texts with the batch endpoint of Ollama (/api/embed), several batches at a time.
+
+    Requests are blocking HTTP calls run in worker threads, so no extra HTTP library is needed; at most
+    concurrency of them are in flight.
+    """
+
+    def __init__(self, model, base_url=OLLAMA_URL, batch_size=BATCH_SIZE, concurrency=MAX_CONCURRENCY,
+                 retries=MAX_RETRIES, backoff=BACKOFF_SECONDS, timeout=REQUEST_TIMEOUT):
+        self.model = model
+        self.url = f"{base_url.rstrip('/')}/api/embed"
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    async def _embed_batch(self, start, batch, semaphore):
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = await asyncio.to_thread(
+                        _post, self.url, {"model": self.model, "input": batch}, self.timeout)
+                    break
+                except urllib.error.HTTPError as e:
+                    if e.code not in RETRY_STATUS or attempt == self.retries:
+                        raise EmbeddingError(f"El servidor de embeddings respondió {e.code}: {e.reason}") from e
+                except (urllib.error.URLError, OSError) as e:
+                    if attempt == self.retries:
+                        raise EmbeddingError(f"No se pudo contactar el servidor de embeddings: {e}") from e
+                except ValueError as e:
+                    raise EmbeddingError(f"El servidor de embeddings no respondió JSON válido: {e}") from e
+                # Jitter keeps concurrent batches from retrying in lockstep
+                await asyncio.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+        embeddings = response.get("embeddings") if isinstance(response, dict) else None
+        if not isinstance(embeddings, list):
+            raise EmbeddingError("La respuesta del servidor de embeddings no contiene embeddings")
+        if len(embeddings) != len(batch):
+            raise EmbeddingError(f"Se recibieron {len(embeddings)} embeddings para {len(batch)} textos")
+        return start, embeddings
+
+    async def embed_async(self, texts, progress=None):
+        """
+        Embed texts in batches, up to concurrency batches at a time.
+
+        :param progress: Optional function called with (texts embedded, total) as batches complete
+        :return: List of embeddings in the order of texts
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        starts = range(0, len(texts), self.batch_size)
+        tasks = [asyncio.ensure_future(self._embed_batch(start, texts[start:start + self.batch_size], semaphore))
+                 for start in starts]
+        embeddings = [None] * len(texts)
+        done = 0
+        try:
+            for future in asyncio.as_completed(tasks):
+                start, batch = await future
+                embeddings[start:start + len(batch)] = batch
+                done += len(batch)
+                if progress is not None:
+                    progress(done, len(texts))
+        finally:
+            for task in tasks:
+                task.cancel()
+        return embeddings
+
+    def embed_documents(self, texts, progress=None):
+        """Embed document chunks; see embed_async."""
+        if not texts:
+            return []
+        return asyncio.run(self.embed_async([DOCUMENT_PREFIX + text for text in texts], progress))
+
+    def embed_query(self, text):
+        return asyncio.run(self.embed_async([QUERY_PREFIX + text]))[0]
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from lab_store import ANALYTE_UNITS
+
+# Points drawn per analyte; about one per two pixels of a wide chart, more adds nothing visible
+MAX_POINTS = 400
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last points and, from each of threshold - 2 buckets in between, the point forming the
+    largest triangle with the point kept before it and the average of the next bucket, so peaks and troughs survive.
+
+    :param x: Numeric x values, sorted
+    :param y: Numeric y values
+    :param threshold: Number of points to keep
+    :return: Indices of the points kept
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    every = (n - 2) / (threshold - 2)
+    # bounds[i]:bounds[i + 1] is bucket i, the last bucket is the final point alone
+    bounds = np.append(np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1, n)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = bounds[i], bounds[i + 1]
+        avg_x = x[stop:bounds[i + 2]].mean()
+        avg_y = y[stop:bounds[i + 2]].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+def downsample(dates, values, max_points=MAX_POINTS):
+    """Downsample one time series, dropping missing values first."""
+    mask = ~(pd.isna(dates) | pd.isna(values))
+    dates = np.asarray(dates)[mask]
+    values = np.asarray(values, dtype="float64")[mask]
+    order = np.argsort(dates, kind="stable")
+    dates, values = dates[order], values[order]
+    keep = lttb(dates.astype("datetime64[ns]").astype(np.int64), values, max_points)
+    return dates[keep], values[keep]
+
+
+def window(results, start=None, end=None):
+    """Keep the long-format results dated between start and end, inclusive."""
+    mask = pd.Series(True, index=results.index)
+    if start is not None:
+        mask &= results["fecha"] >= pd.Timestamp(start)
+    if end is not None:
+        mask &= results["fecha"] <= pd.Timestamp(end)
+    return results[mask]
+
+
+def trend_figure(results, start=None, end=None, max_points=MAX_POINTS):
+    """
+    Plot long-format lab results ("fecha", "analito", "valor") with WebGL traces.
+
+    Only the results inside the date window are sent to the browser, downsampled to max_points per analyte;
+    narrowing the window brings back every point of that period.
+
+    :return: The figure and the number of points left out by downsampling
+    """
+    results = window(results, start, end)
+    fig = go.Figure()
+    hidden = 0
+    for analyte, group in results.groupby("analito", sort=False):
+        dates, values = downsample(group["fecha"].to_numpy(), group["valor"].to_numpy(), max_points)
+        hidden += len(group) - len(dates)
+        unit = ANALYTE_UNITS.get(analyte, '')
+        fig.add_trace(go.Scattergl(
+            x=dates,
+            y=values,
+            mode='lines+markers',
+            name=f"{analyte} ({unit})",
+            hovertemplate=f"{analyte}: %{{y:.2f}} {unit}<extra></extra>"
+        ))
+
+    fig.update_layout(
+        title='Exámenes registro temporal',
+        xaxis_title='Fecha',
+        yaxis_title='Valor',
+        legend_title='Examen',
+        hovermode="x unified",
+        yaxis=dict(title='Valor (ver unidades en leyenda)'),
+        xaxis=dict(
+            rangeselector=dict(
+                buttons=list([
+                    dict(count=7, label="1s", step="day", stepmode="backward"),
+                    dict(count=1, label="1m", step="month", stepmode="backward"),
+                    dict(count=6, label="6m", step="month", stepmode="backward"),
+                    dict(step="all")
+                ])
+            ),
+            rangeslider=dict(visible=False),
+            type="date"
+        )
+    )
+    return fig, hidden
@@ -0,0 +1,260 @@
+import argparse
+import ast
+import os
+import threading
+import uuid
+
+import pandas as pd
+import streamlit as st
+
+import patient_store
+from rut import rut_key
+
+# Lab results in long format, one row per (patient, date, analyte), kept as Parquet part files
+LAB_RESULTS_DIR = os.path.join(patient_store.DATA_DIR, "lab_results")
+# Parts are merged into a single file once there are more than this many
+MAX_PARTS = 50
+
+KEY_COLUMNS = ["rut", "fecha", "analito"]
+LAB_COLUMNS = KEY_COLUMNS + ["valor", "registrado"]
+
+ANALYTE_UNITS = {
+    "Hemoglobina": "g/dL",
+    "Hematocrito": "%",
+    "Leucocitos": "/mm³",
+    "Plaquetas": "/mm³",
+    "Creatinina": "mg/dL",
+    "BUN": "mg/dL",
+    "PCR": "mg/L",
+    "Procalcitonina": "ng/mL",
+    "Sodio": "mEq/L"
+}
+
+_write_lock = threading.Lock()
+_write_counter = 0
+
+
+def _typed(df):
+    df = df.copy()
+    df["rut"] = df["rut"].astype("string")
+    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce").dt.normalize()
+    df["analito"] = df["analito"].astype("string")
+    df["valor"] = pd.to_numeric(df["valor"], errors="coerce").astype("float64")
+    df["registrado"] = pd.to_datetime(df["registrado"], errors="coerce")
+    return df[LAB_COLUMNS]
+
+
+def empty_results():
+    return _typed(pd.DataFrame(columns=LAB_COLUMNS))
+
+
+def _deduplicate(df):
+    # The latest value saved for a (patient, date, analyte) wins
+    df = df.sort_values("registrado", kind="stable").drop_duplicates(KEY_COLUMNS, keep="last")
+    return df.sort_values(KEY_COLUMNS, kind="stable").reset_index(drop=True)
+
+
+def _part_files():
+    if not os.path.exists(LAB_RESULTS_DIR):
+        return []
+    return sorted(os.path.join(LAB_RESULTS_DIR, name) for name in os.listdir(LAB_RESULTS_DIR)
+                  if name.endswith(".parquet"))
+
+
+def _write_part(df):
+    os.makedirs(LAB_RESULTS_DIR, exist_ok=True)
+    path = os.path.join(LAB_RESULTS_DIR, f"part-{pd.Timestamp.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}.parquet")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        df.to_parquet(file, index=False)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_results():
+    """Read every part file and return the deduplicated results sorted by patient, date and analyte."""
+    while True:
+        try:
+            frames = [pd.read_parquet(path) for path in _part_files()]
+            break
+        except FileNotFoundError:
+            # A compaction removed a part while it was being listed; read the new set of files
+            continue
+    if not frames:
+        return empty_results()
+    return _deduplicate(_typed(pd.concat(frames, ignore_index=True)))
+
+
+def results_version():
+    version = [_write_counter]
+    for path in _part_files():
+        try:
+            stat = os.stat(path)
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append((path, None))
+    return tuple(version)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _cached_results(version):
+    df = read_results()
+    # Rows are sorted by patient, so each patient is one contiguous slice
+    index = {key: (positions[0], positions[-1] + 1) for key, positions in df.groupby("rut").indices.items()}
+    return df, index
+
+
+def load_results():
+    """Return the shared results frame and the slice of rows of each patient. Do not modify the frame."""
+    return _cached_results(results_version())
+
+
+def patient_results(rut):
+    """All the results of a patient in long format, sorted by date."""
+    df, index = load_results()
+    start, stop = index.get(rut_key(rut), (0, 0))
+    return df.iloc[start:stop].reset_index(drop=True)
+
+
+def patient_series(rut):
+    """The results of a patient as one column per analyte, indexed by date."""
+    results = patient_results(rut)
+    return results.pivot_table(index="fecha", columns="analito", values="valor", aggfunc="last")
+
+
+def find_results(analito, below=None, above=None, since=None, until=None):
+    """
+    Results of an analyte across every patient, e.g. find_results("Sodio", below=130, since=last_week).
+
+    :param below: Keep values strictly lower than this
+    :param above: Keep values strictly higher than this
+    :param since: Keep results dated on or after this date
+    :param until: Keep results dated on or before this date
+    """
+    df, _ = load_results()
+    mask = df["analito"] == analito
+    if below is not None:
+        mask &= df["valor"] < below
+    if above is not None:
+        mask &= df["valor"] > above
+    if since is not None:
+        mask &= df["fecha"] >= pd.Timestamp(since)
+    if until is not None:
+        mask &= df["fecha"] <= pd.Timestamp(until)
+    return df[mask.fillna(False)].reset_index(drop=True)
+
+
+def exam_grid_results(exam_data):
+    """Turn the exam grid of Registro clínico (a "date" column and one column per analyte) into long rows."""
+    grid = pd.DataFrame(exam_data)
+    if grid.empty or "date" not in grid.columns:
+        return pd.DataFrame(columns=["fecha", "analito", "valor"])
+    return grid.melt(id_vars="date", var_name="analito", value_name="valor").rename(columns={"date": "fecha"})
+
+
+def exams_to_results(exams):
+    """Turn the legacy "Exámenes" list ({"Fecha": "dd-mm-YYYY", "Resultados": {...}}) into long rows."""
+    rows = []
+    for exam in exams or []:
+        fecha = pd.to_datetime(exam.get("Fecha"), format="%d-%m-%Y", errors="coerce")
+        for analito, valor in (exam.get("Resultados") or {}).items():
+            rows.append({"fecha": fecha, "analito": analito, "valor": valor})
+    return pd.DataFrame(rows, columns=["fecha", "analito", "valor"])
+
+
+def _results_frame(rut, results):
+    df = pd.DataFrame(results).copy()
+    if "rut" not in df.columns:
+        df["rut"] = rut_key(rut)
+    df["registrado"] = pd.Timestamp.now()
+    df = _typed(df)
+    return df.dropna(subset=["rut", "fecha", "analito", "valor"])
+
+
+def _save(df):
+    global _write_counter
+    if df.empty:
+        return 0
+    with _write_lock:
+        _write_part(_deduplicate(df))
+        _write_counter += 1
+        needs_compaction = len(_part_files()) > MAX_PARTS
+    if needs_compaction:
+        compact()
+    return len(df)
+
+
+def save_results(rut, results):
+    """
+    Durably save lab results of a patient, replacing earlier values for the same date and analyte.
+
+    :param results: Rows with "fecha", "analito" and "valor"; rows without a value are ignored
+    :return: The number of results saved
+    """
+    return _save(_results_frame(rut, results))
+
+
+def compact():
+    """Merge every part file into one."""
+    with _write_lock:
+        parts = _part_files()
+        if len(parts) <= 1:
+            return
+        _write_part(read_results())
+        for path in parts:
+            os.remove(path)
+
+
+def _legacy_results(rut, exams):
+    if not isinstance(exams, str) or not exams:
+        return None
+    try:
+        exams = ast.literal_eval(exams)
+    except (ValueError, SyntaxError):
+        print(f"Exámenes ilegibles para el RUT {rut}, se omiten")
+        return None
+    return _results_frame(rut, exams_to_results(exams))
+
+
+def migrate_patient(rut, exams):
+    """
+    Move the stringified "Exámenes" list of one patient record into the lab results store.
+
+    :param exams: Value of the "Exámenes" column of the record
+    :return: The number of results migrated
+    """
+    results = _legacy_results(rut, exams)
+    return 0 if results is None else _save(results)
+
+
+def migrate_from_patient_store():
+    """
+    Move the stringified "Exámenes" lists of the patient store into the lab results store.
+
+    :return: The number of results migrated
+    """
+    df = patient_store.load_patients(["Rut", "Exámenes"])
+    frames = [results for results in (_legacy_results(rut, exams) for rut, exams in zip(df["Rut"], df["Exámenes"]))
+              if results is not None]
+    if not frames:
+        return 0
+    return _save(pd.concat(frames, ignore_index=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Herramientas del almacenamiento de exámenes de laboratorio")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="Copiar los exámenes guardados en la base de datos de pacientes")
+    subparsers.add_parser("compact", help="Unir los archivos de resultados en uno solo")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(f"{migrate_from_patient_store()} resultados migrados a {LAB_RESULTS_DIR}")
+    else:
+        compact()
+
+
+if __name__ == "__main__":
+    main()
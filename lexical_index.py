@@ -0,0 +1,184 @@
+import re
+import unicodedata
+import weakref
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from rut import rut_key
+
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Constant of reciprocal-rank fusion; larger values flatten the advantage of the first ranks
+RRF_K = 60
+# Results taken from each ranking before fusing them
+CANDIDATES = 20
+# Queries of at most this many terms, all present in the documents, are answered by the inverted index alone
+EXACT_QUERY_TERMS = 3
+
+STOPWORDS = {
+    "a", "al", "algo", "ante", "como", "con", "cual", "cuando", "de", "del", "desde", "donde", "durante", "el",
+    "ella", "ellos", "en", "entre", "era", "es", "esa", "ese", "esta", "este", "esto", "fue", "ha", "hay", "la",
+    "las", "le", "les", "lo", "los", "mas", "me", "mi", "muy", "no", "o", "para", "pero", "por", "que", "se", "sea",
+    "segun", "ser", "si", "sin", "sobre", "son", "su", "sus", "tiene", "un", "una", "uno", "unos", "y", "ya",
+    "cuales", "cuanto", "dame", "muestra", "paciente", "indica", "ultimo", "ultima",
+}
+
+TOKEN_PATTERN = re.compile(
+    r"(?P<rut>\b\d{1,2}\.?\d{3}\.?\d{3}-[\dk]\b)"
+    r"|(?P<iso_date>\b\d{4}-\d{2}-\d{2}\b)"
+    r"|(?P<date>\b\d{1,2}[-/]\d{1,2}[-/](?:\d{4}|\d{2})\b)"
+    r"|(?P<number>\d+(?:[.,]\d+)?)"
+    r"|(?P<word>[a-zñ]+)")
+
+
+def fold(text):
+    """Lowercase text and drop accents, keeping ñ, so "Vancomicina" and "vancomicína" are the same term."""
+    text = unicodedata.normalize("NFD", str(text).casefold()).replace("n\u0303", "ñ")
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def _stem(word):
+    # Singular forms only; drug, lab and anatomical names are left as written
+    if len(word) > 5 and word.endswith("es"):
+        return word[:-2]
+    if len(word) > 4 and word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """
+    Terms of Spanish clinical text: RUTs in canonical form, dates as dd-mm-yyyy, numbers with a decimal point and
+    accent-folded words without stopwords or plural endings.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(fold(text)):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "rut":
+            terms.append(rut_key(value).lower())
+        elif kind == "iso_date":
+            year, month, day = value.split("-")
+            terms.append(f"{day}-{month}-{year}")
+        elif kind == "date":
+            day, month, year = re.split(r"[-/]", value)
+            terms.append(f"{int(day):02d}-{int(month):02d}-{year if len(year) == 4 else '20' + year}")
+        elif kind == "number":
+            terms.append(value.replace(",", "."))
+        elif value not in STOPWORDS and len(value) > 1:
+            terms.append(_stem(value))
+    return terms
+
+
+class LexicalIndex:
+    """An inverted index of texts ranked with BM25; texts are added incrementally and keep their position."""
+
+    def __init__(self, texts=()):
+        self._postings = defaultdict(list)
+        self._arrays = {}
+        self._lengths = []
+        self.add(texts)
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, texts):
+        for text in texts:
+            position = len(self._lengths)
+            counts = Counter(tokenize(text))
+            for term, count in counts.items():
+                self._postings[term].append((position, count))
+                self._arrays.pop(term, None)
+            self._lengths.append(sum(counts.values()))
+
+    def __contains__(self, term):
+        return term in self._postings
+
+    def _posting_arrays(self, term):
+        if term not in self._arrays:
+            positions, counts = zip(*self._postings[term])
+            self._arrays[term] = (np.array(positions), np.array(counts, dtype=np.float32))
+        return self._arrays[term]
+
+    def scores(self, terms):
+        """BM25 score of every text for the query terms."""
+        n = len(self._lengths)
+        scores = np.zeros(n, dtype=np.float32)
+        if not n:
+            return scores
+        lengths = np.asarray(self._lengths, dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1))
+        for term in set(terms):
+            if term not in self._postings:
+                continue
+            positions, counts = self._posting_arrays(term)
+            idf = np.log(1 + (n - len(positions) + 0.5) / (len(positions) + 0.5))
+            scores[positions] += idf * counts * (BM25_K1 + 1) / (counts + norm[positions])
+        return scores
+
+    def search(self, query, k=CANDIDATES):
+        """Positions and BM25 scores of the k best matching texts, best first; texts without any term are left out."""
+        scores = self.scores(tokenize(query))
+        matching = np.flatnonzero(scores)
+        best = matching[np.argsort(-scores[matching], kind="stable")[:k]]
+        return best, scores[best]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse rankings (lists of keys, best first) by the sum of 1 / (k + rank) of each key."""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] += 1 / (k + rank)
+    return sorted(fused, key=lambda key: fused[key], reverse=True)
+
+
+_lexical_indexes = weakref.WeakKeyDictionary()
+
+
+def lexical_index_for(vector_index):
+    """
+    The inverted index of the texts of a vector index, built once and extended as the vector index grows.
+
+    It lives as long as the vector index object, so indexes kept in a cache keep their inverted index too.
+    """
+    lexical = _lexical_indexes.get(vector_index)
+    if lexical is None:
+        lexical = _lexical_indexes[vector_index] = LexicalIndex()
+    if len(lexical) < len(vector_index):
+        lexical.add(vector_index.texts[len(lexical):])
+    return lexical
+
+
+def is_exact_query(query, lexical_indexes):
+    """Whether the query is a few terms that all appear in the documents, e.g. a drug name, a date or a RUT."""
+    terms = tokenize(query)
+    return 0 < len(terms) <= EXACT_QUERY_TERMS and all(
+        any(term in lexical for lexical in lexical_indexes) for term in terms)
+
+
+def hybrid_search(indexes, query, embed_query, k=3):
+    """
+    The k texts best matching the query across vector indexes, fusing BM25 and vector rankings.
+
+    Exact-term queries are answered from the inverted index without embedding the query.
+
+    :param indexes: List of VectorIndex
+    :param embed_query: Function returning the embedding of the query
+    """
+    lexical_indexes = [lexical_index_for(index) for index in indexes]
+    # Scores of different indexes are not comparable, BM25 ones depend on the vocabulary and lengths of each, so
+    # every index is ranked on its own and the rankings are fused
+    rankings = [[(i, position) for position in lexical.search(query, CANDIDATES)[0]]
+                for i, lexical in enumerate(lexical_indexes)]
+
+    if any(rankings) and is_exact_query(query, lexical_indexes):
+        best = reciprocal_rank_fusion(rankings)[:k]
+    else:
+        query_vector = embed_query(query)
+        rankings.extend([(i, position) for position in index.search(query_vector, CANDIDATES)[0]]
+                        for i, index in enumerate(indexes))
+        best = reciprocal_rank_fusion(rankings)[:k]
+    return [indexes[i].texts[position] for i, position in best]
@@ -1,21 +1,20 @@
 import streamlit as st
-from docx import Document
-from docx.shared import Inches, Cm, Pt
-from docx.enum.section import WD_ORIENT
-from docx.enum.text import WD_LINE_SPACING, WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_TABLE_ALIGNMENT
 from datetime import datetime, date
-import re
 import os
 import csv
 import pandas as pd
 from zoneinfo import ZoneInfo
-import plotly.graph_objects as go
 import PyPDF2
 from io import BytesIO
 import socket
 import requests
-PATIENT_DB_FILE = "../patient_database.csv"
+import census
+import lab_charts
+import lab_store
+import patient_store
+import report_jobs
+import report_templates
+from rut import is_valid_rut
 
 def reset_form():
     """Reset all form data in the session state"""
@@ -24,58 +23,24 @@ def reset_form():
         for key in keys:
             st.session_state.pop(key)
 
-def create_exam_line_plot(exam_data):
-    df = pd.DataFrame(exam_data)
-    df['date'] = pd.to_datetime(df['date'])
-    df = df.sort_values('date')
-
-    # Define units for each exam type
-    units = {
-        "Hemoglobina": "g/dL",
-        "Hematocrito": "%",
-        "Leucocitos": "/mm³",
-        "Plaquetas": "/mm³",
-        "Creatinina": "mg/dL",
-        "BUN": "mg/dL",
-        "PCR": "mg/L",
-        "Procalcitonina": "ng/mL",
-        "Sodio": "mEq/L"
-    }
+def exam_chart_results(exam_history, exam_data):
+    """Stored lab results of the patient plus the rows of the exam grid, which win for the same date and analyte."""
+    grid = lab_store.exam_grid_results(exam_data or {})
+    grid["fecha"] = pd.to_datetime(grid["fecha"], errors="coerce")
+    frames = [frame[["fecha", "analito", "valor"]] for frame in (exam_history, grid)
+              if isinstance(frame, pd.DataFrame) and not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=["fecha", "analito", "valor"])
+    results = pd.concat(frames, ignore_index=True)
+    results["valor"] = pd.to_numeric(results["valor"], errors="coerce")
+    results = results.dropna(subset=["fecha", "valor"])
+    return results.drop_duplicates(["fecha", "analito"], keep="last")
 
-    fig = go.Figure()
-
-    for column in df.columns:
-        if column != 'date':
-            fig.add_trace(go.Scatter(
-                x=df['date'],
-                y=df[column],
-                mode='lines+markers',
-                name=f"{column} ({units.get(column, '')})",
-                hovertemplate=f"{column}: %{{y:.2f}} {units.get(column, '')}<extra></extra>"
-            ))
-
-    fig.update_layout(
-        title='Exámenes registro temporal',
-        xaxis_title='Fecha',
-        yaxis_title='Valor',
-        legend_title='Examen',
-        hovermode="x unified",
-        yaxis=dict(title='Valor (ver unidades en leyenda)'),
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    dict(count=7, label="1s", step="day", stepmode="backward"),
-                    dict(count=1, label="1m", step="month", stepmode="backward"),
-                    dict(count=6, label="6m", step="month", stepmode="backward"),
-                    dict(step="all")
-                ])
-            ),
-            rangeslider=dict(visible=False),
-            type="date"
-        )
-    )
 
-    return fig
+def create_exam_line_plot(results, start=None, end=None):
+    # WebGL traces, downsampled to what the chart can show; the date window brings back every point
+    return lab_charts.trend_figure(results, start, end)
+
 
 def dict_to_string(obj):
     if isinstance(obj, dict):
@@ -97,75 +62,44 @@ def ensure_reports_folder():
         if not os.path.exists("reports"):
             os.makedirs("reports")
 def load_patient_database():
-    columns = [
-        "Rut", "Nombre", "Edad", "Sexo", "Domicilio", "Fecha de ingreso", "Diagnóstico",
-        "Alergias", "Tabaquismo", "Medicamentos", "Antiagregantes plaquetarios", "Anticoagulantes",
-        "Antecedentes mórbidos", "Otra enfermedad","Temperatura", "Frecuencia cardíaca", "Presión arterial", "Saturación O2",
-        "Anamnesis", "Examen físico", "Escala de Glasgow", "Hemiparesia", "Paraparesia",
-        "Focalidad", "Fecha de exámenes", "PCR", "Leucocitos", "Hematocrito", "Natremia", "Otros exámenes","Plan", "Reposo", "Tromboprofilaxis farmacológica", "Hidratación",
-        "Régimen nutricional", "Equipo multidisciplinario", "Antibiótico 1",
-        "Fecha de inicio Antibiotico 1", "Días de antibiótico 1", "Antibiótico 2",
-        "Fecha de inicio Antibiotico 2", "Días de antibiótico 2", "Retiro sonda foley",
-        "Retiro de CVC", "Curación por enfermería", "Instalación sonda nasogástrica",
-        "Oxigenoterapia", "Hemoglucotest", "Precauciones", "Exámenes de laboratorio",
-        "Firma médico"
-    ]
-
-    if not os.path.exists(PATIENT_DB_FILE):
-        return pd.DataFrame(columns=columns)
-    try:
-        df = pd.read_csv(PATIENT_DB_FILE)
-        date_columns = ["Fecha de ingreso", "Fecha de inicio Antibiotico 1", "Fecha de inicio Antibiotico 2"]
-        for col in date_columns:
-            df[col] = df[col].apply(parse_date)
-        return df
-    except Exception as e:
-        st.error(f"Error loading patient database: {str(e)}")
-        return pd.DataFrame(columns=columns)
-
-
-def save_patient_database(df):
-    try:
-        # Convert date columns to string before saving
-        date_columns = ["Fecha de ingreso", "Fecha de inicio Antibiotico 1", "Fecha de inicio Antibiotico 2"]
-        for col in date_columns:
-            df[col] = df[col].astype(str).replace('NaT', 'N/A')
-
-        df.to_csv(PATIENT_DB_FILE, index=False)
-    except Exception as e:
-        st.error(f"Error saving patient database: {str(e)}")
+    # The form needs every column to prefill a returning patient
+    return patient_store.load_patients_with_index()
 
 
-def lookup_patient(rut, df):
-    patient = df[df["Rut"] == rut]
+def lookup_patient(rut, df, rut_index):
+    patient = patient_store.find_patient_rows(df, rut_index, rut)
     if not patient.empty:
         patient_dict = patient.iloc[0].to_dict()
 
-        # Parse the Exámenes field if it exists
-        if 'Exámenes' in patient_dict and patient_dict['Exámenes']:
-            try:
-                exams = eval(patient_dict['Exámenes'])
-                patient_dict['Exámenes'] = exams
-            except:
-                patient_dict['Exámenes'] = []
-        else:
-            patient_dict['Exámenes'] = []
+        # Lab results live in the lab results store, one row per date and analyte
+        results = lab_store.patient_results(rut)
+        # Records saved before that store keep their exams as a string; they are moved there the first time the
+        # patient is opened, before a new save replaces the record without them
+        if results.empty and lab_store.migrate_patient(rut, patient_dict.get('Exámenes')):
+            results = lab_store.patient_results(rut)
+        patient_dict['Exámenes'] = results
 
         return patient_dict
     return None
 
-def add_patient(data, df):
-    # Convert date fields to datetime objects
-    date_fields = ["Fecha de ingreso", "Fecha de inicio Antibiotico 1", "Fecha de inicio Antibiotico 2"]
-    for field in date_fields:
-        if field in data:
-            data[field] = parse_date(data[field])
+def add_patient(data):
+    # Date fields stay as dd-mm-YYYY strings here; the store parses them into typed columns.
+    # The record is appended to the store journal, replacing any existing entry for this Rut.
+    try:
+        patient_store.upsert_patient(data)
+        return True
+    except Exception as e:
+        st.error(f"Error saving patient database: {str(e)}")
+        return False
+
 
-    new_patient = pd.DataFrame([data])
-    df = df[df["Rut"] != data["Rut"]]  # Remove existing entry if any
-    df = pd.concat([df, new_patient], ignore_index=True)
-    save_patient_database(df)
-    return df
+def save_lab_results(rut, exam_data):
+    try:
+        lab_store.save_results(rut, lab_store.exam_grid_results(exam_data or {}))
+        return True
+    except Exception as e:
+        st.error(f"Error saving lab results: {str(e)}")
+        return False
 
 
 def save_dict_to_csv(data_dict, filename=None):
@@ -204,260 +138,43 @@ def save_dict_to_csv(data_dict, filename=None):
 
 
 def create_word_document(data):
-    doc = Document()
-    section = doc.sections[0]
-    section.page_height = Inches(11)
-    section.page_width = Inches(8.5)
-    section.left_margin = section.right_margin = Inches(0.5)
-    section.top_margin = section.bottom_margin = Inches(0.3)
-    section.orientation = WD_ORIENT.PORTRAIT
-
-    # Set default paragraph format
-    style = doc.styles['Normal']
-    style.font.name = 'Arial'
-    style.font.size = Pt(10)
-    style.paragraph_format.line_spacing_rule = WD_LINE_SPACING.ONE_POINT_FIVE
-    style.paragraph_format.space_after = Pt(0)
-
-    ## Add title
-    chile_tz = ZoneInfo("America/Santiago")  # Chile is in GMT-3
-    now = datetime.now(chile_tz)
-    current_time = now.strftime("%H:%M")
-    title = doc.add_paragraph("Evolución médica neurocirugía")
-    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    title.runs[0].font.size = Pt(12)
-    title.runs[0].font.bold = True
-
-    subtitle = doc.add_paragraph(f"{data['Nombre']} , {data['Rut']} , fecha: {data['Fecha']},hora: {current_time}\n")
-    subtitle.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    subtitle.runs[0].font.size = Pt(12)
-
-    # Define sections and their corresponding fields
-    sections = {
-        "Información del Paciente": ["Sexo","Edad","Fecha de ingreso", "Días de hospitalización","Alergias","Domicilio"],
-        "Diagnóstico": ["Diagnostico", "Antecedentes mórbidos"],
-        "Comentario clínico": ["Anamnesis"],
-        "Evaluación clínica": ["Temperatura","Frecuencia cardíaca", "Presión arterial", "Saturación O2","Examen físico","Escala de Glasgow", "Hemiparesia","Paraparesia","Focalidad","Exámenes de laboratorio","Exámenes imagenológicos"],
-        "Tratamiento": ["Reposo", "Tromboprofilaxis farmacológica", "Régimen nutricional", "Hidratación","Equipo multidisciplinario"],
-        "Indicaciones enfermería": ["Retiro sonda foley", "Retiro de CVC", "Curación por enfermería", "Instalación sonda nasogástrica", "Oxigenoterapia", "Exámenes de laboratorio", "Hemoglucotest","Precauciones"],
-        "Firma médico": ["Firma médico"]
-    }
-
-    for section_title, fields in sections.items():
-        # Add section title
-        doc.add_paragraph().add_run(section_title).bold = True
-        if section_title == "Comentario clínico":
-            # Create a single-column table for anamnesis
-            anamnesis_table = doc.add_table(rows=1, cols=1)
-            anamnesis_table.style = 'Table Grid'
-            anamnesis_table.alignment = WD_TABLE_ALIGNMENT.CENTER
-            anamnesis_table.columns[0].width = Inches(7.5)  # Full width of the page
-
-            anamnesis_cell = anamnesis_table.cell(0, 0)
-            p = anamnesis_cell.paragraphs[0]
-            p.add_run("Anamnesis: ").bold = True
-            p.add_run(data.get("Anamnesis", ""))
-
-            # Apply smaller font size to anamnesis table contents
-            for paragraph in anamnesis_cell.paragraphs:
-                for run in paragraph.runs:
-                    run.font.size = Pt(8)
-
-            # Add space after anamnesis table
-            doc.add_paragraph()
-            continue
-        # Create a 2-column table
-        table = doc.add_table(rows=1, cols=2)
-        table.style = 'Table Grid'
-        table.alignment = WD_TABLE_ALIGNMENT.CENTER
-
-        # Set column widths
-        table.columns[0].width = Inches(3.75)
-        table.columns[1].width = Inches(3.75)
-
-        row_cells = table.rows[0].cells
-
-        for i, field in enumerate(fields):
-
-            if i % 2 == 0 and i > 0:
-                # Add a new row for every two fields
-                row_cells = table.add_row().cells
-
-            cell = row_cells[i % 2]
-            p = cell.paragraphs[0]
-            p.add_run(f"{field}: ").bold = True
-            if field in data:
-                # Format the admission date without time
-                if field == "Fecha de ingreso":
-                    admission_date = data[field]
-                    if isinstance(admission_date, str):
-                        try:
-                            admission_date = datetime.strptime(admission_date, "%d-%m-%Y")
-                        except ValueError:
-                            # If parsing fails, it might already be a datetime object
-                            pass
-                    p.add_run(admission_date.strftime("%d-%m-%Y"))
-                else:
-                    p.add_run(str(data[field]))
-        # Apply smaller font size to table contents
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    for run in paragraph.runs:
-                        run.font.size = Pt(8)
-
-        # Add space after table
-        doc.add_paragraph()
-        # For Información del Paciente, add an additional row for medications
-        if section_title == "Información del Paciente":
-            row_cells = table.add_row().cells
-
-            # First column: Medicamentos
-            cell_med = row_cells[0]
-            p_med = cell_med.paragraphs[0]
-            run = p_med.add_run("Medicamentos crónicos: ")
-            run.bold = True
-            run.font.size = Pt(8)
-            p_med.add_run(data.get('Medicamentos', 'No registrados')).font.size = Pt(8)
-
-            # Second column: Antiagregantes and Anticoagulantes
-            cell_anti = row_cells[1]
-            p_anti = cell_anti.paragraphs[0]
-
-            run = p_anti.add_run("Antiagregantes plaquetarios: ")
-            run.bold = True
-            run.font.size = Pt(8)
-            p_anti.add_run(f"{data.get('Antiagregantes plaquetarios', 'No')}").font.size = Pt(8)
-
-            p_anti.add_run("\n")  # Add a newline between antiagregantes and anticoagulantes
-
-            run = p_anti.add_run("Anticoagulantes: ")
-            run.bold = True
-            run.font.size = Pt(8)
-            p_anti.add_run(f"{data.get('Anticoagulantes', 'No')}").font.size = Pt(8)
-
-            # Remove extra space after the paragraphs
-            p_med.paragraph_format.space_after = Pt(0)
-            p_anti.paragraph_format.space_after = Pt(0)
-
-            # Apply smaller font size to table contents
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    for run in paragraph.runs:
-                        run.font.size = Pt(8)
-                    # Remove extra space after each paragraph in the table
-                    paragraph.paragraph_format.space_after = Pt(0)
-        if section_title == "Evolución clínica":
-            doc.add_paragraph().add_run("Anamnesis").bold = True
-            anamnesis_table = doc.add_table(rows=1, cols=1)
-            anamnesis_table.style = 'Table Grid'
-            anamnesis_table.alignment = WD_TABLE_ALIGNMENT.CENTER
-            anamnesis_table.columns[0].width = Inches(7.5)  # Full width of the page
-
-            anamnesis_cell = anamnesis_table.cell(0, 0)
-            anamnesis_paragraph = anamnesis_cell.paragraphs[0]
-            anamnesis_paragraph.add_run(data.get("Anamnesis", ""))
-
-            # Apply smaller font size to anamnesis table contents
-            for paragraph in anamnesis_cell.paragraphs:
-                for run in paragraph.runs:
-                    run.font.size = Pt(8)
-
-            # Add space after anamnesis table
-            doc.add_paragraph()
-            # Add Exámenes section
-            doc.add_paragraph().add_run("Exámenes").bold = True
-
-            # Add Exámenes de laboratorio
-            if data.get("Exámenes de laboratorio"):
-                doc.add_paragraph().add_run("Exámenes de laboratorio:").bold = True
-                doc.add_paragraph(data["Exámenes de laboratorio"])
-
-            # Add Exámenes imagenológicos
-            if data.get("Exámenes imagenológicos"):
-                doc.add_paragraph().add_run("Exámenes imagenológicos:").bold = True
-                doc.add_paragraph(data["Exámenes imagenológicos"])
-
-            doc.add_paragraph()  # Add space after Exámenes section
-
-        # Add separate table for Plan after the Tratamiento section
-        if section_title == "Tratamiento":
-            doc.add_paragraph().add_run("Plan").bold = True
-            plan_table = doc.add_table(rows=1, cols=1)
-            plan_table.style = 'Table Grid'
-            plan_table.alignment = WD_TABLE_ALIGNMENT.CENTER
-            plan_table.columns[0].width = Inches(7.5)  # Full width of the page
-
-            plan_cell = plan_table.cell(0, 0)
-            plan_paragraph = plan_cell.paragraphs[0]
-            plan_paragraph.add_run(data.get("Plan", ""))
-
-            # Apply smaller font size to plan table contents
-            for paragraph in plan_cell.paragraphs:
-                for run in paragraph.runs:
-                    run.font.size = Pt(8)
-
-            # Add space after plan table
-            doc.add_paragraph()
-            # Add antibiotic information only if it's present
-            if data.get("Antibiótico 1") != "Ninguno" or data.get("Antibiótico 2") != "Ninguno":
-                doc.add_paragraph().add_run("Antibióticos").bold = True
-                atb_table = doc.add_table(rows=1, cols=2)
-                atb_table.style = 'Table Grid'
-                atb_table.alignment = WD_TABLE_ALIGNMENT.CENTER
-                atb_table.columns[0].width = Inches(3.75)
-                atb_table.columns[1].width = Inches(3.75)
-
-                row_cells = atb_table.rows[0].cells
-
-                # Antibiótico 1
-                if data.get("Antibiótico 1") != "Ninguno":
-                    cell = row_cells[0]
-                    p = cell.paragraphs[0]
-                    p.add_run("Antibiótico 1: ").bold = True
-                    p.add_run(f"{data.get('Antibiótico 1', '')}")
-                    p.add_run("\nFecha de inicio: ").bold = True
-                    p.add_run(f"{data.get('Fecha de inicio Antibiotico 1', '')}")
-                    p.add_run("\nDías de tratamiento: ").bold = True
-                    p.add_run(f"{data.get('Días de antibiótico 1', '')}")
-
-                # Antibiótico 2
-                if data.get("Antibiótico 2") != "Ninguno":
-                    cell = row_cells[1] if data.get("Antibiótico 1") != "Ninguno" else row_cells[0]
-                    p = cell.paragraphs[0]
-                    p.add_run("Antibiótico 2: ").bold = True
-                    p.add_run(f"{data.get('Antibiótico 2', '')}")
-                    p.add_run("\nFecha de inicio: ").bold = True
-                    p.add_run(f"{data.get('Fecha de inicio Antibiotico 2', '')}")
-                    p.add_run("\nDías de tratamiento: ").bold = True
-                    p.add_run(f"{data.get('Días de antibiótico 2', '')}")
-
-                # Apply smaller font size to antibiotic table contents
-                for row in atb_table.rows:
-                    for cell in row.cells:
-                        for paragraph in cell.paragraphs:
-                            for run in paragraph.runs:
-                                run.font.size = Pt(6)
-
-                # Add space after antibiotic table
-                doc.add_paragraph()
-
-    footer = section.footer
-    footer_paragraph = footer.paragraphs[0]
-    footer_text = f"Unidad de neurocirugía, Hospital de Curicó"
-    footer_paragraph.text = footer_text
-    footer_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    footer_run = footer_paragraph.runs[0]
-    footer_run.font.size = Pt(6)
-    footer_run.font.name = 'Arial'
-    # Create a filename-safe version of the patient's name
-    safe_name = re.sub(r'[^\w\-_\. ]', '_', data['Nombre'])
-    safe_name = safe_name.replace(' ', '_')
-    filename = f"{safe_name}_{datetime.now().strftime('%d%m%Y_%H%M')}.docx"
-    doc.save(filename)
+    filename = report_templates.evolution_report_filename(data)
+    with open(filename, "wb") as f:
+        f.write(report_templates.render_evolution_report(data))
     return filename
 
+
+def show_report_jobs():
+    """Status of the Word documents queued in this session; only those still being generated refresh on their own."""
+    job_ids = list(reversed(st.session_state.get("report_jobs", [])))
+    statuses = {job_id: report_jobs.job_status(job_id) for job_id in job_ids}
+    pending = [job_id for job_id in job_ids if statuses[job_id][0] == "pendiente"]
+    if pending:
+        show_pending_report_jobs(pending)
+    for job_id in job_ids:
+        status, path, error = statuses[job_id]
+        if status == "listo":
+            st.success(f"Archivo guardado: {os.path.join('reports', os.path.basename(path))}")
+            st.download_button(
+                label="Descargar documento Word",
+                data=report_jobs.job_document(job_id),
+                file_name=os.path.basename(path),
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                key=f"report_job_{job_id}"
+            )
+        elif status == "error":
+            st.error(f"Error creating Word document: {str(error)}")
+
+
+@st.fragment(run_every=2)
+def show_pending_report_jobs(job_ids):
+    """Documents being generated, checked every 2 seconds; the page reruns to show them once one is finished."""
+    if any(report_jobs.job_status(job_id)[0] != "pendiente" for job_id in job_ids):
+        st.rerun()
+    for job_id in job_ids:
+        st.info(f"Generando documento Word de {report_jobs.job_name(job_id)}...")
+
+
 def validate_form(data):
     required_fields = [
         "Nombre", "Rut", "Edad", "Sexo", "Domicilio", "Fecha de ingreso",
@@ -473,6 +190,9 @@ def validate_form(data):
     if missing_fields:
         st.error(f"Por favor, complete los siguientes campos obligatorios: {', '.join(missing_fields)}")
         return False
+    if not is_valid_rut(data["Rut"]):
+        st.error(f"El RUT {data['Rut']} no es válido. Revise el dígito verificador.")
+        return False
     return True
 
 
@@ -488,7 +208,7 @@ def main():
     current_date = st.date_input("Fecha actual", value=datetime.now(chile_tz).date())
 
     # Load patient database
-    patient_df = load_patient_database()
+    patient_df, rut_index = load_patient_database()
 
     # Initialize patient_info
     patient_info = {}
@@ -498,7 +218,7 @@ def main():
     rut = st.text_input("Rut")
 
     if rut:
-        patient_info = lookup_patient(rut, patient_df) or {}
+        patient_info = lookup_patient(rut, patient_df, rut_index) or {}
         if patient_info:
             name = st.text_input("Nombre", value=patient_info.get("Nombre", ""), disabled=True)
             age = st.number_input("Edad", value=patient_info.get("Edad", 0), disabled=True)
@@ -669,10 +389,20 @@ def main():
 
     # Update the session state with the edited data
     st.session_state.exam_data = edited_df.to_dict(orient='list')
-    if not edited_df.empty:
+    exam_results = exam_chart_results(patient_info.get('Exámenes'), st.session_state.exam_data)
+    if not exam_results.empty:
         st.subheader("Gráfico de Exámenes")
-        fig = create_exam_line_plot(st.session_state.exam_data)
+        first_date = exam_results["fecha"].min().date()
+        last_date = exam_results["fecha"].max().date()
+        start_date, end_date = first_date, last_date
+        if first_date < last_date:
+            start_date, end_date = st.slider("Período", min_value=first_date, max_value=last_date,
+                                             value=(first_date, last_date), format="DD-MM-YYYY")
+        fig, hidden_points = create_exam_line_plot(exam_results, start_date, end_date)
         st.plotly_chart(fig, use_container_width=True)
+        if hidden_points:
+            st.caption(f"Se muestran los puntos más representativos ({hidden_points} omitidos). "
+                       "Acote el período para ver todos los valores.")
 
     # Text area for additional exam information
     examenes_laboratorio = st.text_area("Exámenes de laboratorio")
@@ -750,12 +480,14 @@ def main():
         motor_score = next((key for key, value in motor_selections.items() if value), "N/A")
         glasgow_score = f"Ocular: {ocular_score}, Verbal: {verbal_score}, Motor: {motor_score}"
 
-        # Calculate hospitalization time
-        hospitalization_time = (current_date - admission_date).days
-
-        # Calculate antibiotic therapy duration
-        atb1_time = (current_date - date_atb1).days + 1 if atb1 != "Ninguno" and date_atb1 is not None else 0
-        atb2_time = (current_date - date_atb2).days + 1 if atb2 != "Ninguno" and date_atb2 is not None else 0
+        # Calculate hospitalization time and antibiotic therapy duration, as the census does for every patient
+        form_days = census.census_days(pd.DataFrame([{
+            "Fecha de ingreso": admission_date,
+            "Antibiótico 1": atb1,
+            "Fecha de inicio Antibiotico 1": date_atb1,
+            "Antibiótico 2": atb2,
+            "Fecha de inicio Antibiotico 2": date_atb2,
+        }]), current_date).drop(columns="Hospitalizado").apply(census.format_days).iloc[0]
 
         data = {
             "Nombre": name,
@@ -765,7 +497,7 @@ def main():
             "Domicilio": domicilio,
             "Fecha": current_date.strftime("%d-%m-%Y"),
             "Fecha de ingreso": admission_date.strftime("%d-%m-%Y"),
-            "Días de hospitalización": f"{(current_date - admission_date).days} días",
+            "Días de hospitalización": form_days["Días de hospitalización"],
             "Alergias": alergias,
             "Tabaquismo": tabaquismo,
             "Medicamentos": fármacos,
@@ -795,10 +527,10 @@ def main():
                 [option for option, selected in equipo_selections.items() if selected]),
             "Antibiótico 1": atb1,
             "Fecha de inicio Antibiotico 1": date_atb1.strftime("%d-%m-%Y") if date_atb1 else "N/A",
-            "Días de antibiótico 1": f"{(current_date - date_atb1).days + 1} días" if atb1 != "Ninguno" and date_atb1 is not None else "N/A",
+            "Días de antibiótico 1": form_days["Días de antibiótico 1"],
             "Antibiótico 2": atb2,
             "Fecha de inicio Antibiotico 2": date_atb2.strftime("%d-%m-%Y") if date_atb2 else "N/A",
-            "Días de antibiótico 2": f"{(current_date - date_atb2).days + 1} días" if atb2 != "Ninguno" and date_atb2 is not None else "N/A",
+            "Días de antibiótico 2": form_days["Días de antibiótico 2"],
             "Retiro sonda foley": foley,
             "Retiro de CVC": cvc,
             "Curación por enfermería": curacion,
@@ -809,58 +541,22 @@ def main():
             "Exámenes de laboratorio": examenes,
             "Firma médico": firma
         }
-        exams_data = []
-        if 'exam_data' in st.session_state and isinstance(st.session_state.exam_data, dict):
-            date_entries = st.session_state.exam_data.get('date', [])
-            for i in range(len(date_entries)):
-                date_value = st.session_state.exam_data['date'][i]
-                if pd.notna(date_value):
-                    if isinstance(date_value, (datetime, pd.Timestamp)):
-                        formatted_date = date_value.strftime("%d-%m-%Y")
-                    elif isinstance(date_value, str):
-                        try:
-                            formatted_date = datetime.strptime(date_value, "%Y-%m-%d").strftime("%d-%m-%Y")
-                        except ValueError:
-                            formatted_date = "Invalid Date"
-                    else:
-                        formatted_date = "Unknown Date Format"
-                else:
-                    formatted_date = "N/A"
-
-                exam = {
-                    "Fecha": formatted_date,
-                    "Resultados": {
-                        col: st.session_state.exam_data[col][i]
-                        for col in st.session_state.exam_data.keys()
-                        if col != 'date' and i < len(st.session_state.exam_data[col]) and pd.notna(
-                            st.session_state.exam_data[col][i])
-                    }
-                }
-                exams_data.append(exam)
-
-        # Add processed exam data and otros examenes to the data dictionary
-        data["Exámenes"] = exams_data
+        # Add otros examenes to the data dictionary; the exam grid is saved to the lab results store
         data["Exámenes de laboratorio"] = examenes_laboratorio
         data["Exámenes imagenológicos"] = examenes_imagenologicos
         if validate_form(data):
-            patient_df = add_patient(data, patient_df)
-
-            ensure_reports_folder()
-            filename = create_word_document(data)
-            new_filename = os.path.join("reports", os.path.basename(filename))
-            os.rename(filename, new_filename)
-
-            csv_filename = save_dict_to_csv(data)
-            st.success(f"Archivo guardado: {new_filename}")
-            st.download_button(
-                label="Descargar documento Word",
-                data=open(new_filename, "rb"),
-                file_name=os.path.basename(new_filename),
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-            )
+            # The record is durably saved before anything else; the Word document is rendered by the worker pool
+            if add_patient(data) and save_lab_results(rut, st.session_state.get('exam_data')):
+                csv_filename = save_dict_to_csv(data)
+                ensure_reports_folder()
+                st.session_state.setdefault("report_jobs", []).append(report_jobs.submit_evolution_report(data))
+                st.success("Registro guardado. El documento Word se está generando.")
         else:
             st.warning("Por favor, complete todos los campos obligatorios antes de guardar.")
 
+    if st.session_state.get("report_jobs"):
+        show_report_jobs()
+
         # Add copyright and confidentiality notice
 
 if __name__ == "__main__":
@@ -1,52 +1,25 @@
 import streamlit as st
-import pandas as pd
 import os
-from datetime import datetime
-import re
+import patient_store
+import report_manifest
 
 # Constants
-PATIENT_DB_FILE = "../patient_database.csv"
 REPORTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "reports")
+SEARCH_COLUMNS = ["Rut", "Nombre"]
 
 
-def load_patient_database():
-    db_path = os.path.join(os.path.dirname(__file__), "..", PATIENT_DB_FILE)
-    if not os.path.exists(db_path):
-        st.error(f"Patient database file '{db_path}' not found.")
-        return pd.DataFrame()
+def find_patient(rut):
+    return patient_store.find_patient(rut, SEARCH_COLUMNS)
 
-    try:
-        df = pd.read_csv(db_path)
-        return df
-    except Exception as e:
-        st.error(f"Error loading patient database: {str(e)}")
-        return pd.DataFrame()
-
-
-def find_patient_reports(patient_name):
-    reports = []
-    patient_name_underscore = patient_name.replace(" ", "_")
 
+def find_patient_reports(patient_name, rut=None):
     try:
         if not os.path.exists(REPORTS_DIRECTORY):
             st.error(f"Reports directory does not exist: {REPORTS_DIRECTORY}")
             return []
 
-        pattern = re.compile(rf"{re.escape(patient_name_underscore)}_(\d{{8}}_\d{{4}}).*\.docx", re.IGNORECASE)
-
-        for filename in os.listdir(REPORTS_DIRECTORY):
-            match = pattern.match(filename)
-            if match:
-                date_time_str = match.group(1)
-                try:
-                    report_datetime = datetime.strptime(date_time_str, '%d%m%Y_%H%M')
-                    formatted_date = report_datetime.strftime('%d-%m-%Y')
-                    formatted_time = report_datetime.strftime('%H:%M')
-                    reports.append((filename, formatted_date, formatted_time))
-                except ValueError:
-                    pass  # Silently skip files with unparseable dates
-
-        return sorted(reports, key=lambda x: datetime.strptime(f"{x[1]} {x[2]}", '%d-%m-%Y %H:%M'), reverse=True)
+        return [(filename, created.strftime('%d-%m-%Y'), created.strftime('%H:%M'))
+                for filename, created in report_manifest.patient_reports(rut, patient_name, REPORTS_DIRECTORY)]
     except Exception as e:
         st.error(f"Error accessing reports directory: {str(e)}")
         return []
@@ -55,19 +28,17 @@ def find_patient_reports(patient_name):
 def main():
     st.title("Buscador de registros clínicos")
 
-    patient_df = load_patient_database()
-
     rut = st.text_input("Ingresar RUT:")
 
     if st.button("Buscar"):
         if rut:
-            patient = patient_df[patient_df["Rut"] == rut]
+            patient = find_patient(rut)
 
             if not patient.empty:
                 patient_name = patient['Nombre'].values[0]
                 st.success(f"Patient found: {patient_name}")
 
-                reports = find_patient_reports(patient_name)
+                reports = find_patient_reports(patient_name, patient['Rut'].values[0])
 
                 if reports:
                     st.subheader("Available Reports")
@@ -8,68 +8,42 @@ from docx.shared import Inches, Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 
 from docx.enum.table import WD_TABLE_ALIGNMENT
+import census
+import patient_store
+import report_jobs
+import write_behind
+from rut import rut_key, rut_keys
 
 
-# File path for the patient database
-PATIENT_DB_FILE = "../patient_database.csv"
+# Columns shown in the census grid and its exports
+LISTADO_COLUMNS = ["Rut", "Nombre", "Edad", "Fecha de ingreso", "Diagnostico", "Plan", "Ubicación", "Estado",
+                   "Fecha de alta"]
+# Patients per page in the census grid
+GRID_PAGE_SIZE = 25
 
 
-def load_patient_database():
-    if not os.path.exists(PATIENT_DB_FILE):
-        return pd.DataFrame(
-            columns=["Rut", "Nombre", "Edad", "Fecha de ingreso", "Diagnostico", "Plan", "Ubicación", "Estado",
-                     "Fecha de alta"])
-    df = pd.read_csv(PATIENT_DB_FILE)
-    if "Estado" not in df.columns:
-        df["Estado"] = "Activo"
-    if "Fecha de alta" not in df.columns:
-        df["Fecha de alta"] = None
-    # Ensure 'Rut' column exists (case-insensitive)
-    rut_column = next((col for col in df.columns if col.lower() == 'rut'), None)
-    if rut_column is None:
-        st.error("Error: La columna 'Rut' no se encuentra en el archivo CSV.")
-        return pd.DataFrame()
-    if rut_column != 'Rut':
-        df = df.rename(columns={rut_column: 'Rut'})
-    return df
+def load_patient_database(columns=None):
+    # Callers that save the frame back must load every column
+    return patient_store.load_patients(columns)
 
 
 def save_patient_database(df):
-    df.to_csv(PATIENT_DB_FILE, index=False)
+    patient_store.save_patients(df)
 
 
 def discharge_patient(rut):
-    df = load_patient_database()
-    df.loc[df["Rut"] == rut, "Estado"] = "Alta"
-    df.loc[df["Rut"] == rut, "Fecha de alta"] = datetime.now().strftime("%d-%m-%Y")
-    save_patient_database(df)
+    patient_store.update_patient(rut, {"Estado": "Alta", "Fecha de alta": pd.Timestamp(date.today())})
 
 
 def update_location(rut, new_location):
-    df = load_patient_database()
-    df.loc[df["Rut"] == rut, "Ubicación"] = new_location
-    save_patient_database(df)
+    # Location edits are coalesced per patient and written in batches, see write_behind
+    write_behind.queue_update(rut, {"Ubicación": new_location})
 
 
 def export_to_csv(df):
     return df.to_csv(index=False).encode('utf-8')
 
 
-def calculate_hospitalization_days(admission_date):
-    if pd.isna(admission_date) or admission_date == '':
-        return "N/A"
-
-    try:
-        # Parse the date in YYYY-MM-DD format
-        parsed_date = datetime.strptime(admission_date, "%Y-%m-%d").date()
-        today = date.today()
-        days = (today - parsed_date).days
-        return days
-    except ValueError as e:
-        st.error(f"Error parsing date '{admission_date}': {e}")
-        return "Formato de fecha inválido"
-
-
 def export_to_docx(df):
     doc = Document()
 
@@ -103,11 +77,12 @@ def export_to_docx(df):
         hdr_cells[i].paragraphs[0].runs[0].bold = True
         hdr_cells[i].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
 
+    df = df.assign(**{'Días de Hospitalización': census.census_days(df)['Días de hospitalización']})
     for _, row in df.iterrows():
         row_cells = table.add_row().cells
         for i, column in enumerate(headers):
-            if column == 'Días de Hospitalización':
-                value = calculate_hospitalization_days(row.get('Fecha de ingreso', "N/A"))
+            if column == 'Fecha de ingreso':
+                value = patient_store.format_date(row.get(column))
             else:
                 value = row.get(column, "N/A")
             if pd.isna(value):
@@ -125,39 +100,59 @@ def export_to_docx(df):
     docx_buffer.seek(0)
     return docx_buffer
 
+def _is_missing(value):
+    return value is None or (not isinstance(value, (list, tuple, dict)) and pd.isna(value))
+
+
+def census_report_records(df, today):
+    """Turn stored patients into the Registro clínico records of an evolution dated today."""
+    days = census.census_days(df, today).drop(columns="Hospitalizado")
+    days = days.apply(census.format_days)
+    for row, row_days in zip(df.to_dict("records"), days.to_dict("records")):
+        record = {field: "" if _is_missing(value) else value for field, value in row.items()}
+        for field in patient_store.DATE_COLUMNS:
+            if field in row:
+                record[field] = patient_store.format_date(row[field])
+        record["Fecha"] = today.strftime("%d-%m-%Y")
+        record.update(row_days)
+        for number in (1, 2):
+            record[f"Antibiótico {number}"] = record.get(f"Antibiótico {number}") or "Ninguno"
+        yield record
+
+
+def generate_census_reports():
+    """
+    Render today's evolution report of every hospitalized patient into one ZIP, replacing the previous one.
+
+    :return: The path of the ZIP file and the number of reports, or None if it could not be generated
+    """
+    try:
+        df = load_patient_database()
+        active_df = df[df["Estado"] == "Activo"]
+        today = date.today()
+        records = census_report_records(active_df, today)
+        zip_path = report_jobs.census_zip_path(datetime.now())
+        return zip_path, report_jobs.write_reports_zip(records, zip_path)
+    except Exception as e:
+        st.error(f"Error generating census reports: {str(e)}")
+        return None
+
+
 def import_from_csv(uploaded_file):
+    """Merge an uploaded census CSV into the database and return the inserted/updated/rejected counts."""
     if uploaded_file is not None:
         try:
-            new_df = pd.read_csv(uploaded_file)
-            df = load_patient_database()
-
-            # Ensure 'Rut' column exists in the uploaded file
-            rut_column = next((col for col in new_df.columns if col.lower() == 'rut'), None)
-            if rut_column is None:
-                st.error("Error: La columna 'Rut' no se encuentra en el archivo CSV cargado.")
-                return False
-            if rut_column != 'Rut':
-                new_df = new_df.rename(columns={rut_column: 'Rut'})
-
-            # Update existing patients and add new ones, avoiding duplicates
-            for _, row in new_df.iterrows():
-                if row["Rut"] in df["Rut"].values:
-                    # Update existing patient
-                    df.loc[df["Rut"] == row["Rut"], df.columns.intersection(new_df.columns)] = row
-                else:
-                    # Add new patient
-                    df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
-
-            save_patient_database(df)
-            return True
+            # Large exports are parsed and merged chunk by chunk
+            chunks = pd.read_csv(uploaded_file, chunksize=patient_store.IMPORT_CHUNK_SIZE)
+            return patient_store.bulk_upsert(chunks)
         except Exception as e:
             st.error(f"Error al cargar el archivo: {e}")
-    return False
+    return None
 
 
 def reset_to_original_database():
-    if os.path.exists(PATIENT_DB_FILE):
-        df = pd.read_csv(PATIENT_DB_FILE)
+    df = load_patient_database()
+    if not df.empty:
         # Ensure all patients are set to "Activo" and clear "Fecha de alta"
         df["Estado"] = "Activo"
         df["Fecha de alta"] = None
@@ -166,6 +161,135 @@ def reset_to_original_database():
     return False
 
 
+def display_patient_rows(active_df):
+    pending = write_behind.pending_updates()
+    col1, col2, col3, col4, col5, col6, col7, col8, col9, col10 = st.columns([2, 2, 1, 2, 1, 2, 3, 3, 2, 1])
+    col1.write("**Rut**")
+    col2.write("**Nombre**")
+    col3.write("**Edad**")
+    col4.write("**Fecha de ingreso**")
+    col5.write("**Días**")
+    col6.write("**Ubicación**")
+    col7.write("**Diagnóstico**")
+    col8.write("**Plan**")
+    col9.write("**Actualizar**")
+    col10.write("**Alta**")
+    hospitalization_days = census.format_days(census.census_days(active_df)["Días de hospitalización"])
+    for index, row in active_df.iterrows():
+        col1, col2, col3, col4, col5, col6, col7, col8, col9, col10 = st.columns([2, 2, 1, 2, 1, 2, 3, 3, 2, 1])
+        with col1:
+            st.write(str(row["Rut"]))
+        with col2:
+            st.write(row["Nombre"])
+        with col3:
+            st.write(str(row["Edad"]))
+        with col4:
+            st.write(patient_store.format_date(row["Fecha de ingreso"]))
+        with col5:
+            st.write(hospitalization_days[index].removesuffix(" días"))
+        with col6:
+            # Edits still waiting in the write-behind queue count as saved
+            saved_location = row["Ubicación"] if pd.notna(row["Ubicación"]) else ""
+            stored_location = pending.get(rut_key(row["Rut"]), {}).get("Ubicación", saved_location)
+            location = st.text_input("Ubicación", value=stored_location, key=f"location_{row['Rut']}")
+            if location != stored_location:
+                update_location(row["Rut"], location)
+        with col7:
+            st.write(row["Diagnostico"] if pd.notna(row["Diagnostico"]) else "No especificado")
+        with col8:
+            st.write(row["Plan"] if pd.notna(row["Plan"]) else "No especificado")
+        with col9:
+            if st.button("Actualizar", key=f"update_{row['Rut']}"):
+                write_behind.flush()
+                st.success("Ubicación actualizada")
+                st.rerun()
+        with col10:
+            if st.button("Alta", key=f"discharge_{row['Rut']}"):
+                discharge_patient(row["Rut"])
+                st.success("Paciente dado de alta")
+                st.rerun()
+
+
+def census_grid_frame(active_df, pending):
+    """Rows shown by the census grid, with locations still waiting in the write-behind queue applied."""
+    admission = active_df["Fecha de ingreso"]
+    days = census.census_days(active_df)
+    locations = active_df["Ubicación"].fillna("")
+    queued = rut_keys(active_df["Rut"]).map(lambda key: pending.get(key, {}).get("Ubicación"))
+    return pd.DataFrame({
+        "Rut": active_df["Rut"],
+        "Nombre": active_df["Nombre"],
+        "Edad": active_df["Edad"],
+        "Fecha de ingreso": admission.dt.date,
+        "Días": days["Días de hospitalización"],
+        "Ubicación": queued.where(queued.notna(), locations),
+        "Diagnóstico": active_df["Diagnostico"].fillna("No especificado"),
+        "Plan": active_df["Plan"].fillna("No especificado"),
+        "Alta": False,
+    }).reset_index(drop=True)
+
+
+def grid_changes(page_df, editor_state):
+    """
+    Turn the data editor's diff into census changes.
+
+    :param page_df: The rows passed to the data editor
+    :param editor_state: The editor's session state, whose "edited_rows" maps row positions to edited cells
+    :return: A tuple (dictionary of RUT to new location, list of RUTs to discharge)
+    """
+    locations = {}
+    discharges = []
+    for position, edits in editor_state.get("edited_rows", {}).items():
+        row = page_df.iloc[int(position)]
+        if "Ubicación" in edits and (edits["Ubicación"] or "") != row["Ubicación"]:
+            locations[row["Rut"]] = edits["Ubicación"] or ""
+        if edits.get("Alta"):
+            discharges.append(row["Rut"])
+    return locations, discharges
+
+
+def display_patient_grid(active_df):
+    """Census as one paginated data editor; only the edited cells come back from the browser."""
+    grid_df = census_grid_frame(active_df, write_behind.pending_updates())
+    page_count = max(1, -(-len(grid_df) // GRID_PAGE_SIZE))
+    page = st.number_input("Página", min_value=1, max_value=page_count, value=1, step=1) if page_count > 1 else 1
+    page_df = grid_df.iloc[(page - 1) * GRID_PAGE_SIZE:page * GRID_PAGE_SIZE].reset_index(drop=True)
+
+    # Bumping the version gives the editor a fresh key once its edits have been applied
+    editor_key = f"census_grid_{st.session_state.setdefault('grid_version', 0)}_{page}"
+    st.data_editor(
+        page_df,
+        key=editor_key,
+        hide_index=True,
+        use_container_width=True,
+        disabled=[col for col in page_df.columns if col not in ("Ubicación", "Alta")],
+        column_config={
+            "Fecha de ingreso": st.column_config.DateColumn("Fecha de ingreso", format="DD-MM-YYYY"),
+            "Días": st.column_config.NumberColumn("Días", format="%d"),
+            "Ubicación": st.column_config.TextColumn("Ubicación"),
+            "Alta": st.column_config.CheckboxColumn("Alta", help="Marcar para dar de alta al paciente"),
+        },
+    )
+
+    locations, discharges = grid_changes(page_df, st.session_state.get(editor_key, {}))
+    for rut, location in locations.items():
+        update_location(rut, location)
+    if discharges:
+        write_behind.flush()
+        for rut in discharges:
+            discharge_patient(rut)
+        st.session_state.grid_version += 1
+        st.success(f"{len(discharges)} paciente(s) dado(s) de alta")
+        st.rerun()
+
+    st.caption(f"{len(grid_df)} pacientes hospitalizados, página {page} de {page_count}")
+    if st.button("Actualizar"):
+        write_behind.flush()
+        st.session_state.grid_version += 1
+        st.success("Ubicación actualizada")
+        st.rerun()
+
+
 def main():
     st.set_page_config(page_title="Lista de Pacientes Hospitalizados", layout="wide")
     st.title("Lista de Pacientes Hospitalizados")
@@ -174,15 +298,22 @@ def main():
     if 'reset_clicked' not in st.session_state:
         st.session_state.reset_clicked = False
 
-    col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
+    col1, col2, col3, col4, col5 = st.columns([2, 2, 1, 1, 1])
 
     with col1:
         # Load CSV button
         uploaded_file = st.file_uploader("Cargar lista de pacientes desde CSV", type="csv")
-        if uploaded_file is not None:
-            if import_from_csv(uploaded_file):
-                st.success("Archivo CSV cargado exitosamente")
+        # The uploader keeps its file across reruns, so each upload is imported only once
+        if uploaded_file is not None and st.session_state.get("imported_file_id") != uploaded_file.file_id:
+            counts = import_from_csv(uploaded_file)
+            if counts is not None:
+                st.session_state.imported_file_id = uploaded_file.file_id
+                st.session_state.import_counts = counts
                 st.rerun()
+        if "import_counts" in st.session_state:
+            counts = st.session_state.pop("import_counts")
+            st.success(f"Archivo CSV cargado exitosamente: {counts['inserted']} nuevos, "
+                       f"{counts['updated']} actualizados, {counts['rejected']} rechazados")
 
     with col2:
         # Reset button
@@ -195,7 +326,7 @@ def main():
                 st.error("No se pudo reiniciar la base de datos")
 
     # Load patient database
-    df = load_patient_database()
+    df = load_patient_database(LISTADO_COLUMNS)
     if df.empty:
         st.error("No se pudo cargar la base de datos de pacientes.")
         return
@@ -223,49 +354,33 @@ def main():
                 mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             )
 
+    with col5:
+        # Evolution reports of the whole census for rounds
+        if not active_df.empty and st.button("Generar evoluciones"):
+            with st.spinner("Generando evoluciones..."):
+                result = generate_census_reports()
+            if result is not None:
+                st.session_state.census_reports = result
+        if "census_reports" in st.session_state:
+            zip_path, count = st.session_state.census_reports
+            if os.path.exists(zip_path):
+                with open(zip_path, "rb") as f:
+                    st.download_button(
+                        label=f"Descargar {count} evoluciones (ZIP)",
+                        data=f,
+                        file_name=os.path.basename(zip_path),
+                        mime="application/zip",
+                    )
+
     # Display patient table
     if not active_df.empty:
-        col1, col2, col3, col4, col5, col6, col7, col8, col9, col10 = st.columns([2, 2, 1, 2, 1, 2, 3, 3, 2, 1])
-        col1.write("**Rut**")
-        col2.write("**Nombre**")
-        col3.write("**Edad**")
-        col4.write("**Fecha de ingreso**")
-        col5.write("**Días**")
-        col6.write("**Ubicación**")
-        col7.write("**Diagnóstico**")
-        col8.write("**Plan**")
-        col9.write("**Actualizar**")
-        col10.write("**Alta**")
-        for index, row in active_df.iterrows():
-            col1, col2, col3, col4, col5, col6, col7, col8, col9, col10 = st.columns([2, 2, 1, 2, 1, 2, 3, 3, 2, 1])
-            with col1:
-                st.write(str(row["Rut"]))
-            with col2:
-                st.write(row["Nombre"])
-            with col3:
-                st.write(str(row["Edad"]))
-            with col4:
-                st.write(row["Fecha de ingreso"])
-            with col5:
-                hospitalization_days = calculate_hospitalization_days(row["Fecha de ingreso"])
-                st.write(f"{hospitalization_days}" if isinstance(hospitalization_days, int) else hospitalization_days)
-            with col6:
-                location = st.text_input("Ubicación", value=str(row.get("Ubicación", "")), key=f"location_{row['Rut']}")
-                if location != str(row.get("Ubicación", "")):
-                    update_location(row["Rut"], location)
-            with col7:
-                st.write(row["Diagnostico"] if pd.notna(row["Diagnostico"]) else "No especificado")
-            with col8:
-                st.write(row["Plan"] if pd.notna(row["Plan"]) else "No especificado")
-            with col9:
-                if st.button("Actualizar", key=f"update_{row['Rut']}"):
-                    st.success("Ubicación actualizada")
-                    st.rerun()
-            with col10:
-                if st.button("Alta", key=f"discharge_{row['Rut']}"):
-                    discharge_patient(row["Rut"])
-                    st.success("Paciente dado de alta")
-                    st.rerun()
+        view = st.radio("Vista", ["Tabla", "Filas"], horizontal=True,
+                        help="La tabla muestra el listado en un solo componente paginado; "
+                             "las filas muestran un formulario por paciente")
+        if view == "Tabla":
+            display_patient_grid(active_df)
+        else:
+            display_patient_rows(active_df)
     else:
         st.write("No hay pacientes hospitalizados en este momento.")
 
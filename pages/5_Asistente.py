@@ -1,71 +1,105 @@
-import os
-import tempfile
 import streamlit as st
 from langchain_community.llms import Ollama
-from langchain_community.document_loaders import DirectoryLoader
-from langchain_community.document_loaders import UnstructuredWordDocumentLoader, PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import OllamaEmbeddings
-import numpy as np
 from docx import Document
 from io import BytesIO
 
+import document_parsing
+import embedding_cache
+import report_index
+import report_manifest
+import response_cache
+import summarization
+from embedding_client import EmbeddingClient, EmbeddingError
+from lexical_index import hybrid_search, lexical_index_for
+from vector_index import VectorIndex
+
+EMBEDDING_MODEL = "nomic-embed-text"
+LLM_MODEL = "llama3.1:8b"
+
 # Initialize Ollama
-ollama = Ollama(base_url='http://localhost:11434', model="llama3.1:8b")
+ollama = Ollama(base_url='http://localhost:11434', model=LLM_MODEL)
 
-# Initialize OllamaEmbeddings
-oembed = OllamaEmbeddings(base_url="http://localhost:11434", model="nomic-embed-text")
+# Initialize the embedding client, which sends chunks to Ollama in concurrent batches
+oembed = EmbeddingClient(EMBEDDING_MODEL, base_url="http://localhost:11434")
 
 
 # Function to load and process documents
 @st.cache_resource
 def load_and_process_documents(uploaded_files):
     if uploaded_files:
-        # Create a temporary directory to store uploaded files
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Save uploaded files to the temporary directory
-            for uploaded_file in uploaded_files:
-                with open(os.path.join(temp_dir, uploaded_file.name), "wb") as f:
-                    f.write(uploaded_file.getvalue())
-
-            # Load documents from the temporary directory
-            loaders = {
-                "docx": UnstructuredWordDocumentLoader,
-                "pdf": PyPDFLoader
-            }
-            loader = DirectoryLoader(temp_dir, glob="*.*",
-                                     loader_cls=lambda file_path: loaders[file_path.split(".")[-1]](file_path))
-            documents = loader.load()
-
-            # Split the documents into chunks
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=0)
-            all_splits = text_splitter.split_documents(documents)
-
-            # Create embeddings
-            texts = [doc.page_content for doc in all_splits]
-            embeddings = oembed.embed_documents(texts)
-
-            return texts, embeddings
+        # Parse the uploads from memory, each document or group of PDF pages in its own worker process
+        files = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+        progress_bar = st.progress(0.0, text="Leyendo documentos...")
+
+        def show_parsing_progress(done, total):
+            progress_bar.progress(done / total, text=f"Leyendo documentos... {done}/{total}")
+
+        documents, errors = document_parsing.parse_documents(files, progress=show_parsing_progress)
+        for filename, error in errors:
+            st.warning(f"No se pudo leer {filename}: {error}")
+
+        # Split the documents into chunks
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=0)
+        all_splits = text_splitter.create_documents([text for text, _ in documents],
+                                                    [metadata for _, metadata in documents])
+
+        # Create embeddings, reusing those of chunks embedded before
+        texts = [doc.page_content for doc in all_splits]
+
+        def show_progress(done, total):
+            progress_bar.progress(done / total, text=f"Procesando documentos... {done}/{total} fragmentos")
+
+        try:
+            embeddings = embedding_cache.cached_embeddings(
+                lambda missing: oembed.embed_documents(missing, progress=show_progress), EMBEDDING_MODEL, texts)
+        except EmbeddingError as e:
+            st.error(f"Error al procesar los documentos: {str(e)}")
+            st.stop()
+        finally:
+            progress_bar.empty()
+
+        index = VectorIndex()
+        index.add(texts, embeddings, [doc.metadata for doc in all_splits])
+        # The inverted index for exact terms is built with the cached index and kept as long as it
+        lexical_index_for(index)
+
+        return texts, index
     else:
         return None, None
 
 
-# Function to perform similarity search
-def similarity_search(query, texts, embeddings, k=3):
-    query_embedding = oembed.embed_query(query)
-    similarities = np.dot(embeddings, query_embedding)
-    top_k_indices = np.argsort(similarities)[-k:][::-1]
-    return [texts[i] for i in top_k_indices]
+# Function to embed a question; repeated questions reuse their embedding
+def embed_query(query):
+    query_embedding, = embedding_cache.cached_embeddings(
+        lambda queries: [oembed.embed_query(text) for text in queries], f"{EMBEDDING_MODEL}:query", [query])
+    return query_embedding
+
 
+# Function to search the uploaded documents and the patient's archived reports, by exact terms and by meaning
+def similarity_search(query, indexes, k=3):
+    return hybrid_search(indexes, query, embed_query, k)
 
-# Function to generate clinical summary
-def generate_clinical_summary(texts, embeddings, patient_name):
+
+# Function to generate clinical summary; yields the text as the model writes it, or the cached summary.
+# The complete summary covers every document and day of the record instead of the most relevant chunks.
+def generate_clinical_summary(indexes, patient_name, refresh=False, complete=False):
     prompt = f"Please create a clear and comprehensive clinical summary in spanish for patient {patient_name}, including personal data (name, RUT, age, admission date), clinical diagnosis, lab results such as hematocrit, hemoglobin, sodium, white blood counts and creatinin levels,and imaging studies (ct scan and mri reports), as well as surgical and medical treatment. Provide a clear and comprehensive overview of the case, starting from the initial presentation. The use of personal data was authorized by the patient"
-    relevant_docs = similarity_search(prompt, texts, embeddings)
+    if complete:
+        progress_bar = st.progress(0.0, text="Resumiendo el registro...")
+
+        def show_progress(step, done, total):
+            progress_bar.progress(done / total if total else 1.0, text=f"Resumiendo {step}... {done}/{total}")
+
+        summary = summarization.map_reduce_summary(ollama, LLM_MODEL, summarization.summary_branches(indexes),
+                                                   prompt, refresh, show_progress)
+        progress_bar.empty()
+        return summary
+
+    relevant_docs = similarity_search(prompt, indexes)
     context = "\n".join(relevant_docs)
     full_prompt = f"Context: {context}\n\nTask: {prompt}\n\nSummary:"
-    summary = ollama.invoke(full_prompt)
-    return summary
+    return response_cache.cached_stream(LLM_MODEL, prompt, context, lambda: ollama.stream(full_prompt), refresh)
 
 
 # Function to create and download DOCX file
@@ -81,39 +115,89 @@ def create_docx(summary, patient_name):
     return docx_file
 
 
+# Function to load the archived reports index of a patient key, read again only once the indexer rewrites it
+@st.cache_resource(max_entries=32)
+def load_archive_index(key, version):
+    index = report_index.load_patient_index(key)
+    if index is not None:
+        lexical_index_for(index)
+    return index
+
+
+# Index the reports archive in the background, once per server process
+@st.cache_resource
+def start_report_indexer():
+    return report_index.start_indexer(oembed, on_update=load_archive_index.clear)
+
+
+start_report_indexer()
+
 # Streamlit UI
 st.title('Asistente médico')
 
 # Patient name input
 patient_name = st.text_input('Nombre del paciente')
+patient_rut = st.text_input('RUT del paciente (opcional)')
 
 # File upload widget
 uploaded_files = st.file_uploader("Subir documentos médicos", type=["docx", "pdf"], accept_multiple_files=True)
 
 # Load and process documents when files are uploaded
-texts, embeddings = load_and_process_documents(uploaded_files)
+texts, index = load_and_process_documents(uploaded_files)
+
+# Reports of the patient already in the archive are searched without uploading them
+archive_rut = patient_rut
+if not patient_rut and patient_name:
+    # Namesakes are never merged: with reports of several RUTs under this name, the user picks the patient
+    candidate_ruts = report_manifest.patient_ruts(patient_name)
+    if len(candidate_ruts) > 1:
+        archive_rut = st.selectbox("Hay informes de más de un paciente con este nombre. Seleccione su RUT",
+                                   candidate_ruts, index=None, placeholder="RUT del paciente")
+archive_indexes = [archive for archive in (load_archive_index(key, report_index.index_version(key))
+                                            for key in report_index.patient_keys(archive_rut, patient_name))
+                   if archive is not None]
+if archive_indexes:
+    st.caption(f"Se consultarán también {sum(len(archive) for archive in archive_indexes)} fragmentos "
+               f"de informes anteriores del paciente")
+indexes = ([index] if texts else []) + archive_indexes
 
 # Create a text input box for the user
 prompt = st.text_input('Ingresar solicitud')
 
-if prompt and texts and embeddings:
+# Answers to repeated questions about the same documents are reused unless asked otherwise, once per click
+regenerate_answer = st.button("Regenerar respuesta",
+                              help="Generar la respuesta nuevamente en lugar de usar la guardada")
+
+if prompt and indexes:
     # Perform similarity search
-    relevant_docs = similarity_search(prompt, texts, embeddings)
+    relevant_docs = similarity_search(prompt, indexes)
 
     # Prepare context for Ollama
     context = "\n".join(relevant_docs)
 
-    # Generate response using Ollama
-    full_prompt = f"Context: {context}\n\nQuestion: {prompt}\n\nAnswer:"
-    response = ollama.invoke(full_prompt)
+    # Reruns caused by other widgets show the same answer again without counting another cache lookup
+    question = response_cache.response_key(LLM_MODEL, prompt, context)
+    repeated = st.session_state.get("answered_question") == question
 
-    st.write(response)
+    # Generate response using Ollama, showing it as it is written
+    full_prompt = f"Context: {context}\n\nQuestion: {prompt}\n\nAnswer:"
+    st.write_stream(response_cache.cached_stream(LLM_MODEL, prompt, context, lambda: ollama.stream(full_prompt),
+                                                 regenerate_answer, count=not repeated))
+    st.session_state["answered_question"] = question
 
 # Add "Resumen clínico" button
-if st.button("Resumen clínico"):
-    if texts and embeddings and patient_name:
-        summary = generate_clinical_summary(texts, embeddings, patient_name)
-        st.write(summary)
+complete_summary = st.checkbox("Resumen completo del registro",
+                               help="Resumir cada documento y cada día del registro, no solo los fragmentos más "
+                                    "relevantes. Los resúmenes parciales se guardan, así que una nota nueva solo "
+                                    "resume su propia parte.")
+summary_column, regenerate_column = st.columns(2)
+summary_requested = summary_column.button("Resumen clínico")
+regenerate_summary = regenerate_column.button("Regenerar resumen",
+                                              help="Escribir el resumen nuevamente en lugar de usar el guardado")
+if summary_requested or regenerate_summary:
+    if indexes and patient_name:
+        summary = st.write_stream(generate_clinical_summary(indexes, patient_name, regenerate_summary,
+                                                            complete_summary))
 
         # Create download button for DOCX
         docx_file = create_docx(summary, patient_name)
@@ -126,7 +210,13 @@ if st.button("Resumen clínico"):
     elif not patient_name:
         st.write("Por favor, ingrese el nombre del paciente antes de generar el resumen clínico.")
     else:
-        st.write("Por favor, suba documentos médicos antes de generar el resumen clínico.")
+        st.write("Por favor, suba documentos médicos o verifique el nombre o RUT del paciente antes de generar el "
+                 "resumen clínico.")
+
+cache_stats = response_cache.stats()
+if cache_stats["lookups"]:
+    st.caption(f"Respuestas reutilizadas: {cache_stats['hit_rate']:.0%} "
+               f"({cache_stats['memory_hits'] + cache_stats['disk_hits']} de {cache_stats['lookups']} solicitudes)")
 
 st.markdown("""
     <style>
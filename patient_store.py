@@ -0,0 +1,567 @@
+import json
+import os
+import threading
+
+import pandas as pd
+import streamlit as st
+
+import dashboard_stats
+import sqlite_store
+from rut import rut_key, rut_keys, valid_ruts
+
+# The patient database lives next to the repository checkout, as the pages always assumed
+DATA_DIR = os.environ.get("EVOLUCION_DATA_DIR",
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+LEGACY_CSV_FILE = os.path.join(DATA_DIR, "patient_database.csv")
+PATIENT_STORE_FILE = os.path.join(DATA_DIR, "patient_database.parquet")
+# Writes go to an append-only journal that is folded into the store once it grows past the threshold
+JOURNAL_FILE = os.path.join(DATA_DIR, "patient_journal.jsonl")
+COMPACTING_FILE = f"{JOURNAL_FILE}.compacting"
+COMPACTION_THRESHOLD = 200
+# Row positions of each patient in the compacted store, keyed by canonical RUT
+RUT_INDEX_FILE = os.path.join(DATA_DIR, "patient_rut_index.json")
+# "parquet" (default) or "sqlite", which updates single rows in place inside transactions
+STORE_BACKEND = os.environ.get("PATIENT_STORE_BACKEND", "parquet")
+SQLITE_STORE_FILE = os.path.join(DATA_DIR, "patient_database.sqlite3")
+# Rows parsed and merged at a time when importing a census export
+IMPORT_CHUNK_SIZE = 1000
+# Running dashboard aggregates, updated with every write
+STATS_FILE = os.path.join(DATA_DIR, "patient_stats.sqlite3")
+
+DATE_COLUMNS = ["Fecha", "Fecha de ingreso", "Fecha de inicio Antibiotico 1", "Fecha de inicio Antibiotico 2",
+                "Fecha de alta"]
+INTEGER_COLUMNS = ["Edad"]
+
+# Every column written by Registro clínico plus the census fields kept by Listado de pacientes
+COLUMNS = [
+    "Rut", "Nombre", "Edad", "Sexo", "Domicilio", "Fecha", "Fecha de ingreso", "Días de hospitalización",
+    "Diagnostico", "Alergias", "Tabaquismo", "Medicamentos", "Antiagregantes plaquetarios", "Anticoagulantes",
+    "Antecedentes mórbidos", "Otra enfermedad", "Temperatura", "Frecuencia cardíaca", "Presión arterial",
+    "Saturación O2", "Anamnesis", "Examen físico", "Escala de Glasgow", "Hemiparesia", "Paraparesia",
+    "Focalidad", "Exámenes", "Exámenes de laboratorio", "Exámenes imagenológicos", "Plan", "Reposo",
+    "Tromboprofilaxis farmacológica", "Hidratación", "Régimen nutricional", "Equipo multidisciplinario",
+    "Antibiótico 1", "Fecha de inicio Antibiotico 1", "Días de antibiótico 1", "Antibiótico 2",
+    "Fecha de inicio Antibiotico 2", "Días de antibiótico 2", "Retiro sonda foley", "Retiro de CVC",
+    "Curación por enfermería", "Instalación sonda nasogástrica", "Oxigenoterapia", "Hemoglucotest",
+    "Precauciones", "Firma médico", "Ubicación", "Estado", "Fecha de alta"
+]
+
+# The store is shared by every session of the Streamlit process
+_write_lock = threading.Lock()
+_compaction_lock = threading.Lock()
+_journal_length = None
+_base_index_cache = []
+_write_counter = 0
+# Held around a store write and its aggregate update, so both see the writes of the process in the same order
+_stats_lock = threading.RLock()
+
+
+def parse_dates(values):
+    """Parse a column holding dd-mm-YYYY strings, ISO strings or datetimes into datetime64."""
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("datetime64[ns]")
+    text = values.astype("string").str.strip()
+    parsed = pd.to_datetime(text, format="%d-%m-%Y", errors="coerce")
+    missing = parsed.isna() & text.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(text[missing], format="ISO8601", errors="coerce")
+    return parsed.astype("datetime64[ns]")
+
+
+def _as_text(value):
+    # Free text may arrive as lists or numbers from the forms; the store keeps it as text
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple, dict)):
+        return str(value)
+    if pd.isna(value):
+        return None
+    return str(value)
+
+
+def coerce_types(df):
+    """Normalize column names and give every known column its store dtype."""
+    rut_column = next((col for col in df.columns if col.lower() == "rut"), None)
+    if rut_column is not None and rut_column != "Rut":
+        df = df.rename(columns={rut_column: "Rut"})
+
+    df = df.copy()
+    for col in df.columns:
+        if col in DATE_COLUMNS:
+            df[col] = parse_dates(df[col])
+        elif col in INTEGER_COLUMNS:
+            df[col] = pd.to_numeric(df[col], errors="coerce").round().astype("Int64")
+        else:
+            df[col] = df[col].map(_as_text).astype("string")
+
+    if "Estado" in df.columns:
+        df["Estado"] = df["Estado"].fillna("Activo")
+    return df
+
+
+def empty_frame(columns=None):
+    return coerce_types(pd.DataFrame(columns=columns or COLUMNS))
+
+
+def read_legacy_csv(path=LEGACY_CSV_FILE):
+    df = pd.read_csv(path)
+    if "Estado" not in df.columns:
+        df["Estado"] = "Activo"
+    if "Fecha de alta" not in df.columns:
+        df["Fecha de alta"] = None
+    return coerce_types(df)
+
+
+def _ensure_store():
+    """Convert the legacy CSV to the configured store the first time it is needed."""
+    store_file = SQLITE_STORE_FILE if STORE_BACKEND == "sqlite" else PATIENT_STORE_FILE
+    if os.path.exists(store_file) or not os.path.exists(LEGACY_CSV_FILE):
+        return
+    save_patients(read_legacy_csv())
+
+
+def _read_base():
+    """Read the compacted store and the RUT index matching that exact version of the file."""
+    if not os.path.exists(PATIENT_STORE_FILE):
+        return empty_frame(), {}
+    # Reading through one handle pins the file version even if a compaction replaces it meanwhile,
+    # so the index always matches the rows it was built for
+    with open(PATIENT_STORE_FILE, "rb") as file:
+        stat = os.fstat(file.fileno())
+        df = pd.read_parquet(file)
+        index = _read_base_index([stat.st_mtime_ns, stat.st_size], df)
+    return df, index
+
+
+def _write_base(df):
+    df = coerce_types(df.reset_index(drop=True))
+    tmp_file = f"{PATIENT_STORE_FILE}.tmp"
+    df.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, PATIENT_STORE_FILE)
+    stat = os.stat(PATIENT_STORE_FILE)
+    _write_base_index([stat.st_mtime_ns, stat.st_size], build_rut_index(df["Rut"]))
+
+
+def _to_json_values(values):
+    """Type a record like the store would and make it JSON serializable."""
+    row = coerce_types(pd.DataFrame([values])).iloc[0]
+    converted = {}
+    for col, value in row.items():
+        if pd.isna(value):
+            converted[col] = None
+        elif isinstance(value, pd.Timestamp):
+            converted[col] = value.isoformat()
+        elif col in INTEGER_COLUMNS:
+            converted[col] = int(value)
+        else:
+            converted[col] = str(value)
+    return converted
+
+
+def _read_journal(path):
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn last line from a crash mid-write; everything before it is intact
+                break
+    return entries
+
+
+def _read_journal_tail():
+    # Both journal files are read under the write lock so a concurrent rotation can't hide entries
+    with _write_lock:
+        return _read_journal(COMPACTING_FILE) + _read_journal(JOURNAL_FILE)
+
+
+def build_rut_index(ruts):
+    """Map each RUT key to the row positions holding that patient."""
+    keys = rut_keys(ruts).reset_index(drop=True)
+    return {key: positions.tolist() for key, positions in keys.groupby(keys.values).indices.items()}
+
+
+def _write_base_index(signature, index):
+    payload = {"store": signature, "positions": index}
+    tmp_file = f"{RUT_INDEX_FILE}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as file:
+        json.dump(payload, file, ensure_ascii=False)
+    os.replace(tmp_file, RUT_INDEX_FILE)
+    _base_index_cache[:] = [signature, index]
+
+
+def _read_base_index(signature, df):
+    """Index of the compacted store, loaded from disk and rebuilt only when the store file changed."""
+    if _base_index_cache and _base_index_cache[0] == signature:
+        return _base_index_cache[1]
+    if os.path.exists(RUT_INDEX_FILE):
+        with open(RUT_INDEX_FILE, encoding="utf-8") as file:
+            payload = json.load(file)
+        if payload.get("store") == signature:
+            _base_index_cache[:] = [signature, payload["positions"]]
+            return payload["positions"]
+    index = build_rut_index(df["Rut"])
+    _write_base_index(signature, index)
+    return index
+
+
+def _apply_journal(df, index, entries):
+    """
+    Replay journal entries on top of the compacted store and keep the RUT index in step.
+
+    Saved patients are overwritten in place so existing positions stay valid; only patients new to the
+    store are appended. Replaying the same entries twice gives the same result.
+    """
+    if not entries:
+        return df, index
+    index = dict(index)
+    overwrites = {}
+    partial = {}
+    duplicates = []
+    new_rows = {}
+    for entry in entries:
+        key = entry["rut"]
+        if entry["op"] == "upsert":
+            if key in new_rows:
+                new_rows[key] = dict(entry["record"])
+            elif index.get(key):
+                position = index[key][0]
+                # A patient saved more than once in the legacy CSV collapses to a single row
+                duplicates.extend(index[key][1:])
+                index[key] = [position]
+                overwrites[position] = dict(entry["record"])
+                partial.pop(position, None)
+            else:
+                new_rows[key] = dict(entry["record"])
+        elif key in new_rows:
+            new_rows[key].update(entry["fields"])
+        else:
+            for position in index.get(key, []):
+                if position in overwrites:
+                    overwrites[position].update(entry["fields"])
+                else:
+                    partial.setdefault(position, {}).update(entry["fields"])
+
+    df = df.copy()
+    if overwrites:
+        patch = coerce_types(pd.DataFrame(list(overwrites.values()), index=list(overwrites)))
+        for col in patch.columns:
+            if col not in df.columns:
+                df[col] = patch[col].iloc[:0].reindex(df.index)
+        for col in df.columns:
+            values = patch[col] if col in patch.columns else pd.Series(pd.NA, index=patch.index)
+            df.loc[patch.index, col] = values.astype(df[col].dtype).values
+    by_column = {}
+    for position, fields in partial.items():
+        for col, value in fields.items():
+            by_column.setdefault(col, {})[position] = value
+    for col, values in by_column.items():
+        typed = coerce_types(pd.DataFrame({col: list(values.values())}))[col]
+        if col not in df.columns:
+            df[col] = typed.iloc[:0].reindex(df.index)
+        df.loc[list(values), col] = typed.values
+
+    if duplicates:
+        df = df.drop(index=duplicates).reset_index(drop=True)
+        index = build_rut_index(df["Rut"])
+    if new_rows:
+        start = len(df)
+        df = pd.concat([df, coerce_types(pd.DataFrame(list(new_rows.values())))], ignore_index=True)
+        for offset, key in enumerate(new_rows):
+            index[key] = [start + offset]
+    if "Estado" in df.columns:
+        # Journaled records saved without a status are active, as they are once compacted into the base file
+        df["Estado"] = df["Estado"].fillna("Activo")
+    return df, index
+
+
+def _append_journal(entries):
+    """Durably append entries to the journal; each save costs one small write instead of a full rewrite."""
+    global _journal_length, _write_counter
+    lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+    with _write_lock:
+        with open(JOURNAL_FILE, "a", encoding="utf-8") as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+        _write_counter += 1
+        if _journal_length is None:
+            _journal_length = len(_read_journal(JOURNAL_FILE))
+        else:
+            _journal_length += len(entries)
+        needs_compaction = _journal_length >= COMPACTION_THRESHOLD
+    if needs_compaction and not _compaction_lock.locked():
+        threading.Thread(target=compact, daemon=True).start()
+
+
+def compact():
+    """Fold the journal into the columnar store in the background."""
+    global _journal_length
+    with _compaction_lock:
+        with _write_lock:
+            # A leftover file means an earlier compaction was interrupted; finish that one first
+            if not os.path.exists(COMPACTING_FILE):
+                if not os.path.exists(JOURNAL_FILE):
+                    return
+                os.replace(JOURNAL_FILE, COMPACTING_FILE)
+                _journal_length = 0
+        df, _ = _apply_journal(*_read_base(), _read_journal(COMPACTING_FILE))
+        _write_base(df)
+        os.remove(COMPACTING_FILE)
+
+
+def store_version():
+    """
+    Cheap token that changes whenever the store changes. For Parquet it is the stat of every store file
+    plus a counter bumped by each write in this process, so same-timestamp writes are not missed either;
+    SQLite keeps its own counter, bumped inside every write transaction.
+    """
+    if STORE_BACKEND == "sqlite":
+        return ("sqlite", sqlite_store.data_version(SQLITE_STORE_FILE))
+    version = [_write_counter]
+    for path in (PATIENT_STORE_FILE, COMPACTING_FILE, JOURNAL_FILE):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+
+def read_parquet_store():
+    entries = _read_journal_tail()
+    return _apply_journal(*_read_base(), entries)
+
+
+def _read_store():
+    if STORE_BACKEND == "sqlite":
+        df, index = sqlite_store.read_store(SQLITE_STORE_FILE)
+        return coerce_types(df), index
+    return read_parquet_store()
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _cached_snapshot(version):
+    # One snapshot for the whole process, shared by every session and rerun until the version changes
+    return _read_store()
+
+
+def _project(df, columns):
+    if not columns:
+        return df.copy()
+    missing = [col for col in columns if col not in df.columns]
+    projected = df[[col for col in columns if col in df.columns]].copy()
+    for col in missing:
+        projected[col] = pd.Series(pd.NA, index=df.index, dtype=empty_frame([col])[col].dtype)
+    return projected[columns]
+
+
+def load_patients_with_index(columns=None):
+    """
+    Load the patient store: the compacted columnar file merged with the journal tail, or the SQLite table.
+
+    The merged store is cached process-wide and only re-read after a write; each caller gets its own
+    copy of the requested columns, so the shared snapshot is never modified.
+
+    :param columns: Optional; only these columns are returned. Columns missing from the store are
+                    returned empty so callers can rely on them being present.
+    :return: A tuple (DataFrame with typed columns, RUT index mapping each RUT key to its row positions).
+             The index is shared, callers must not modify it.
+    """
+    try:
+        _ensure_store()
+        df, index = _cached_snapshot(store_version())
+        return _project(df, columns), index
+    except Exception as e:
+        st.error(f"Error loading patient database: {str(e)}")
+        return empty_frame(columns), {}
+
+
+def load_patients(columns=None):
+    return load_patients_with_index(columns)[0]
+
+
+def find_patient_rows(df, rut_index, rut):
+    """Rows of one patient, found through the RUT index instead of scanning the Rut column."""
+    return df.iloc[rut_index.get(rut_key(rut), [])]
+
+
+def find_patient(rut, columns=None):
+    df, rut_index = load_patients_with_index(columns)
+    return find_patient_rows(df, rut_index, rut)
+
+
+def _replace_base(df):
+    # Callers hold both locks, so no journal entry can slip in between the rewrite and the cleanup
+    global _journal_length, _write_counter
+    _write_counter += 1
+    _write_base(df)
+    for path in (JOURNAL_FILE, COMPACTING_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    _journal_length = 0
+
+
+def _remove_stats():
+    for path in (STATS_FILE, f"{STATS_FILE}-wal", f"{STATS_FILE}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _record_stats(update):
+    try:
+        update()
+    except Exception as e:
+        # The write itself succeeded; the aggregates are rebuilt from the store the next time they are read
+        print(f"Error updating dashboard statistics: {e}")
+        _remove_stats()
+
+
+def load_dashboard_stats():
+    """
+    The dashboard aggregates kept up to date by every write, see dashboard_stats.read_stats.
+    They are only computed from the whole store when they do not exist yet.
+    """
+    try:
+        stats = dashboard_stats.read_stats(STATS_FILE)
+        if stats is None:
+            _ensure_store()
+            with _stats_lock:
+                df, _ = _read_store()
+                dashboard_stats.rebuild(STATS_FILE, df)
+            stats = dashboard_stats.read_stats(STATS_FILE)
+        return stats
+    except Exception as e:
+        st.error(f"Error loading dashboard statistics: {str(e)}")
+        return None
+
+
+def save_patients(df):
+    """Rewrite the whole store atomically so readers never see a half-written file."""
+    with _stats_lock:
+        if STORE_BACKEND == "sqlite":
+            sqlite_store.replace_all(SQLITE_STORE_FILE, coerce_types(df))
+        else:
+            with _compaction_lock, _write_lock:
+                _replace_base(df)
+        _record_stats(lambda: dashboard_stats.rebuild(STATS_FILE, df))
+
+
+def _valid_import_chunks(chunks, counts):
+    for chunk in chunks:
+        chunk = coerce_types(chunk)
+        if "Rut" not in chunk.columns:
+            raise ValueError("La columna 'Rut' no se encuentra en el archivo CSV cargado.")
+        valid = valid_ruts(chunk["Rut"])
+        counts["rejected"] += int((~valid).sum())
+        chunk = chunk[valid].reset_index(drop=True)
+        chunk["Rut"] = rut_keys(chunk["Rut"])
+        # Within a chunk the last row of a patient wins, as it did when rows were applied one by one
+        chunk = chunk.drop_duplicates("Rut", keep="last").reset_index(drop=True)
+        if not chunk.empty:
+            yield chunk
+
+
+def _merge_chunk(df, index, chunk, counts):
+    """Set-based upsert of one chunk: a vectorized column update for known patients, one concat for new ones."""
+    known = chunk["Rut"].isin(list(index))
+    existing = chunk[known].assign(_positions=chunk.loc[known, "Rut"].map(index)).explode("_positions")
+    for col in chunk.columns:
+        if col not in df.columns:
+            df[col] = chunk[col].iloc[:0].reindex(df.index)
+        if not existing.empty:
+            df.loc[existing["_positions"].astype(int).values, col] = existing[col].values
+    new = chunk[~known]
+    if not new.empty:
+        start = len(df)
+        df = pd.concat([df, new], ignore_index=True)
+        for offset, key in enumerate(new["Rut"]):
+            index[key] = [start + offset]
+    counts["updated"] += int(known.sum())
+    counts["inserted"] += len(new)
+    return df
+
+
+def bulk_upsert(chunks):
+    """
+    Import patients in bulk, e.g. the hospital's daily census export.
+
+    Rows are matched on the canonical RUT: known patients get the uploaded columns updated, new ones are
+    inserted and rows whose RUT has a wrong check digit are rejected. The store is written once at the end.
+
+    :param chunks: Iterable of DataFrames, e.g. pd.read_csv(..., chunksize=IMPORT_CHUNK_SIZE)
+    :return: Dictionary with the number of inserted, updated and rejected rows
+    """
+    _ensure_store()
+    counts = {"inserted": 0, "updated": 0, "rejected": 0}
+    stats_changes = []
+
+    def valid_chunks():
+        for chunk in _valid_import_chunks(chunks, counts):
+            stats_columns = [col for col in dashboard_stats.STATS_COLUMNS if col in chunk.columns]
+            stats_changes.extend((key, fields, "merge") for key, fields in zip(
+                chunk["Rut"], chunk[stats_columns].astype(object).to_dict("records")))
+            yield chunk
+
+    with _stats_lock:
+        if STORE_BACKEND == "sqlite":
+            inserted, updated = sqlite_store.bulk_upsert(SQLITE_STORE_FILE, valid_chunks())
+            counts["inserted"] += inserted
+            counts["updated"] += updated
+        else:
+            with _compaction_lock, _write_lock:
+                df, index = _apply_journal(*_read_base(),
+                                           _read_journal(COMPACTING_FILE) + _read_journal(JOURNAL_FILE))
+                index = dict(index)
+                for chunk in valid_chunks():
+                    df = _merge_chunk(df, index, chunk, counts)
+                _replace_base(df)
+        _record_stats(lambda: dashboard_stats.record_changes(STATS_FILE, stats_changes))
+    return counts
+
+
+def upsert_patient(record):
+    """Insert or replace the record of one patient, appending it to the journal or replacing its row."""
+    _ensure_store()
+    key = rut_key(record["Rut"])
+    record = _to_json_values(dict(record, Rut=key))
+    with _stats_lock:
+        if STORE_BACKEND == "sqlite":
+            sqlite_store.upsert_patient(SQLITE_STORE_FILE, record)
+        else:
+            _append_journal([{"op": "upsert", "rut": key, "record": record}])
+        _record_stats(lambda: dashboard_stats.record_changes(STATS_FILE, [(key, record, "upsert")]))
+
+
+def update_patients(updates):
+    """
+    Change some fields of several patients in a single durable write.
+
+    :param updates: Dictionary mapping a RUT to the dictionary of fields to set on every row of that patient
+    """
+    _ensure_store()
+    updates = {rut_key(rut): _to_json_values(fields) for rut, fields in updates.items()}
+    with _stats_lock:
+        if STORE_BACKEND == "sqlite":
+            sqlite_store.update_patients(SQLITE_STORE_FILE, updates)
+        else:
+            _append_journal([{"op": "update", "rut": key, "fields": fields} for key, fields in updates.items()])
+        _record_stats(lambda: dashboard_stats.record_changes(
+            STATS_FILE, [(key, fields, "update") for key, fields in updates.items()]))
+
+
+def update_patient(rut, fields):
+    update_patients({rut: fields})
+
+
+def format_date(value, fmt="%d-%m-%Y"):
+    """Format a stored date for display, returning "N/A" for missing values."""
+    if value is None or pd.isna(value):
+        return "N/A"
+    if isinstance(value, str):
+        return value
+    return value.strftime(fmt)
@@ -0,0 +1,212 @@
+import argparse
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import closing
+
+import document_parsing
+import embedding_cache
+import patient_store
+import report_manifest
+from embedding_client import EmbeddingClient
+from rut import rut_key
+from vector_index import META_FILE, VectorIndex
+
+# One vector index per patient over the chunks of their reports, plus what was indexed from each file
+REPORT_INDEX_DIR = os.path.join(patient_store.DATA_DIR, "report_index")
+STATE_FILE = "indexed_reports.sqlite3"
+# Seconds between two scans of the reports directory by the background indexer
+POLL_SECONDS = 30
+CHUNK_SIZE = 1500
+
+_index_lock = threading.Lock()
+
+
+def patient_key(rut=None, name=None):
+    """Key of the index of a patient: their RUT, or for reports only known by filename, their name."""
+    if rut:
+        return f"rut_{rut_key(rut)}"
+    return f"nombre_{report_manifest.name_key(name)}"
+
+
+def _patient_dir(key, index_dir):
+    # RUTs that could not be parsed are kept as typed; they must still make a single directory name
+    return os.path.join(index_dir, report_manifest.name_key(key))
+
+
+def _connect(index_dir):
+    os.makedirs(index_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(index_dir, STATE_FILE), timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS files (filename TEXT PRIMARY KEY, sha256 TEXT, patient_key TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS files_patient_key ON files (patient_key)")
+    conn.execute("CREATE TABLE IF NOT EXISTS chunks (filename TEXT, position INTEGER, text TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS chunks_filename ON chunks (filename, position)")
+    return conn
+
+
+def split_text(text, chunk_size=CHUNK_SIZE):
+    """Split text into chunks of at most chunk_size characters, at line breaks where possible."""
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > chunk_size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:chunk_size])
+            line = line[chunk_size:]
+        if current and len(current) + 1 + len(line) > chunk_size:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _parse(path):
+    try:
+        return split_text(document_parsing.docx_text(path))
+    except Exception as e:
+        # Unreadable files are recorded without chunks and read again only once they change
+        print(f"No se pudo leer el informe {path}: {e}")
+        return []
+
+
+def index_reports(client, directory=report_manifest.REPORTS_DIR, index_dir=REPORT_INDEX_DIR):
+    """
+    Bring the patient indexes up to date with the reports directory.
+
+    Only files that are new or whose content changed are read, and only the indexes of their patients are
+    rebuilt, with embeddings of unchanged chunks taken from the embedding cache.
+
+    :param client: EmbeddingClient used for the chunks never embedded before
+    :return: A tuple (files indexed, files removed)
+    """
+    report_manifest.sync(directory)
+    entries = {filename: (patient_key(rut, name), sha256)
+               for filename, rut, name, sha256 in report_manifest.report_entries(directory)}
+    with _index_lock, closing(_connect(index_dir)) as conn:
+        indexed = {row[0]: row[1:] for row in conn.execute("SELECT filename, patient_key, sha256 FROM files")}
+        changed = [filename for filename, entry in entries.items() if indexed.get(filename) != entry]
+        removed = [filename for filename in indexed if filename not in entries]
+        if not changed and not removed:
+            return 0, 0
+
+        new_chunks = {filename: _parse(os.path.join(directory, filename)) for filename in changed}
+        affected = ({entries[filename][0] for filename in changed} |
+                    {indexed[filename][0] for filename in changed + removed if filename in indexed})
+        for key in affected:
+            texts, metadata = [], []
+            for filename in sorted(filename for filename, entry in entries.items() if entry[0] == key):
+                if filename in new_chunks:
+                    chunks = new_chunks[filename]
+                else:
+                    chunks = [row[0] for row in conn.execute(
+                        "SELECT text FROM chunks WHERE filename = ? ORDER BY position", (filename,))]
+                texts.extend(chunks)
+                metadata.extend({"file": filename, "position": position} for position in range(len(chunks)))
+            patient_dir = _patient_dir(key, index_dir)
+            if not texts:
+                shutil.rmtree(patient_dir, ignore_errors=True)
+                continue
+            index = VectorIndex()
+            index.add(texts, embedding_cache.cached_embeddings(client.embed_documents, client.model, texts), metadata)
+            index.save(patient_dir)
+
+        # Recorded once the indexes are saved, so files whose embedding failed are tried again on the next scan
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for filename in changed + removed:
+                conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+                conn.execute("DELETE FROM chunks WHERE filename = ?", (filename,))
+            for filename in changed:
+                conn.execute("INSERT INTO files VALUES (?, ?, ?)", (filename, entries[filename][1],
+                                                                    entries[filename][0]))
+                conn.executemany("INSERT INTO chunks VALUES (?, ?, ?)",
+                                 [(filename, position, text) for position, text in enumerate(new_chunks[filename])])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return len(changed), len(removed)
+
+
+def patient_keys(rut=None, name=None, directory=report_manifest.REPORTS_DIR):
+    """
+    Keys of the indexes of a patient: of the reports recorded with their RUT and of those only known by name.
+
+    Without a RUT, the reports recorded with a RUT under the same name are included too, but only when a single
+    RUT has that name; reports of namesakes must never be mixed, so the RUT has to be chosen then.
+    """
+    keys = []
+    if rut:
+        keys.append(patient_key(rut=rut))
+    elif name:
+        ruts = report_manifest.patient_ruts(name, directory)
+        if len(ruts) == 1:
+            keys.append(patient_key(rut=ruts[0]))
+    if name:
+        keys.append(patient_key(name=name))
+    return keys
+
+
+def index_version(key, index_dir=REPORT_INDEX_DIR):
+    """Modification time of the saved index of a patient, changed by every rebuild; None if there is none."""
+    try:
+        return os.stat(os.path.join(_patient_dir(key, index_dir), META_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_patient_index(key, index_dir=REPORT_INDEX_DIR):
+    """The saved index of a patient key, or None if it has no indexed reports."""
+    index = VectorIndex.load(_patient_dir(key, index_dir))
+    return index if index is not None and len(index) else None
+
+
+def patient_indexes(rut=None, name=None, directory=report_manifest.REPORTS_DIR, index_dir=REPORT_INDEX_DIR):
+    """The indexes of the reports of a patient, read from disk."""
+    indexes = [load_patient_index(key, index_dir) for key in patient_keys(rut, name, directory)]
+    return [index for index in indexes if index is not None]
+
+
+def start_indexer(client, directory=report_manifest.REPORTS_DIR, index_dir=REPORT_INDEX_DIR,
+                  interval=POLL_SECONDS, on_update=None):
+    """
+    Index the reports directory now and then every interval seconds in a daemon thread.
+
+    :param on_update: Optional function called after a scan saved or removed any index, e.g. to drop cached copies
+    :return: An Event that stops the thread when set
+    """
+    stop = threading.Event()
+
+    def run():
+        while True:
+            try:
+                if any(index_reports(client, directory, index_dir)) and on_update is not None:
+                    on_update()
+            except Exception as e:
+                print(f"Error al indexar los informes: {e}")
+            if stop.wait(interval):
+                return
+
+    threading.Thread(target=run, name="report-indexer", daemon=True).start()
+    return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexar los informes para el Asistente")
+    parser.add_argument("--dir", default=report_manifest.REPORTS_DIR, help="Directorio de informes")
+    parser.add_argument("--model", default="nomic-embed-text", help="Modelo de embeddings de Ollama")
+    parser.add_argument("--url", default="http://localhost:11434", help="Dirección de Ollama")
+    args = parser.parse_args()
+    indexed, removed = index_reports(EmbeddingClient(args.model, args.url), args.dir)
+    print(f"{indexed} informes indexados, {removed} eliminados del índice")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import report_manifest
+import report_templates
+
+REPORTS_DIR = report_manifest.REPORTS_DIR
+# Rendering is CPU bound, a few workers keep up with a whole ward without starving Streamlit itself
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION = 3600
+# Census ZIPs are only downloads, so they live outside the report archive and only the latest one is kept
+CENSUS_ZIP_DIR = os.path.join(tempfile.gettempdir(), "evolucion_census_reports")
+CENSUS_ZIP_PREFIX = "evoluciones_"
+
+_executor = None
+_executor_lock = threading.Lock()
+_jobs = {}
+_job_ids = itertools.count(1)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: forking the Streamlit server process with its threads is not safe
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def write_evolution_report(data, path, record=True):
+    """
+    Render the evolution report of a record to path. Runs in a worker process.
+
+    :param record: Whether to add the report to the manifest of its directory
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(report_templates.render_evolution_report(data))
+    # The file only appears under its final name once it is complete
+    os.replace(tmp_path, path)
+    if record:
+        report_manifest.record_report(path, rut=data.get("Rut"), name=data.get("Nombre"))
+    return path
+
+
+def _submit(path, data, record=True):
+    try:
+        return _get_executor().submit(write_evolution_report, data, path, record)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool and try once more
+        _reset_executor()
+        return _get_executor().submit(write_evolution_report, data, path, record)
+
+
+def _unique_name(name, used):
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in used:
+        n += 1
+        candidate = f"{stem}_{n}{ext}"
+    used.add(candidate)
+    return candidate
+
+
+def write_reports_zip(records, zip_path):
+    """
+    Render the evolution reports of several records in parallel and collect them in one ZIP file.
+
+    Each worker writes its document to a scratch directory and every file is moved into the archive as soon
+    as it is finished, so only the document being compressed is ever held in memory.
+
+    :param records: Registro clínico records
+    :param zip_path: Path of the ZIP file to create
+    :return: The number of reports in the archive
+    """
+    scratch = tempfile.mkdtemp(prefix="census_reports_", dir=os.path.dirname(os.path.abspath(zip_path)))
+    tmp_zip = f"{zip_path}.tmp"
+    futures = {}
+    try:
+        futures = {_submit(os.path.join(scratch, f"{i}.docx"), data, record=False):
+                   report_templates.evolution_report_filename(data) for i, data in enumerate(records)}
+        used = set()
+        with zipfile.ZipFile(tmp_zip, "w", zipfile.ZIP_DEFLATED) as archive:
+            for future in as_completed(futures):
+                path = future.result()
+                archive.write(path, _unique_name(futures[future], used))
+                os.remove(path)
+        os.replace(tmp_zip, zip_path)
+        return len(futures)
+    finally:
+        for future in futures:
+            future.cancel()
+        shutil.rmtree(scratch, ignore_errors=True)
+        if os.path.exists(tmp_zip):
+            os.remove(tmp_zip)
+
+
+def census_zip_path(timestamp):
+    """
+    Path for a new census ZIP, removing the ZIPs generated before it.
+
+    :param timestamp: datetime the reports are generated at, used in the file name
+    """
+    os.makedirs(CENSUS_ZIP_DIR, exist_ok=True)
+    for name in os.listdir(CENSUS_ZIP_DIR):
+        if name.startswith(CENSUS_ZIP_PREFIX) and name.endswith(".zip"):
+            try:
+                os.remove(os.path.join(CENSUS_ZIP_DIR, name))
+            except FileNotFoundError:
+                pass
+    return os.path.join(CENSUS_ZIP_DIR, f"{CENSUS_ZIP_PREFIX}{timestamp.strftime('%d%m%Y_%H%M')}.zip")
+
+
+def submit_evolution_report(data):
+    """
+    Queue the evolution report of a record that is already saved in the patient store.
+
+    :param data: Registro clínico record
+    :return: The id of the job, to be passed to job_status
+    """
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    path = os.path.abspath(os.path.join(REPORTS_DIR, report_templates.evolution_report_filename(data)))
+    future = _submit(path, data)
+    _forget_old_jobs()
+    job_id = next(_job_ids)
+    _jobs[job_id] = {"future": future, "path": path, "name": data.get("Nombre", ""), "submitted": time.time()}
+    return job_id
+
+
+def job_status(job_id):
+    """
+    :return: A tuple (status, path, error) where status is "pendiente", "listo", "error" or "desconocido"
+    """
+    job = _jobs.get(job_id)
+    if job is None:
+        return "desconocido", None, None
+    future = job["future"]
+    if not future.done():
+        return "pendiente", job["path"], None
+    error = future.exception()
+    if error is not None:
+        return "error", job["path"], error
+    return "listo", job["path"], None
+
+
+def job_name(job_id):
+    job = _jobs.get(job_id)
+    return job["name"] if job else ""
+
+
+def job_document(job_id):
+    """Bytes of the document of a finished job, read from disk once and kept while the job is remembered."""
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+    if "document" not in job:
+        with open(job["path"], "rb") as f:
+            job["document"] = f.read()
+    return job["document"]
+
+
+def _forget_old_jobs():
+    limit = time.time() - JOB_RETENTION
+    for job_id, job in list(_jobs.items()):
+        if job["submitted"] < limit and job["future"].done():
+            _jobs.pop(job_id, None)
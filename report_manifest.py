@@ -0,0 +1,173 @@
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+
+from rut import rut_key
+
+REPORTS_DIR = "reports"
+MANIFEST_FILE = "reports_manifest.sqlite3"
+# Report files are named <name>_<ddmmYYYY_HHMM>[...].docx
+REPORT_FILENAME_PATTERN = re.compile(r"^(.+?)_(\d{8}_\d{4}).*\.docx$", re.IGNORECASE)
+
+_synced = set()
+_sync_lock = threading.Lock()
+
+
+def manifest_path(directory=REPORTS_DIR):
+    return os.path.join(directory, MANIFEST_FILE)
+
+
+def name_key(name):
+    """Patient name as it appears in report filenames, lowercased for matching."""
+    return re.sub(r'[^\w\-_\. ]', '_', str(name)).replace(' ', '_').lower()
+
+
+def _connect(directory):
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(manifest_path(directory), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS reports (
+        filename TEXT PRIMARY KEY, rut_key TEXT, name_key TEXT, created TEXT, mtime REAL, size INTEGER,
+        sha256 TEXT)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS reports_rut_key ON reports (rut_key, created)")
+    conn.execute("CREATE INDEX IF NOT EXISTS reports_name_key ON reports (name_key, created)")
+    conn.execute("CREATE INDEX IF NOT EXISTS reports_mtime ON reports (mtime)")
+    return conn
+
+
+def _file_entry(path, rut=None, name=None):
+    filename = os.path.basename(path)
+    match = REPORT_FILENAME_PATTERN.match(filename)
+    created = None
+    if match:
+        try:
+            created = datetime.strptime(match.group(2), "%d%m%Y_%H%M")
+        except ValueError:
+            pass
+    stat = os.stat(path)
+    if created is None:
+        created = datetime.fromtimestamp(stat.st_mtime)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return (filename, rut_key(rut) if rut else None,
+            name_key(name) if name is not None else (match.group(1).lower() if match else None),
+            created.isoformat(), stat.st_mtime, stat.st_size, digest.hexdigest())
+
+
+def _upsert(conn, entries):
+    conn.executemany("INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?, ?)", entries)
+
+
+def record_report(path, rut=None, name=None):
+    """
+    Add a report that was just written to the manifest of its directory.
+
+    :param path: Path of the .docx file
+    :param rut: RUT of the patient, when known
+    :param name: Name of the patient; taken from the filename if not given
+    """
+    directory = os.path.dirname(path) or "."
+    with closing(_connect(directory)) as conn, conn:
+        _upsert(conn, [_file_entry(path, rut, name)])
+
+
+def sync(directory=REPORTS_DIR):
+    """
+    Reconcile the manifest with the files in the directory: index reports written outside the app and forget
+    deleted ones. Reports written by the app are recorded as they are created, so this only runs once per process.
+
+    :return: A tuple (added, removed)
+    """
+    if not os.path.exists(directory):
+        return 0, 0
+    with closing(_connect(directory)) as conn, conn:
+        known = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT filename, mtime, size FROM reports")}
+        on_disk = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(".docx"):
+                    stat = entry.stat()
+                    on_disk[entry.name] = (stat.st_mtime, stat.st_size)
+        changed = [filename for filename, signature in on_disk.items() if known.get(filename) != signature]
+        removed = [filename for filename in known if filename not in on_disk]
+        # Files rewritten in place keep the patient they were recorded with
+        keys = dict(conn.execute("SELECT filename, rut_key FROM reports"))
+        new_entries = []
+        for filename in changed:
+            entry = _file_entry(os.path.join(directory, filename))
+            new_entries.append((entry[0], keys.get(filename)) + entry[2:])
+        _upsert(conn, new_entries)
+        conn.executemany("DELETE FROM reports WHERE filename = ?", [(filename,) for filename in removed])
+    return len(changed), len(removed)
+
+
+def _ensure_synced(directory):
+    key = os.path.abspath(directory)
+    with _sync_lock:
+        if key not in _synced:
+            sync(directory)
+            _synced.add(key)
+
+
+def latest_reports(n=5, directory=REPORTS_DIR):
+    """Return the filenames of the n most recently written reports."""
+    if not os.path.exists(directory):
+        return []
+    _ensure_synced(directory)
+    with closing(_connect(directory)) as conn:
+        return [row[0] for row in conn.execute("SELECT filename FROM reports ORDER BY mtime DESC LIMIT ?", (n,))]
+
+
+def patient_reports(rut=None, name=None, directory=REPORTS_DIR):
+    """
+    Return the reports of a patient, newest first, as a list of (filename, created datetime).
+
+    Reports recorded with a RUT are matched by RUT; older ones, only known by their filename, by name.
+    """
+    if not os.path.exists(directory):
+        return []
+    _ensure_synced(directory)
+    with closing(_connect(directory)) as conn:
+        rows = conn.execute(
+            "SELECT filename, created FROM reports WHERE rut_key = ? OR (rut_key IS NULL AND name_key = ?) "
+            "ORDER BY created DESC, mtime DESC",
+            (rut_key(rut) if rut else None, name_key(name) if name is not None else None))
+        return [(filename, datetime.fromisoformat(created)) for filename, created in rows]
+
+
+def patient_ruts(name, directory=REPORTS_DIR):
+    """Return the RUT keys that reports of a patient name were recorded with, for when only the name is known."""
+    if name is None or not os.path.exists(directory):
+        return []
+    _ensure_synced(directory)
+    with closing(_connect(directory)) as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT DISTINCT rut_key FROM reports WHERE name_key = ? AND rut_key IS NOT NULL ORDER BY rut_key",
+            (name_key(name),))]
+
+
+def report_entries(directory=REPORTS_DIR):
+    """Return every report in the manifest as a list of (filename, rut_key, name_key, sha256)."""
+    if not os.path.exists(directory):
+        return []
+    with closing(_connect(directory)) as conn:
+        return conn.execute("SELECT filename, rut_key, name_key, sha256 FROM reports ORDER BY filename").fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruir el índice de informes")
+    parser.add_argument("--dir", default=REPORTS_DIR, help="Directorio de informes")
+    args = parser.parse_args()
+    added, removed = sync(args.dir)
+    print(f"{added} informes indexados, {removed} eliminados del índice")
+
+
+if __name__ == "__main__":
+    main()
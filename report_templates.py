@@ -0,0 +1,408 @@
+import functools
+import re
+import zipfile
+from datetime import datetime
+from io import BytesIO
+from xml.sax.saxutils import escape
+from zoneinfo import ZoneInfo
+
+from docx import Document
+from docx.enum.section import WD_ORIENT
+from docx.enum.table import WD_TABLE_ALIGNMENT
+from docx.enum.text import WD_LINE_SPACING, WD_ALIGN_PARAGRAPH
+from docx.shared import Inches, Pt
+
+# Placeholder text written where a field value goes while a template is laid out
+_SLOT = "⟦{}⟧"
+_SLOT_PATTERN = re.compile("⟦(\\d+)⟧")
+# Characters that are not allowed in XML text
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+EVOLUTION_SECTIONS = {
+    "Información del Paciente": ["Sexo", "Edad", "Fecha de ingreso", "Días de hospitalización", "Alergias",
+                                 "Domicilio"],
+    "Diagnóstico": ["Diagnostico", "Antecedentes mórbidos"],
+    "Comentario clínico": ["Anamnesis"],
+    "Evaluación clínica": ["Temperatura", "Frecuencia cardíaca", "Presión arterial", "Saturación O2",
+                           "Examen físico", "Escala de Glasgow", "Hemiparesia", "Paraparesia", "Focalidad",
+                           "Exámenes de laboratorio", "Exámenes imagenológicos"],
+    "Tratamiento": ["Reposo", "Tromboprofilaxis farmacológica", "Régimen nutricional", "Hidratación",
+                    "Equipo multidisciplinario"],
+    "Indicaciones enfermería": ["Retiro sonda foley", "Retiro de CVC", "Curación por enfermería",
+                                "Instalación sonda nasogástrica", "Oxigenoterapia", "Exámenes de laboratorio",
+                                "Hemoglucotest", "Precauciones"],
+    "Firma médico": ["Firma médico"]
+}
+
+
+class _Slots:
+    """Hands out placeholder tokens while a template is laid out and remembers which field each one is."""
+
+    def __init__(self):
+        self.names = []
+
+    def __call__(self, name):
+        self.names.append(name)
+        return _SLOT.format(len(self.names) - 1)
+
+
+def _xml_text(value):
+    """Escape a field value for a <w:t> element, turning line breaks and tabs into their run elements."""
+    text = escape(_INVALID_XML_CHARS.sub("", str(value)))
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = text.replace("\n", '</w:t><w:br/><w:t xml:space="preserve">')
+    return text.replace("\t", '</w:t><w:tab/><w:t xml:space="preserve">')
+
+
+class CompiledTemplate:
+    """
+    A document laid out once with python-docx and kept as raw package parts.
+
+    Rendering only splices the escaped field values into the pre-split document XML and zips the parts
+    again, so styles, fonts and table layout are never rebuilt per report.
+    """
+
+    def __init__(self, layout):
+        slots = _Slots()
+        buffer = BytesIO()
+        layout(slots).save(buffer)
+        with zipfile.ZipFile(buffer) as archive:
+            self.parts = [(info.filename, archive.read(info.filename)) for info in archive.infolist()]
+        document_xml = dict(self.parts)["word/document.xml"].decode("utf-8")
+        # Values may start or end with spaces, which Word drops unless the text is marked as preserved
+        document_xml = document_xml.replace("<w:t>", '<w:t xml:space="preserve">')
+        pieces = _SLOT_PATTERN.split(document_xml)
+        self.segments = pieces[0::2]
+        self.fields = [slots.names[int(slot)] for slot in pieces[1::2]]
+
+    def render(self, values):
+        """
+        :param values: Dictionary mapping every field of the template to its text
+        :return: The .docx file as bytes
+        """
+        xml = [self.segments[0]]
+        for field, segment in zip(self.fields, self.segments[1:]):
+            xml.append(_xml_text(values[field]))
+            xml.append(segment)
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, data in self.parts:
+                archive.writestr(name, "".join(xml).encode("utf-8") if name == "word/document.xml" else data)
+        return buffer.getvalue()
+
+
+def _set_font_size(cells, size):
+    for cell in cells:
+        for paragraph in cell.paragraphs:
+            for run in paragraph.runs:
+                run.font.size = size
+
+
+def layout_evolution_document(value, has_atb1, has_atb2):
+    """
+    Lay out the evolution report of Registro clínico.
+
+    :param value: Callable returning the text of a field; a placeholder when compiling the template
+    :param has_atb1: Whether the Antibiótico 1 cell is present
+    :param has_atb2: Whether the Antibiótico 2 cell is present
+    """
+    doc = Document()
+    section = doc.sections[0]
+    section.page_height = Inches(11)
+    section.page_width = Inches(8.5)
+    section.left_margin = section.right_margin = Inches(0.5)
+    section.top_margin = section.bottom_margin = Inches(0.3)
+    section.orientation = WD_ORIENT.PORTRAIT
+
+    # Set default paragraph format
+    style = doc.styles['Normal']
+    style.font.name = 'Arial'
+    style.font.size = Pt(10)
+    style.paragraph_format.line_spacing_rule = WD_LINE_SPACING.ONE_POINT_FIVE
+    style.paragraph_format.space_after = Pt(0)
+
+    title = doc.add_paragraph("Evolución médica neurocirugía")
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title.runs[0].font.size = Pt(12)
+    title.runs[0].font.bold = True
+
+    subtitle = doc.add_paragraph(
+        f"{value('Nombre')} , {value('Rut')} , fecha: {value('Fecha')},hora: {value('hora')}\n")
+    subtitle.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    subtitle.runs[0].font.size = Pt(12)
+
+    for section_title, fields in EVOLUTION_SECTIONS.items():
+        doc.add_paragraph().add_run(section_title).bold = True
+        if section_title == "Comentario clínico":
+            # Create a single-column table for anamnesis
+            anamnesis_table = doc.add_table(rows=1, cols=1)
+            anamnesis_table.style = 'Table Grid'
+            anamnesis_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+            anamnesis_table.columns[0].width = Inches(7.5)  # Full width of the page
+
+            anamnesis_cell = anamnesis_table.cell(0, 0)
+            p = anamnesis_cell.paragraphs[0]
+            p.add_run("Anamnesis: ").bold = True
+            p.add_run(value("Anamnesis"))
+            _set_font_size([anamnesis_cell], Pt(8))
+
+            doc.add_paragraph()
+            continue
+
+        # Create a 2-column table
+        table = doc.add_table(rows=1, cols=2)
+        table.style = 'Table Grid'
+        table.alignment = WD_TABLE_ALIGNMENT.CENTER
+        table.columns[0].width = Inches(3.75)
+        table.columns[1].width = Inches(3.75)
+
+        row_cells = table.rows[0].cells
+        for i, field in enumerate(fields):
+            if i % 2 == 0 and i > 0:
+                # Add a new row for every two fields
+                row_cells = table.add_row().cells
+            p = row_cells[i % 2].paragraphs[0]
+            p.add_run(f"{field}: ").bold = True
+            p.add_run(value(field))
+
+        doc.add_paragraph()
+        # For Información del Paciente, add an additional row for medications
+        if section_title == "Información del Paciente":
+            row_cells = table.add_row().cells
+
+            p_med = row_cells[0].paragraphs[0]
+            p_med.add_run("Medicamentos crónicos: ").bold = True
+            p_med.add_run(value("Medicamentos"))
+
+            p_anti = row_cells[1].paragraphs[0]
+            p_anti.add_run("Antiagregantes plaquetarios: ").bold = True
+            p_anti.add_run(value("Antiagregantes plaquetarios"))
+            p_anti.add_run("\n")  # Add a newline between antiagregantes and anticoagulantes
+            p_anti.add_run("Anticoagulantes: ").bold = True
+            p_anti.add_run(value("Anticoagulantes"))
+
+        # Apply smaller font size to table contents and remove extra space after each paragraph
+        for row in table.rows:
+            _set_font_size(row.cells, Pt(8))
+            for cell in row.cells:
+                for paragraph in cell.paragraphs:
+                    paragraph.paragraph_format.space_after = Pt(0)
+
+        # Add separate table for Plan after the Tratamiento section
+        if section_title == "Tratamiento":
+            doc.add_paragraph().add_run("Plan").bold = True
+            plan_table = doc.add_table(rows=1, cols=1)
+            plan_table.style = 'Table Grid'
+            plan_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+            plan_table.columns[0].width = Inches(7.5)  # Full width of the page
+
+            plan_cell = plan_table.cell(0, 0)
+            plan_cell.paragraphs[0].add_run(value("Plan"))
+            _set_font_size([plan_cell], Pt(8))
+
+            doc.add_paragraph()
+            # Add antibiotic information only if it's present
+            if has_atb1 or has_atb2:
+                doc.add_paragraph().add_run("Antibióticos").bold = True
+                atb_table = doc.add_table(rows=1, cols=2)
+                atb_table.style = 'Table Grid'
+                atb_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+                atb_table.columns[0].width = Inches(3.75)
+                atb_table.columns[1].width = Inches(3.75)
+
+                row_cells = atb_table.rows[0].cells
+                antibiotics = [number for number, present in ((1, has_atb1), (2, has_atb2)) if present]
+                for cell, number in zip(row_cells, antibiotics):
+                    p = cell.paragraphs[0]
+                    p.add_run(f"Antibiótico {number}: ").bold = True
+                    p.add_run(value(f"Antibiótico {number}"))
+                    p.add_run("\nFecha de inicio: ").bold = True
+                    p.add_run(value(f"Fecha de inicio Antibiotico {number}"))
+                    p.add_run("\nDías de tratamiento: ").bold = True
+                    p.add_run(value(f"Días de antibiótico {number}"))
+
+                for row in atb_table.rows:
+                    _set_font_size(row.cells, Pt(6))
+
+                doc.add_paragraph()
+
+    footer_paragraph = section.footer.paragraphs[0]
+    footer_paragraph.text = "Unidad de neurocirugía, Hospital de Curicó"
+    footer_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    footer_run = footer_paragraph.runs[0]
+    footer_run.font.size = Pt(6)
+    footer_run.font.name = 'Arial'
+    return doc
+
+
+def _format_admission_date(admission_date):
+    if isinstance(admission_date, str):
+        try:
+            admission_date = datetime.strptime(admission_date, "%d-%m-%Y")
+        except ValueError:
+            return admission_date
+    return admission_date.strftime("%d-%m-%Y") if hasattr(admission_date, "strftime") else str(admission_date)
+
+
+def evolution_values(data):
+    """Text of every field of the evolution report, with the defaults the report always used."""
+    values = {field: str(data[field]) if field in data else ""
+              for fields in EVOLUTION_SECTIONS.values() for field in fields}
+    if "Fecha de ingreso" in data:
+        values["Fecha de ingreso"] = _format_admission_date(data["Fecha de ingreso"])
+    values.update({
+        "Nombre": data["Nombre"],
+        "Rut": data["Rut"],
+        "Fecha": data["Fecha"],
+        "hora": datetime.now(ZoneInfo("America/Santiago")).strftime("%H:%M"),
+        "Anamnesis": data.get("Anamnesis", ""),
+        "Medicamentos": data.get("Medicamentos", "No registrados"),
+        "Antiagregantes plaquetarios": f"{data.get('Antiagregantes plaquetarios', 'No')}",
+        "Anticoagulantes": f"{data.get('Anticoagulantes', 'No')}",
+        "Plan": data.get("Plan", ""),
+    })
+    for number in (1, 2):
+        for field in (f"Antibiótico {number}", f"Fecha de inicio Antibiotico {number}",
+                      f"Días de antibiótico {number}"):
+            values[field] = f"{data.get(field, '')}"
+    return values
+
+
+@functools.lru_cache(maxsize=None)
+def evolution_template(has_atb1, has_atb2):
+    # One compiled template per antibiotic table layout, built the first time it is needed
+    return CompiledTemplate(lambda slots: layout_evolution_document(slots, has_atb1, has_atb2))
+
+
+def _antibiotic_layout(data):
+    return data.get("Antibiótico 1") != "Ninguno", data.get("Antibiótico 2") != "Ninguno"
+
+
+def render_evolution_report(data):
+    """Return the evolution report of a Registro clínico record as .docx bytes."""
+    return evolution_template(*_antibiotic_layout(data)).render(evolution_values(data))
+
+
+def build_evolution_document(data):
+    """Lay out the evolution report from scratch with python-docx, without the compiled template."""
+    values = evolution_values(data)
+    return layout_evolution_document(values.__getitem__, *_antibiotic_layout(data))
+
+
+def evolution_report_filename(data, timestamp=None):
+    # Create a filename-safe version of the patient's name
+    safe_name = re.sub(r'[^\w\-_\. ]', '_', data['Nombre'])
+    safe_name = safe_name.replace(' ', '_')
+    return f"{safe_name}_{(timestamp or datetime.now()).strftime('%d%m%Y_%H%M')}.docx"
+
+
+UPC_DETAILS = ["Ventilación Mecánica", "Drogas Vasoactivas", "Nivel de Sedación (SAS)", "Evaluación Pupilar",
+               "Examen Motor", "Herida Quirúrgica"]
+
+
+def layout_upc_document(value):
+    """Lay out the evolution report of Registro UPC. See layout_evolution_document for value."""
+    doc = Document()
+
+    # Set default paragraph format
+    style = doc.styles['Normal']
+    style.font.name = 'Arial'
+    style.font.size = Pt(10)
+    style.paragraph_format.line_spacing_rule = WD_LINE_SPACING.ONE_POINT_FIVE
+    style.paragraph_format.space_after = Pt(0)
+
+    section = doc.sections[0]
+    section.page_height = Inches(11)
+    section.page_width = Inches(8.5)
+    section.left_margin = section.right_margin = Inches(1)
+    section.top_margin = section.bottom_margin = Inches(1)
+
+    title = doc.add_paragraph("Evolución médica neurocirugía UPC")
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title.runs[0].font.size = Pt(14)
+    title.runs[0].font.bold = True
+
+    subtitle = doc.add_paragraph(f"Fecha y hora: {value('Fecha y hora')}")
+    subtitle.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    subtitle.runs[0].font.size = Pt(10)
+
+    def add_label_table(labels, label_width, value_width):
+        table = doc.add_table(rows=len(labels), cols=2)
+        table.style = 'Table Grid'
+        table.alignment = WD_TABLE_ALIGNMENT.CENTER
+        table.columns[0].width = label_width
+        table.columns[1].width = value_width
+        for row, label in zip(table.rows, labels):
+            row.cells[0].text = label
+            row.cells[1].text = value(label)
+        return table
+
+    def add_text_table(field):
+        table = doc.add_table(rows=1, cols=1)
+        table.style = 'Table Grid'
+        table.alignment = WD_TABLE_ALIGNMENT.CENTER
+        table.rows[0].cells[0].text = value(field)
+        table.columns[0].width = Inches(6.5)
+
+    # Patient Information Table
+    patient_table = add_label_table(["Nombre", "RUT", "Edad", "Diagnóstico"], Inches(1.5), Inches(5.0))
+    patient_table.autofit = False
+
+    doc.add_paragraph()
+    doc.add_paragraph().add_run("Evaluación Clínica").bold = True
+    add_text_table("Evaluación Clínica")
+
+    doc.add_paragraph()
+    doc.add_paragraph().add_run("Detalles de Evaluación Clínica").bold = True
+    add_label_table(UPC_DETAILS, Inches(2.0), Inches(4.5))
+
+    doc.add_paragraph()
+    doc.add_paragraph().add_run("Escala de Coma de Glasgow").bold = True
+    add_text_table("Escala de Coma de Glasgow")
+
+    doc.add_paragraph()
+    doc.add_paragraph().add_run("Estudios Clínicos").bold = True
+    add_label_table(["Exámenes de Laboratorio", "Estudios de Imagen"], Inches(2.0), Inches(4.5))
+
+    doc.add_paragraph()
+    doc.add_paragraph().add_run("Plan de Tratamiento").bold = True
+    add_text_table("Plan de Tratamiento")
+
+    # Apply consistent formatting to all paragraphs and table cells
+    for paragraph in doc.paragraphs:
+        paragraph.style = doc.styles['Normal']
+        for run in paragraph.runs:
+            run.font.size = Pt(10)
+
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for paragraph in cell.paragraphs:
+                    paragraph.style = doc.styles['Normal']
+                    paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
+                    for run in paragraph.runs:
+                        run.font.size = Pt(10)
+    return doc
+
+
+@functools.lru_cache(maxsize=None)
+def upc_template():
+    return CompiledTemplate(layout_upc_document)
+
+
+def upc_values(data):
+    values = {field: str(data[field]) for field in ["Nombre", "RUT", "Edad", "Diagnóstico", "Evaluación Clínica",
+                                                    "Escala de Coma de Glasgow", "Exámenes de Laboratorio",
+                                                    "Estudios de Imagen", "Plan de Tratamiento"] + UPC_DETAILS}
+    values["Fecha y hora"] = datetime.now().strftime("%d-%m-%Y %H:%M")
+    return values
+
+
+def render_upc_report(data):
+    """Return the Registro UPC report as .docx bytes."""
+    return upc_template().render(upc_values(data))
+
+
+def upc_report_filename(data, timestamp=None):
+    return (f"Evolucion_medica_neurocirugia_UPC_{data['Nombre']}_"
+            f"{(timestamp or datetime.now()).strftime('%d%m%Y_%H%M')}.docx")
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import closing
+
+import patient_store
+
+# Answers of the Asistente, keyed by model, question and the context retrieved for it
+RESPONSE_CACHE_FILE = os.path.join(patient_store.DATA_DIR, "response_cache.sqlite3")
+# Answers kept in memory, most recently used first, and on disk
+MEMORY_ENTRIES = 256
+DISK_ENTRIES = 5000
+# Answers older than this are generated again
+RESPONSE_TTL_SECONDS = 7 * 24 * 3600
+
+_lock = threading.Lock()
+_memory = OrderedDict()
+_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def normalize_prompt(prompt):
+    """Lowercase the prompt, drop accents and collapse whitespace, so "Último  sodio" and "ultimo sodio" match."""
+    text = unicodedata.normalize("NFKD", str(prompt).casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", text).strip().rstrip("?.!¿¡ ")
+
+
+def response_key(model, prompt, context):
+    context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{model}\0{normalize_prompt(prompt)}\0{context_hash}".encode("utf-8")).hexdigest()
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS responses "
+                 "(key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, last_used REAL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+    return conn
+
+
+def get(key, path=RESPONSE_CACHE_FILE, count=True):
+    """
+    Return the cached answer, or None if there is none or it expired.
+
+    :param count: Whether the lookup counts in stats; internal lookups, like those of partial summaries, do not
+    """
+    now = time.time()
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None and now - entry[1] <= RESPONSE_TTL_SECONDS:
+            _memory.move_to_end(key)
+            if count:
+                _counters["memory_hits"] += 1
+            return entry[0]
+        _memory.pop(key, None)
+        row = None
+        if os.path.exists(path):
+            with closing(_connect(path)) as conn:
+                row = conn.execute("SELECT response, created FROM responses WHERE key = ? AND created >= ?",
+                                   (key, now - RESPONSE_TTL_SECONDS)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        if row is None:
+            if count:
+                _counters["misses"] += 1
+            return None
+        if count:
+            _counters["disk_hits"] += 1
+        _remember(key, row[0], row[1])
+        return row[0]
+
+
+def _remember(key, response, created):
+    _memory[key] = (response, created)
+    _memory.move_to_end(key)
+    while len(_memory) > MEMORY_ENTRIES:
+        _memory.popitem(last=False)
+
+
+def put(key, model, response, path=RESPONSE_CACHE_FILE):
+    now = time.time()
+    with _lock:
+        _remember(key, response, now)
+        with closing(_connect(path)) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                             (key, model, response, now, now))
+                conn.execute("DELETE FROM responses WHERE created < ?", (now - RESPONSE_TTL_SECONDS,))
+                conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                             "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (DISK_ENTRIES,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+
+def cached_stream(model, prompt, context, generate, refresh=False, path=RESPONSE_CACHE_FILE, count=True):
+    """
+    Yield the answer to prompt from the cache, or stream it from generate and cache it once complete.
+
+    :param generate: Function returning an iterator of text chunks, e.g. lambda: ollama.stream(full_prompt)
+    :param refresh: Generate the answer again even if it is cached
+    :param count: Whether the lookup counts in stats; see get
+    """
+    key = response_key(model, prompt, context)
+    if not refresh:
+        response = get(key, path, count)
+        if response is not None:
+            yield response
+            return
+    chunks = []
+    for chunk in generate():
+        chunks.append(chunk)
+        yield chunk
+    # Only complete answers are cached; an interrupted stream never gets here
+    put(key, model, "".join(chunks), path)
+
+
+def stats():
+    """:return: Dictionary with memory_hits, disk_hits, misses, lookups and hit_rate of this process"""
+    with _lock:
+        counters = dict(_counters)
+    counters["lookups"] = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+    hits = counters["memory_hits"] + counters["disk_hits"]
+    counters["hit_rate"] = hits / counters["lookups"] if counters["lookups"] else 0.0
+    return counters
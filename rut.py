@@ -0,0 +1,72 @@
+import re
+
+import pandas as pd
+
+RUT_PATTERN = r"^0*(\d{1,9})([0-9K])$"
+
+
+def compute_check_digit(body):
+    """Return the modulo 11 check digit ("0"-"9" or "K") of the numeric part of a RUT."""
+    total = 0
+    factor = 2
+    for digit in reversed(str(body)):
+        total += int(digit) * factor
+        factor = 2 if factor == 7 else factor + 1
+    remainder = 11 - total % 11
+    if remainder == 11:
+        return "0"
+    if remainder == 10:
+        return "K"
+    return str(remainder)
+
+
+def normalize_rut(value):
+    """
+    Return the canonical form of a RUT ("12345678-5", no dots, uppercase K).
+
+    :param value: RUT as typed by the user, with or without dots and dash
+    :return: The canonical RUT, or None if the value does not look like a RUT
+    """
+    if value is None or pd.isna(value):
+        return None
+    cleaned = re.sub(r"[^0-9K]", "", str(value).upper())
+    match = re.match(RUT_PATTERN, cleaned)
+    if not match:
+        return None
+    return f"{match.group(1)}-{match.group(2)}"
+
+
+def is_valid_rut(value):
+    canonical = normalize_rut(value)
+    if canonical is None:
+        return False
+    body, check_digit = canonical.split("-")
+    return compute_check_digit(body) == check_digit
+
+
+def rut_key(value):
+    """Key used to index patients: the canonical RUT, or the trimmed value when it can't be parsed."""
+    canonical = normalize_rut(value)
+    if canonical is not None:
+        return canonical
+    if value is None or pd.isna(value):
+        return None
+    return str(value).strip().upper()
+
+
+def rut_keys(values):
+    """Vectorized rut_key for a whole column."""
+    text = pd.Series(values).astype("string")
+    parts = text.str.upper().str.replace(r"[^0-9K]", "", regex=True).str.extract(RUT_PATTERN)
+    return (parts[0] + "-" + parts[1]).fillna(text.str.strip().str.upper())
+
+
+def valid_ruts(values):
+    """Vectorized is_valid_rut: a boolean Series telling which values carry a correct check digit."""
+    text = pd.Series(values).astype("string")
+    parts = text.str.upper().str.replace(r"[^0-9K]", "", regex=True).str.extract(RUT_PATTERN)
+    body = parts[0].fillna("0").str.zfill(9)
+    total = sum(body.str[position].astype(int) * (2 + (8 - position) % 6) for position in range(9))
+    remainder = 11 - total % 11
+    expected = remainder.astype(str).replace({"11": "0", "10": "K"})
+    return (parts[1] == expected).fillna(False).astype(bool).set_axis(text.index)
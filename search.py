@@ -1,24 +1,19 @@
 import streamlit as st
-import pandas as pd
 import csv
 from io import StringIO
 import base64
+import patient_store
 
 
 # Function to load the patient database
-def load_patient_database(file_path):
-    try:
-        df = pd.read_csv(file_path)
-        df['Fecha'] = pd.to_datetime(df['Fecha'], format='%d-%m-%Y', errors='coerce')
-        return df
-    except Exception as e:
-        st.error(f"Error loading patient database: {str(e)}")
-        return pd.DataFrame()
+def load_patient_database():
+    # Dates come back typed from the store, no per-load parsing needed
+    return patient_store.load_patients_with_index()
 
 
 # Function to search for patient records
-def search_patient_records(df, rut):
-    return df[df['Rut'] == rut].sort_values('Fecha', ascending=False)
+def search_patient_records(df, rut_index, rut):
+    return patient_store.find_patient_rows(df, rut_index, rut).sort_values('Fecha', ascending=False)
 
 
 # Function to create a downloadable link for CSV data
@@ -34,8 +29,7 @@ def main():
     st.title("Patient Data Search and Download")
 
     # Load the patient database
-    db_file = "patient_database.csv"  # Update this with your actual database file path
-    df = load_patient_database(db_file)
+    df, rut_index = load_patient_database()
 
     if df.empty:
         st.warning("No patient data available.")
@@ -46,7 +40,7 @@ def main():
 
     if rut:
         # Search for patient records
-        patient_records = search_patient_records(df, rut)
+        patient_records = search_patient_records(df, rut_index, rut)
 
         if patient_records.empty:
             st.warning("No records found for this RUT.")
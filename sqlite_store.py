@@ -0,0 +1,242 @@
+import argparse
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+import dashboard_stats
+from rut import rut_key, rut_keys
+
+POOL_SIZE = 4
+# SQLite builds before 3.32 accept at most 999 bound parameters per statement
+MAX_PARAMETERS = 900
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class ConnectionPool:
+    """A small pool of WAL-mode connections shared by every session of the Streamlit process."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.columns = None
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS patients (rut_key TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS patients_rut_key ON patients (rut_key)")
+            conn.execute("CREATE TABLE IF NOT EXISTS store_meta (version INTEGER NOT NULL)")
+            if conn.execute("SELECT COUNT(*) FROM store_meta").fetchone()[0] == 0:
+                conn.execute("INSERT INTO store_meta (version) VALUES (0)")
+            self.refresh_columns(conn)
+            if "Estado" in self.columns:
+                conn.execute("CREATE INDEX IF NOT EXISTS patients_estado ON patients (\"Estado\")")
+
+    def refresh_columns(self, conn):
+        self.columns = [row[1] for row in conn.execute("PRAGMA table_info(patients)")]
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Every committed census change must survive a power cut
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            conn = self._connect() if create else self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE takes the write lock up front, so concurrent writers queue instead of failing."""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("UPDATE store_meta SET version = version + 1")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                # Columns added inside the rolled back transaction are gone again
+                self.refresh_columns(conn)
+                raise
+
+    def ensure_columns(self, conn, names):
+        for name in names:
+            if name not in self.columns:
+                conn.execute(f"ALTER TABLE patients ADD COLUMN {_quote(name)}")
+                self.columns.append(name)
+                if name == "Estado":
+                    conn.execute("CREATE INDEX IF NOT EXISTS patients_estado ON patients (\"Estado\")")
+
+
+def get_pool(path):
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path)
+        return _pools[path]
+
+
+def data_version(path):
+    with get_pool(path).connection() as conn:
+        return conn.execute("SELECT version FROM store_meta").fetchone()[0]
+
+
+def read_store(path):
+    """Return the raw patient table (untyped) and the RUT index of its row positions."""
+    pool = get_pool(path)
+    with pool.connection() as conn:
+        df = pd.read_sql_query("SELECT * FROM patients ORDER BY rowid", conn)
+    keys = df.pop("rut_key")
+    index = {key: positions.tolist() for key, positions in keys.groupby(keys.values).indices.items()}
+    return df, index
+
+
+def _insert(conn, pool, record):
+    pool.ensure_columns(conn, record)
+    names = ["rut_key"] + list(record)
+    placeholders = ", ".join("?" for _ in names)
+    conn.execute(f"INSERT INTO patients ({', '.join(_quote(name) for name in names)}) VALUES ({placeholders})",
+                 [rut_key(record.get("Rut"))] + list(record.values()))
+
+
+def upsert_patient(path, record):
+    """Replace the row of a patient in place, or insert it if the patient is new."""
+    pool = get_pool(path)
+    key = rut_key(record.get("Rut"))
+    with pool.transaction() as conn:
+        rowids = [row[0] for row in conn.execute("SELECT rowid FROM patients WHERE rut_key = ? ORDER BY rowid",
+                                                 (key,))]
+        if not rowids:
+            _insert(conn, pool, record)
+            return
+        pool.ensure_columns(conn, record)
+        names = [name for name in pool.columns if name != "rut_key"]
+        assignments = ", ".join(f"{_quote(name)} = ?" for name in names)
+        conn.execute(f"UPDATE patients SET {assignments} WHERE rowid = ?",
+                     [record.get(name) for name in names] + [rowids[0]])
+        # A patient saved more than once in the legacy CSV collapses to a single row
+        conn.executemany("DELETE FROM patients WHERE rowid = ?", [(rowid,) for rowid in rowids[1:]])
+
+
+def update_patients(path, updates):
+    """
+    Apply field changes to several patients in one transaction.
+
+    :param updates: Dictionary mapping a RUT key to the dictionary of fields to set
+    """
+    pool = get_pool(path)
+    with pool.transaction() as conn:
+        for key, fields in updates.items():
+            pool.ensure_columns(conn, fields)
+            assignments = ", ".join(f"{_quote(name)} = ?" for name in fields)
+            conn.execute(f"UPDATE patients SET {assignments} WHERE rut_key = ?", list(fields.values()) + [key])
+
+
+def _to_sql_values(df):
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].map(lambda value: value.isoformat() if pd.notna(value) else None)
+        else:
+            df[col] = df[col].astype(object).where(df[col].notna(), None)
+    return df
+
+
+def replace_all(path, df):
+    """Replace the whole table, e.g. when migrating or resetting the census."""
+    pool = get_pool(path)
+    df = _to_sql_values(df)
+    names = ["rut_key"] + list(df.columns)
+    placeholders = ", ".join("?" for _ in names)
+    rows = zip(rut_keys(df["Rut"]).tolist(), *(df[col].tolist() for col in df.columns))
+    with pool.transaction() as conn:
+        pool.ensure_columns(conn, df.columns)
+        conn.execute("DELETE FROM patients")
+        conn.executemany(f"INSERT INTO patients ({', '.join(_quote(name) for name in names)}) "
+                         f"VALUES ({placeholders})", rows)
+
+
+def bulk_upsert(path, chunks):
+    """
+    Update known patients and insert new ones, all chunks in a single transaction.
+
+    :param chunks: Iterable of typed DataFrames whose "Rut" column already holds RUT keys
+    :return: A tuple (inserted, updated)
+    """
+    pool = get_pool(path)
+    inserted = updated = 0
+    with pool.transaction() as conn:
+        for chunk in chunks:
+            chunk = _to_sql_values(chunk)
+            pool.ensure_columns(conn, chunk.columns)
+            keys = chunk["Rut"].tolist()
+            known = set()
+            for start in range(0, len(keys), MAX_PARAMETERS):
+                batch = keys[start:start + MAX_PARAMETERS]
+                known.update(row[0] for row in conn.execute(
+                    f"SELECT DISTINCT rut_key FROM patients WHERE rut_key IN ({', '.join('?' for _ in batch)})",
+                    batch))
+            is_known = chunk["Rut"].isin(known)
+
+            assignments = ", ".join(f"{_quote(name)} = ?" for name in chunk.columns)
+            conn.executemany(f"UPDATE patients SET {assignments} WHERE rut_key = ?",
+                             zip(*(chunk.loc[is_known, col].tolist() for col in chunk.columns),
+                                 chunk.loc[is_known, "Rut"].tolist()))
+
+            names = ["rut_key"] + list(chunk.columns)
+            new = chunk[~is_known]
+            conn.executemany(f"INSERT INTO patients ({', '.join(_quote(name) for name in names)}) "
+                             f"VALUES ({', '.join('?' for _ in names)})",
+                             zip(new["Rut"].tolist(), *(new[col].tolist() for col in new.columns)))
+            updated += int(is_known.sum())
+            inserted += len(new)
+    return inserted, updated
+
+
+def main():
+    import patient_store
+
+    parser = argparse.ArgumentParser(description="Herramientas de la base de datos SQLite de pacientes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Copiar la base de datos existente a SQLite")
+    migrate.add_argument("--csv", default=patient_store.LEGACY_CSV_FILE, help="CSV de origen")
+    migrate.add_argument("--from-parquet", action="store_true",
+                         help="Copiar desde el almacenamiento Parquet en lugar del CSV")
+    migrate.add_argument("--db", default=patient_store.SQLITE_STORE_FILE, help="Archivo SQLite de destino")
+    args = parser.parse_args()
+
+    if args.from_parquet:
+        df, _ = patient_store.read_parquet_store()
+    else:
+        df = patient_store.read_legacy_csv(args.csv)
+    replace_all(args.db, df)
+    if os.path.abspath(args.db) == os.path.abspath(patient_store.SQLITE_STORE_FILE):
+        # The dashboard aggregates describe the store just replaced
+        dashboard_stats.rebuild(patient_store.STATS_FILE, df)
+    print(f"{len(df)} registros copiados a {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import response_cache
+from report_manifest import REPORT_FILENAME_PATTERN
+
+# LLM requests in flight while summarizing; Ollama queues whatever its parallelism does not take
+MAX_CONCURRENCY = 4
+# Summaries merged by one request at each level of the reduction
+REDUCE_FANOUT = 8
+
+CHUNK_PROMPT = ("Summarize in spanish the clinically relevant facts of this fragment of a patient's medical record: "
+                "diagnoses, procedures, treatments with doses and dates, lab results with values and dates, "
+                "imaging findings and clinical evolution. Do not add information that is not in the fragment.")
+BRANCH_PROMPT = ("Merge in spanish these summaries of consecutive fragments of {label} of a patient's medical record "
+                 "into one chronological summary, keeping every value, date and treatment.")
+MERGE_PROMPT = ("Merge in spanish these chronological summaries of parts of a patient's medical record into one "
+                "chronological summary, keeping the relevant values, dates and treatments.")
+
+
+def report_day(filename):
+    """Date of a report from its filename, or None for documents not named like reports."""
+    match = REPORT_FILENAME_PATTERN.match(filename or "")
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(2), "%d%m%Y_%H%M").date()
+    except ValueError:
+        return None
+
+
+def summary_branches(indexes):
+    """
+    Group the chunks of vector indexes into the branches summarized separately: one per day for the archived reports
+    and one per uploaded document.
+
+    :return: List of (label, chunk texts), days in chronological order and then documents in upload order
+    """
+    days = {}
+    documents = {}
+    for index in indexes:
+        for text, metadata in zip(index.texts, index.metadata):
+            source = metadata.get("file") or metadata.get("source") or ""
+            day = report_day(source)
+            if day is not None:
+                days.setdefault(day, []).append(text)
+            else:
+                documents.setdefault(source, []).append(text)
+    return ([(f"el día {day:%d-%m-%Y}", chunks) for day, chunks in sorted(days.items())] +
+            [(f"el documento {source or 'sin nombre'}", chunks) for source, chunks in documents.items()])
+
+
+def _summarize_all(llm, model, requests, executor, progress):
+    """
+    Answer (prompt, context) requests, taking those answered before from the response cache.
+
+    :return: List of answers in the order of requests
+    """
+    # Partial summaries are not answers shown to the user, so they stay out of the cache statistics
+    answers = [response_cache.get(response_cache.response_key(model, prompt, context), count=False)
+               for prompt, context in requests]
+    missing = [i for i, answer in enumerate(answers) if answer is None]
+
+    def summarize(i):
+        prompt, context = requests[i]
+        answer = llm.invoke(f"Context: {context}\n\nTask: {prompt}\n\nSummary:")
+        response_cache.put(response_cache.response_key(model, prompt, context), model, answer)
+        return i, answer
+
+    done = len(requests) - len(missing)
+    if progress is not None:
+        progress(done, len(requests))
+    for future in as_completed([executor.submit(summarize, i) for i in missing]):
+        i, answer = future.result()
+        answers[i] = answer
+        done += 1
+        if progress is not None:
+            progress(done, len(requests))
+    return answers
+
+
+def map_reduce_summary(llm, model, branches, prompt, refresh=False, progress=None):
+    """
+    Summarize a whole record: every chunk, then each branch from its chunk summaries, then groups of REDUCE_FANOUT
+    branches until few enough are left for the final summary.
+
+    Every intermediate summary is cached by the hash of its input, so a new note only costs the summaries of its
+    chunk, its branch and the groups above it.
+
+    :param llm: Ollama LLM, used through invoke and stream
+    :param branches: List of (label, chunk texts) from summary_branches
+    :param prompt: Task of the final summary
+    :param refresh: Write the final summary again even if it is cached
+    :param progress: Optional function called with (step, done, total) as intermediate summaries complete
+    :return: Iterator of the text of the final summary
+    """
+    def step_progress(step):
+        return None if progress is None else lambda done, total: progress(step, done, total)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+        chunks = [(label, chunk) for label, branch in branches for chunk in branch]
+        chunk_summaries = iter(_summarize_all(llm, model, [(CHUNK_PROMPT, chunk) for _, chunk in chunks],
+                                              executor, step_progress("fragmentos")))
+        grouped = [(label, [next(chunk_summaries) for _ in branch]) for label, branch in branches]
+
+        # Branches of a single chunk already have their summary
+        merge = [i for i, (_, summaries) in enumerate(grouped) if len(summaries) > 1]
+        merged = _summarize_all(llm, model, [(BRANCH_PROMPT.format(label=grouped[i][0]), "\n\n".join(grouped[i][1]))
+                                             for i in merge], executor, step_progress("días y documentos"))
+        summaries = [f"Resumen de {label}:\n{summaries[0]}" for label, summaries in grouped]
+        for i, summary in zip(merge, merged):
+            summaries[i] = f"Resumen de {grouped[i][0]}:\n{summary}"
+
+        # Groups keep chronological order, so a new day only changes the last group of each level
+        while len(summaries) > REDUCE_FANOUT:
+            groups = ["\n\n".join(summaries[start:start + REDUCE_FANOUT])
+                      for start in range(0, len(summaries), REDUCE_FANOUT)]
+            summaries = _summarize_all(llm, model, [(MERGE_PROMPT, group) for group in groups], executor,
+                                       step_progress("etapas"))
+
+    context = "\n\n".join(summaries)
+    full_prompt = f"Context: {context}\n\nTask: {prompt}\n\nSummary:"
+    return response_cache.cached_stream(model, prompt, context, lambda: llm.stream(full_prompt), refresh)
@@ -0,0 +1,54 @@
+"""
+Compare embedding throughput one text per request against batched concurrent requests, on the stub server.
+
+    python tools/bench_embeddings.py [--texts 400] [--batch-size 32] [--concurrency 4] [--fail-rate 0.05]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from embedding_client import DOCUMENT_PREFIX, EmbeddingClient  # noqa: E402
+from stub_embedding_server import start_server, stub_embedding  # noqa: E402
+
+
+def texts_per_second(client, texts):
+    start = time.perf_counter()
+    embeddings = client.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    return len(texts) / elapsed, embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--texts", type=int, default=400, help="Chunks embedded by each configuration")
+    parser.add_argument("--batch-size", type=int, default=32, help="Texts per request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Stub latency per request")
+    parser.add_argument("--per-text-ms", type=float, default=2, help="Stub latency per text")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests failed by the stub")
+    args = parser.parse_args()
+
+    server = start_server(0, args.latency_ms, args.per_text_ms, args.fail_rate)
+    url = f"http://127.0.0.1:{server.server_port}"
+    texts = [f"Evolución día {i}: paciente estable, sin déficit focal." for i in range(args.texts)]
+    try:
+        serial, _ = texts_per_second(EmbeddingClient("stub", url, batch_size=1, concurrency=1, backoff=0.01), texts)
+        batched, embeddings = texts_per_second(
+            EmbeddingClient("stub", url, batch_size=args.batch_size, concurrency=args.concurrency, backoff=0.01),
+            texts)
+    finally:
+        server.shutdown()
+
+    if any(embedding != stub_embedding(DOCUMENT_PREFIX + text) for text, embedding in zip(texts, embeddings)):
+        print("Warning: embeddings were returned out of order")
+    print(f"One text per request: {serial:8.1f} texts/s")
+    print(f"Batched, concurrent:  {batched:8.1f} texts/s ({batched / serial:.1f}x)")
+    print(f"Requests served: {server.requests}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Compare how many evolution reports per second the original python-docx code writes against the compiled template.
+
+    python tools/bench_reports.py [--reports 200]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from docx import Document
+from docx.enum.section import WD_ORIENT
+from docx.enum.table import WD_TABLE_ALIGNMENT
+from docx.enum.text import WD_LINE_SPACING, WD_ALIGN_PARAGRAPH
+from docx.shared import Inches, Pt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import report_templates  # noqa: E402
+
+SAMPLE_RECORD = {
+    "Nombre": "Paciente de Prueba", "Rut": "12345678-5", "Fecha": "17-10-2026", "Sexo": "Femenino", "Edad": 64,
+    "Fecha de ingreso": "10-10-2026", "Días de hospitalización": "7 días", "Alergias": "No", "Domicilio": "Curicó",
+    "Medicamentos": "Losartán 50 mg/día", "Antiagregantes plaquetarios": "No", "Anticoagulantes": "No",
+    "Diagnostico": "Hematoma subdural crónico", "Antecedentes mórbidos": "HTA, DM2",
+    "Anamnesis": "Paciente evoluciona estable.\nSin cefalea ni vómitos. Drenaje con débito < 50 ml & claro.",
+    "Temperatura": "36,8", "Frecuencia cardíaca": "78", "Presión arterial": "130/80", "Saturación O2": "97",
+    "Examen físico": "Vigil, orientada", "Escala de Glasgow": "15", "Hemiparesia": "No", "Paraparesia": "No",
+    "Focalidad": "No", "Exámenes de laboratorio": "Hb 12,1", "Exámenes imagenológicos": "TC sin resangrado",
+    "Reposo": "Relativo", "Tromboprofilaxis farmacológica": "Sí", "Régimen nutricional": "Común",
+    "Hidratación": "No", "Equipo multidisciplinario": "Kinesiología", "Retiro sonda foley": "No",
+    "Retiro de CVC": "No", "Curación por enfermería": "Sí", "Instalación sonda nasogástrica": "No",
+    "Oxigenoterapia": "No", "Hemoglucotest": "No", "Precauciones": "Caídas", "Firma médico": "Dr. Prueba",
+    "Plan": "Control TC en 48 horas", "Antibiótico 1": "Cefazolina", "Fecha de inicio Antibiotico 1": "10-10-2026",
+    "Días de antibiótico 1": 7, "Antibiótico 2": "Ninguno",
+}
+
+
+def document_text(path):
+    with zipfile.ZipFile(path) as archive:
+        xml = archive.read("word/document.xml").decode("utf-8")
+    return xml.replace(' xml:space="preserve"', "")
+
+
+# create_word_document as pages/1_Registro_clínico.py had it before the compiled templates, kept unchanged as the
+# baseline: it builds the document with python-docx and saves it to the working directory
+def create_word_document(data):
+    doc = Document()
+    section = doc.sections[0]
+    section.page_height = Inches(11)
+    section.page_width = Inches(8.5)
+    section.left_margin = section.right_margin = Inches(0.5)
+    section.top_margin = section.bottom_margin = Inches(0.3)
+    section.orientation = WD_ORIENT.PORTRAIT
+
+    # Set default paragraph format
+    style = doc.styles['Normal']
+    style.font.name = 'Arial'
+    style.font.size = Pt(10)
+    style.paragraph_format.line_spacing_rule = WD_LINE_SPACING.ONE_POINT_FIVE
+    style.paragraph_format.space_after = Pt(0)
+
+    ## Add title
+    chile_tz = ZoneInfo("America/Santiago")  # Chile is in GMT-3
+    now = datetime.now(chile_tz)
+    current_time = now.strftime("%H:%M")
+    title = doc.add_paragraph("Evolución médica neurocirugía")
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title.runs[0].font.size = Pt(12)
+    title.runs[0].font.bold = True
+
+    subtitle = doc.add_paragraph(f"{data['Nombre']} , {data['Rut']} , fecha: {data['Fecha']},hora: {current_time}\n")
+    subtitle.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    subtitle.runs[0].font.size = Pt(12)
+
+    # Define sections and their corresponding fields
+    sections = {
+        "Información del Paciente": ["Sexo","Edad","Fecha de ingreso", "Días de hospitalización","Alergias","Domicilio"],
+        "Diagnóstico": ["Diagnostico", "Antecedentes mórbidos"],
+        "Comentario clínico": ["Anamnesis"],
+        "Evaluación clínica": ["Temperatura","Frecuencia cardíaca", "Presión arterial", "Saturación O2","Examen físico","Escala de Glasgow", "Hemiparesia","Paraparesia","Focalidad","Exámenes de laboratorio","Exámenes imagenológicos"],
+        "Tratamiento": ["Reposo", "Tromboprofilaxis farmacológica", "Régimen nutricional", "Hidratación","Equipo multidisciplinario"],
+        "Indicaciones enfermería": ["Retiro sonda foley", "Retiro de CVC", "Curación por enfermería", "Instalación sonda nasogástrica", "Oxigenoterapia", "Exámenes de laboratorio", "Hemoglucotest","Precauciones"],
+        "Firma médico": ["Firma médico"]
+    }
+
+    for section_title, fields in sections.items():
+        # Add section title
+        doc.add_paragraph().add_run(section_title).bold = True
+        if section_title == "Comentario clínico":
+            # Create a single-column table for anamnesis
+            anamnesis_table = doc.add_table(rows=1, cols=1)
+            anamnesis_table.style = 'Table Grid'
+            anamnesis_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+            anamnesis_table.columns[0].width = Inches(7.5)  # Full width of the page
+
+            anamnesis_cell = anamnesis_table.cell(0, 0)
+            p = anamnesis_cell.paragraphs[0]
+            p.add_run("Anamnesis: ").bold = True
+            p.add_run(data.get("Anamnesis", ""))
+
+            # Apply smaller font size to anamnesis table contents
+            for paragraph in anamnesis_cell.paragraphs:
+                for run in paragraph.runs:
+                    run.font.size = Pt(8)
+
+            # Add space after anamnesis table
+            doc.add_paragraph()
+            continue
+        # Create a 2-column table
+        table = doc.add_table(rows=1, cols=2)
+        table.style = 'Table Grid'
+        table.alignment = WD_TABLE_ALIGNMENT.CENTER
+
+        # Set column widths
+        table.columns[0].width = Inches(3.75)
+        table.columns[1].width = Inches(3.75)
+
+        row_cells = table.rows[0].cells
+
+        for i, field in enumerate(fields):
+
+            if i % 2 == 0 and i > 0:
+                # Add a new row for every two fields
+                row_cells = table.add_row().cells
+
+            cell = row_cells[i % 2]
+            p = cell.paragraphs[0]
+            p.add_run(f"{field}: ").bold = True
+            if field in data:
+                # Format the admission date without time
+                if field == "Fecha de ingreso":
+                    admission_date = data[field]
+                    if isinstance(admission_date, str):
+                        try:
+                            admission_date = datetime.strptime(admission_date, "%d-%m-%Y")
+                        except ValueError:
+                            # If parsing fails, it might already be a datetime object
+                            pass
+                    p.add_run(admission_date.strftime("%d-%m-%Y"))
+                else:
+                    p.add_run(str(data[field]))
+        # Apply smaller font size to table contents
+        for row in table.rows:
+            for cell in row.cells:
+                for paragraph in cell.paragraphs:
+                    for run in paragraph.runs:
+                        run.font.size = Pt(8)
+
+        # Add space after table
+        doc.add_paragraph()
+        # For Información del Paciente, add an additional row for medications
+        if section_title == "Información del Paciente":
+            row_cells = table.add_row().cells
+
+            # First column: Medicamentos
+            cell_med = row_cells[0]
+            p_med = cell_med.paragraphs[0]
+            run = p_med.add_run("Medicamentos crónicos: ")
+            run.bold = True
+            run.font.size = Pt(8)
+            p_med.add_run(data.get('Medicamentos', 'No registrados')).font.size = Pt(8)
+
+            # Second column: Antiagregantes and Anticoagulantes
+            cell_anti = row_cells[1]
+            p_anti = cell_anti.paragraphs[0]
+
+            run = p_anti.add_run("Antiagregantes plaquetarios: ")
+            run.bold = True
+            run.font.size = Pt(8)
+            p_anti.add_run(f"{data.get('Antiagregantes plaquetarios', 'No')}").font.size = Pt(8)
+
+            p_anti.add_run("\n")  # Add a newline between antiagregantes and anticoagulantes
+
+            run = p_anti.add_run("Anticoagulantes: ")
+            run.bold = True
+            run.font.size = Pt(8)
+            p_anti.add_run(f"{data.get('Anticoagulantes', 'No')}").font.size = Pt(8)
+
+            # Remove extra space after the paragraphs
+            p_med.paragraph_format.space_after = Pt(0)
+            p_anti.paragraph_format.space_after = Pt(0)
+
+            # Apply smaller font size to table contents
+        for row in table.rows:
+            for cell in row.cells:
+                for paragraph in cell.paragraphs:
+                    for run in paragraph.runs:
+                        run.font.size = Pt(8)
+                    # Remove extra space after each paragraph in the table
+                    paragraph.paragraph_format.space_after = Pt(0)
+        if section_title == "Evolución clínica":
+            doc.add_paragraph().add_run("Anamnesis").bold = True
+            anamnesis_table = doc.add_table(rows=1, cols=1)
+            anamnesis_table.style = 'Table Grid'
+            anamnesis_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+            anamnesis_table.columns[0].width = Inches(7.5)  # Full width of the page
+
+            anamnesis_cell = anamnesis_table.cell(0, 0)
+            anamnesis_paragraph = anamnesis_cell.paragraphs[0]
+            anamnesis_paragraph.add_run(data.get("Anamnesis", ""))
+
+            # Apply smaller font size to anamnesis table contents
+            for paragraph in anamnesis_cell.paragraphs:
+                for run in paragraph.runs:
+                    run.font.size = Pt(8)
+
+            # Add space after anamnesis table
+            doc.add_paragraph()
+            # Add Exámenes section
+            doc.add_paragraph().add_run("Exámenes").bold = True
+
+            # Add Exámenes de laboratorio
+            if data.get("Exámenes de laboratorio"):
+                doc.add_paragraph().add_run("Exámenes de laboratorio:").bold = True
+                doc.add_paragraph(data["Exámenes de laboratorio"])
+
+            # Add Exámenes imagenológicos
+            if data.get("Exámenes imagenológicos"):
+                doc.add_paragraph().add_run("Exámenes imagenológicos:").bold = True
+                doc.add_paragraph(data["Exámenes imagenológicos"])
+
+            doc.add_paragraph()  # Add space after Exámenes section
+
+        # Add separate table for Plan after the Tratamiento section
+        if section_title == "Tratamiento":
+            doc.add_paragraph().add_run("Plan").bold = True
+            plan_table = doc.add_table(rows=1, cols=1)
+            plan_table.style = 'Table Grid'
+            plan_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+            plan_table.columns[0].width = Inches(7.5)  # Full width of the page
+
+            plan_cell = plan_table.cell(0, 0)
+            plan_paragraph = plan_cell.paragraphs[0]
+            plan_paragraph.add_run(data.get("Plan", ""))
+
+            # Apply smaller font size to plan table contents
+            for paragraph in plan_cell.paragraphs:
+                for run in paragraph.runs:
+                    run.font.size = Pt(8)
+
+            # Add space after plan table
+            doc.add_paragraph()
+            # Add antibiotic information only if it's present
+            if data.get("Antibiótico 1") != "Ninguno" or data.get("Antibiótico 2") != "Ninguno":
+                doc.add_paragraph().add_run("Antibióticos").bold = True
+                atb_table = doc.add_table(rows=1, cols=2)
+                atb_table.style = 'Table Grid'
+                atb_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+                atb_table.columns[0].width = Inches(3.75)
+                atb_table.columns[1].width = Inches(3.75)
+
+                row_cells = atb_table.rows[0].cells
+
+                # Antibiótico 1
+                if data.get("Antibiótico 1") != "Ninguno":
+                    cell = row_cells[0]
+                    p = cell.paragraphs[0]
+                    p.add_run("Antibiótico 1: ").bold = True
+                    p.add_run(f"{data.get('Antibiótico 1', '')}")
+                    p.add_run("\nFecha de inicio: ").bold = True
+                    p.add_run(f"{data.get('Fecha de inicio Antibiotico 1', '')}")
+                    p.add_run("\nDías de tratamiento: ").bold = True
+                    p.add_run(f"{data.get('Días de antibiótico 1', '')}")
+
+                # Antibiótico 2
+                if data.get("Antibiótico 2") != "Ninguno":
+                    cell = row_cells[1] if data.get("Antibiótico 1") != "Ninguno" else row_cells[0]
+                    p = cell.paragraphs[0]
+                    p.add_run("Antibiótico 2: ").bold = True
+                    p.add_run(f"{data.get('Antibiótico 2', '')}")
+                    p.add_run("\nFecha de inicio: ").bold = True
+                    p.add_run(f"{data.get('Fecha de inicio Antibiotico 2', '')}")
+                    p.add_run("\nDías de tratamiento: ").bold = True
+                    p.add_run(f"{data.get('Días de antibiótico 2', '')}")
+
+                # Apply smaller font size to antibiotic table contents
+                for row in atb_table.rows:
+                    for cell in row.cells:
+                        for paragraph in cell.paragraphs:
+                            for run in paragraph.runs:
+                                run.font.size = Pt(6)
+
+                # Add space after antibiotic table
+                doc.add_paragraph()
+
+    footer = section.footer
+    footer_paragraph = footer.paragraphs[0]
+    footer_text = f"Unidad de neurocirugía, Hospital de Curicó"
+    footer_paragraph.text = footer_text
+    footer_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    footer_run = footer_paragraph.runs[0]
+    footer_run.font.size = Pt(6)
+    footer_run.font.name = 'Arial'
+    # Create a filename-safe version of the patient's name
+    safe_name = re.sub(r'[^\w\-_\. ]', '_', data['Nombre'])
+    safe_name = safe_name.replace(' ', '_')
+    filename = f"{safe_name}_{datetime.now().strftime('%d%m%Y_%H%M')}.docx"
+    doc.save(filename)
+    return filename
+
+
+def template_report(record):
+    filename = report_templates.evolution_report_filename(record)
+    with open(filename, "wb") as f:
+        f.write(report_templates.render_evolution_report(record))
+    return filename
+
+
+def reports_per_second(render, record, reports):
+    start = time.perf_counter()
+    for _ in range(reports):
+        render(record)
+    return reports / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--reports", type=int, default=200, help="Reports generated by each method")
+    args = parser.parse_args()
+
+    # Both methods write their reports to files, as the app does; they go to a scratch directory
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        start = time.perf_counter()
+        report_templates.render_evolution_report(SAMPLE_RECORD)
+        print(f"Compiling the template: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        original = document_text(create_word_document(SAMPLE_RECORD))
+        if original != document_text(template_report(SAMPLE_RECORD)):
+            print("Warning: the template output differs from the original python-docx document")
+
+        legacy = reports_per_second(create_word_document, SAMPLE_RECORD, args.reports)
+        template = reports_per_second(template_report, SAMPLE_RECORD, args.reports)
+    print(f"python-docx: {legacy:8.1f} reports/s")
+    print(f"template:    {template:8.1f} reports/s ({template / legacy:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+A stand-in for the Ollama embedding endpoints, for testing and benchmarking the Asistente offline.
+
+Answers /api/embed and /api/embeddings with deterministic vectors derived from each text, after a configurable
+latency per request and per text, and fails a fraction of requests with 503 to exercise retries.
+
+    python tools/stub_embedding_server.py [--port 11435] [--latency-ms 50] [--per-text-ms 2] [--fail-rate 0.05]
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+DIMENSIONS = 768
+
+
+def stub_embedding(text, dimensions=DIMENSIONS):
+    """A unit vector seeded by the text, so equal texts always get equal embeddings."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class StubEmbeddingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+        if random.random() < server.fail_rate:
+            self._reply(503, {"error": "stub overloaded"})
+            return
+        if self.path == "/api/embed":
+            texts = body.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+        elif self.path == "/api/embeddings":
+            texts = [body.get("prompt", "")]
+        else:
+            self._reply(404, {"error": "not found"})
+            return
+        time.sleep(server.latency + server.per_text * len(texts))
+        with server.stats_lock:
+            server.texts += len(texts)
+        embeddings = [stub_embedding(text, server.dimensions) for text in texts]
+        if self.path == "/api/embed":
+            self._reply(200, {"model": body.get("model"), "embeddings": embeddings})
+        else:
+            self._reply(200, {"embedding": embeddings[0]})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, latency_ms=50, per_text_ms=2, fail_rate=0.0, dimensions=DIMENSIONS):
+    """
+    Serve in a background thread.
+
+    :param port: Port to listen on; 0 picks a free one
+    :return: The server; its URL is f"http://127.0.0.1:{server.server_port}", stop it with shutdown()
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubEmbeddingHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000
+    server.per_text = per_text_ms / 1000
+    server.fail_rate = fail_rate
+    server.dimensions = dimensions
+    server.stats_lock = threading.Lock()
+    server.requests = 0
+    server.texts = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=11435, help="Port to listen on")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Latency of every request")
+    parser.add_argument("--per-text-ms", type=float, default=2, help="Additional latency per text embedded")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--dimensions", type=int, default=DIMENSIONS, help="Length of the embeddings")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency_ms, args.per_text_ms, args.fail_rate, args.dimensions)
+    print(f"Stub embedding server on http://127.0.0.1:{server.server_port} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import json
+import os
+
+import numpy as np
+
+# Above this many vectors searches go through an inverted-file (IVF) index instead of scanning every vector
+IVF_THRESHOLD = 50_000
+# Clusters of the IVF index searched per query; more is slower but misses fewer neighbours
+IVF_PROBES = 8
+# The IVF clusters are retrained once the index has grown to this many times the size they were trained on
+IVF_RETRAIN_GROWTH = 2.0
+
+VECTORS_FILE = "vectors.npy"
+META_FILE = "index.json"
+IVF_FILE = "ivf.npz"
+
+
+def normalize(vectors):
+    """Rows scaled to unit length as a contiguous float32 matrix, so dot products are cosine similarities."""
+    vectors = np.ascontiguousarray(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first, without sorting every score."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Spherical k-means: cluster centres of unit vectors by cosine similarity."""
+    rng = np.random.default_rng(seed)
+    # Training on a sample keeps building the index fast; 256 points per cluster are plenty
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), 256 * n_clusters), replace=False)]
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = ~sums.any(axis=1)
+        # Empty clusters restart from a random point
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class VectorIndex:
+    """
+    Texts and their embeddings for similarity search.
+
+    Vectors are kept normalized in one float32 matrix that grows as documents are added. Small indexes are
+    searched exactly; once they pass IVF_THRESHOLD vectors they are clustered and a query only scans the vectors
+    of the clusters closest to it.
+    """
+
+    def __init__(self, dim=None, ivf_threshold=IVF_THRESHOLD):
+        self.dim = dim
+        self.ivf_threshold = ivf_threshold
+        self.texts = []
+        self.metadata = []
+        self._vectors = np.empty((0, dim or 0), dtype=np.float32)
+        self._size = 0
+        self.centroids = None
+        self._lists = []
+        self._trained_size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vectors(self):
+        return self._vectors[:self._size]
+
+    def add(self, texts, vectors, metadata=None):
+        """
+        Add texts with their embeddings.
+
+        :param metadata: Optional list with a JSON-serializable dictionary per text
+        :return: Positions of the added texts
+        """
+        if len(texts) == 0:
+            return np.empty(0, dtype=np.int64)
+        vectors = normalize(vectors)
+        if len(vectors) != len(texts):
+            raise ValueError("Se requiere un vector por texto")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._vectors = np.empty((0, self.dim), dtype=np.float32)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Los vectores tienen dimensión {vectors.shape[1]}, el índice {self.dim}")
+
+        start, stop = self._size, self._size + len(vectors)
+        if stop > len(self._vectors):
+            # Grow geometrically so adding documents one by one stays linear overall
+            grown = np.empty((max(stop, 2 * len(self._vectors), 1024), self.dim), dtype=np.float32)
+            grown[:start] = self._vectors[:start]
+            self._vectors = grown
+        self._vectors[start:stop] = vectors
+        self._size = stop
+        self.texts.extend(texts)
+        self.metadata.extend(metadata if metadata is not None else [{} for _ in texts])
+
+        positions = np.arange(start, stop)
+        if self.centroids is not None and self._size < IVF_RETRAIN_GROWTH * self._trained_size:
+            self._assign(positions)
+        elif self._size >= self.ivf_threshold:
+            self.build_ivf()
+        return positions
+
+    def build_ivf(self, n_clusters=None):
+        """Cluster the vectors; by default into about the square root of their number of clusters."""
+        if n_clusters is None:
+            n_clusters = int(np.sqrt(self._size))
+        n_clusters = max(1, min(n_clusters, self._size))
+        self.centroids = _kmeans(self.vectors, n_clusters)
+        self._lists = [np.empty(0, dtype=np.int64) for _ in range(n_clusters)]
+        self._trained_size = self._size
+        self._assign(np.arange(self._size))
+
+    def _assign(self, positions):
+        assignment = np.argmax(self._vectors[positions] @ self.centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        clusters, starts = np.unique(assignment[order], return_index=True)
+        for cluster, members in zip(clusters, np.split(positions[order], starts[1:])):
+            self._lists[cluster] = np.concatenate([self._lists[cluster], members])
+
+    def search(self, query_vector, k=3, probes=IVF_PROBES, where=None):
+        """
+        Positions and cosine similarities of the k texts most similar to the query, best first.
+
+        :param probes: Clusters scanned when the index is clustered
+        :param where: Optional array of positions to restrict the search to
+        """
+        if self._size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = normalize(query_vector)[0]
+        if where is not None:
+            candidates = np.asarray(where, dtype=np.int64)
+        elif self.centroids is not None:
+            closest = top_k(self.centroids @ query, probes)
+            candidates = np.concatenate([self._lists[cluster] for cluster in closest])
+        else:
+            candidates = None
+        if candidates is None:
+            scores = self.vectors @ query
+            best = top_k(scores, k)
+            return best, scores[best]
+        scores = self._vectors[candidates] @ query
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    def search_texts(self, query_vector, k=3, **kwargs):
+        """The k texts most similar to the query, best first."""
+        positions, _ = self.search(query_vector, k, **kwargs)
+        return [self.texts[i] for i in positions]
+
+    def save(self, directory):
+        """Write the index to a directory, replacing each file atomically."""
+        os.makedirs(directory, exist_ok=True)
+        _write_atomic(os.path.join(directory, VECTORS_FILE), lambda f: np.save(f, self.vectors))
+        if self.centroids is not None:
+            lists = np.concatenate(self._lists) if self._lists else np.empty(0, dtype=np.int64)
+            offsets = np.cumsum([0] + [len(members) for members in self._lists])
+            _write_atomic(os.path.join(directory, IVF_FILE),
+                          lambda f: np.savez(f, centroids=self.centroids, lists=lists, offsets=offsets))
+        elif os.path.exists(os.path.join(directory, IVF_FILE)):
+            os.remove(os.path.join(directory, IVF_FILE))
+        meta = {"dim": self.dim, "size": self._size, "trained_size": self._trained_size,
+                "ivf_threshold": self.ivf_threshold, "texts": self.texts, "metadata": self.metadata}
+        # Written last: an index whose size does not match its vectors is treated as missing
+        _write_atomic(os.path.join(directory, META_FILE),
+                      lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode("utf-8")))
+
+    @classmethod
+    def load(cls, directory):
+        """Read an index written by save, or return None if there is none."""
+        try:
+            with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+            vectors = np.load(os.path.join(directory, VECTORS_FILE))
+        except (FileNotFoundError, ValueError):
+            return None
+        if len(vectors) != meta["size"]:
+            return None
+        index = cls(meta["dim"], meta["ivf_threshold"])
+        index._vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        index._size = meta["size"]
+        index.texts = meta["texts"]
+        index.metadata = meta["metadata"]
+        ivf_path = os.path.join(directory, IVF_FILE)
+        if meta["trained_size"] and os.path.exists(ivf_path):
+            with np.load(ivf_path) as ivf:
+                index.centroids = ivf["centroids"]
+                index._lists = np.split(ivf["lists"], ivf["offsets"][1:-1])
+            index._trained_size = meta["trained_size"]
+        return index
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,77 @@
+import atexit
+import threading
+
+import patient_store
+from rut import rut_key
+
+# Seconds without new edits before pending changes are written on their own
+FLUSH_DELAY = 2.0
+
+_pending = {}
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_timer = None
+
+
+def _schedule_flush():
+    global _timer
+    if _timer is not None:
+        _timer.cancel()
+    _timer = threading.Timer(FLUSH_DELAY, _flush_in_background)
+    _timer.daemon = True
+    _timer.start()
+
+
+def _flush_in_background():
+    try:
+        flush()
+    except Exception as e:
+        # The edits stay queued and are retried on the next flush
+        print(f"Error writing pending patient updates: {e}")
+
+
+def queue_update(rut, fields):
+    """
+    Queue a field change for a patient instead of writing it right away.
+
+    Edits of the same patient are coalesced, the latest value of each field wins. Everything queued is
+    written in one batch by flush(), or automatically once no edit arrived for FLUSH_DELAY seconds.
+    """
+    with _lock:
+        _pending.setdefault(rut_key(rut), {}).update(fields)
+        _schedule_flush()
+
+
+def pending_updates():
+    with _lock:
+        return {key: dict(fields) for key, fields in _pending.items()}
+
+
+def flush():
+    """
+    Durably write every queued change in a single batch.
+
+    :return: The number of patients written
+    """
+    global _timer
+    with _flush_lock:
+        with _lock:
+            batch = dict(_pending)
+            _pending.clear()
+            if _timer is not None:
+                _timer.cancel()
+                _timer = None
+        if not batch:
+            return 0
+        try:
+            patient_store.update_patients(batch)
+        except Exception:
+            with _lock:
+                # Put the batch back, without overriding edits queued while it was being written
+                for key, fields in batch.items():
+                    _pending[key] = {**fields, **_pending.get(key, {})}
+            raise
+        return len(batch)
+
+
+atexit.register(flush)